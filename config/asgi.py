@@ -3,6 +3,11 @@ ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The notification stream (``notifications/stream/``) pushes new notifications
+over Server-Sent Events only when the project is served through this entry
+point, e.g. ``uvicorn config.asgi:application``. Under WSGI the browser keeps
+polling ``notifications/get/`` instead.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
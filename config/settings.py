@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,6 +58,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -71,6 +73,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'core.context_processors.navigation',
             ],
         },
     },
@@ -100,6 +103,28 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# ===== کش مشترک بین پروسه‌ها (برای گراف‌های فرایند و نسخه‌های آن‌ها) =====
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'django_cache'),
+    }
+}
+
+# ===== تنظیمات صف رندر گراف (Graphviz) =====
+GRAPH_RENDER_MAX_WORKERS = 2      # حداکثر تعداد پروسه‌های هم‌زمان dot در هر پروسه وب
+GRAPH_RENDER_QUEUE_SIZE = 8       # تعداد کارهای منتظر؛ بیش از آن درخواست رد می‌شود
+GRAPH_RENDER_TIMEOUT = 10         # مهلت اجرای هر رندر (ثانیه)؛ پس از آن پروسه dot کشته می‌شود
+GRAPH_RENDER_WAIT_TIMEOUT = 5     # حداکثر زمان انتظار یک درخواست برای نتیجه رندر (ثانیه)
+GRAPH_RENDER_FAILURE_TTL = 60     # مدتی که رندر ناموفق یک گراف تکرار نمی‌شود و پیام «در دسترس نیست» نمایش داده می‌شود (ثانیه)
+
+# فاصله بررسی نسخه تعریف کامپایل‌شده فرایندها در هر پروسه (ثانیه)؛ پروسه‌های دیگر تغییر مراحل یا
+# مسئولان را حداکثر با این تأخیر می‌بینند و در این فاصله انتقال‌ها ممکن است با مهلت قبلی محاسبه شوند
+PROCESS_DEFINITION_TTL = 5
+
+# فاصله ارسال پیام keep-alive در جریان SSE اعلان‌ها (ثانیه)
+NOTIFICATION_STREAM_HEARTBEAT = 20
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'core.User'
 LOGIN_URL = 'login'
@@ -111,5 +136,45 @@ EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+EMAIL_TIMEOUT = 30                # مهلت اتصال/ارسال SMTP (ثانیه)
+
+# آدرس پایه سایت برای ساخت لینک در ایمیل‌هایی که بیرون از درخواست وب ساخته می‌شوند (مانند یادآوری‌ها)
+SITE_URL = 'https://your-domain.com'
+REMINDER_THROTTLE_HOURS = 24      # فاصله مجاز بین دو یادآوری برای یک درخواست و یک گیرنده
+REMINDER_ESCALATION_HOURS = 48    # پس از این مدت از سررسید، وظیفه معوق به مدیر مسئول اطلاع داده می‌شود
+
+# ===== تنظیمات صف خروجی ایمیل (دستور send_outbox) =====
+EMAIL_OUTBOX_BATCH_SIZE = 100     # تعداد ایمیل‌های ارسالی روی هر اتصال SMTP
+EMAIL_OUTBOX_MAX_ATTEMPTS = 8     # پس از این تعداد تلاش ناموفق، ایمیل «ناموفق» علامت می‌خورد
+EMAIL_OUTBOX_RETRY_BASE = 60      # تأخیر اولین تلاش مجدد (ثانیه)؛ هر بار دو برابر می‌شود
+EMAIL_OUTBOX_RETRY_MAX = 6 * 60 * 60  # سقف تأخیر بین تلاش‌ها (ثانیه)
+EMAIL_OUTBOX_LEASE = 300          # مدت رزرو یک دسته توسط هر پردازشگر (ثانیه)
+
+# ===== تنظیمات متریک‌های عملکرد (endpoint /metrics در قالب Prometheus) =====
+# فایل متریک هر پروسه؛ فایل پروسه‌های خاتمه‌یافته در metrics-archive.json ادغام می‌شود.
+# باید روی دیسک محلی همان سرور باشد (زنده بودن پروسه‌ها از روی pid بررسی می‌شود)
+METRICS_DIR = os.path.join(BASE_DIR, 'metrics')
+METRICS_FLUSH_INTERVAL = 1        # حداکثر فاصله نوشتن متریک‌های هر پروسه در فایل (ثانیه)
+METRICS_TOKEN = secrets.get('METRICS_TOKEN')  # اسکرپر باید هدر Authorization: Bearer <token> بفرستد؛ ادمین‌ها همیشه دسترسی دارند
+# اختیاری: آدرس‌هایی که بدون توکن دسترسی دارند. پشت reverse proxy محلی همه درخواست‌ها از 127.0.0.1
+# می‌آیند، پس فقط وقتی اسکرپر مستقیم (بدون proxy) به برنامه وصل می‌شود آدرس آن را اضافه کنید
+METRICS_ALLOWED_IPS = []
+
+# ===== پروفایل نمونه‌برداری درخواست‌های کند (ProfilingMiddleware؛ فهرست در ادمین) =====
+PROFILING_ENABLED = False         # با False میان‌افزار کاملاً از زنجیره حذف می‌شود
+PROFILING_SAMPLE_RATE = 0.0       # کسری از درخواست‌ها که به صورت تصادفی پروفایل می‌شوند (مثلاً 0.01)
+PROFILING_SLOW_THRESHOLD = 2.0    # درخواست‌های کندتر از این (ثانیه) ثبت می‌شوند؛ None برای غیرفعال کردن
+PROFILING_INTERVAL = 0.01         # فاصله نمونه‌برداری از پشته (ثانیه)
+PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')  # خارج از MEDIA_ROOT تا فایل‌ها عمومی نباشند
+PROFILING_RETENTION_DAYS = 7
+PROFILING_MAX_CAPTURES = 200
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# ===== بارگذاری تکه‌ای پیوست‌ها (core/uploads.py) =====
+# فایل‌های بزرگ در تکه‌های هم‌اندازه و جدا از فرم اقدام بارگذاری می‌شوند؛ هر تکه مستقیماً روی
+# دیسک نوشته می‌شود و پس از قطع اتصال، بارگذاری از آخرین offset ثبت‌شده ادامه می‌یابد.
+ATTACHMENT_CHUNK_SIZE = 1024 * 1024        # اندازه هر تکه (بایت)
+ATTACHMENT_MAX_SIZE = 512 * 1024 * 1024    # حداکثر حجم هر پیوست (بایت)
+# روی همان دیسکِ MEDIA_ROOT باشد تا فایل کامل‌شده به جای کپی، فقط جابه‌جا (rename) شود
+UPLOAD_TEMP_DIR = os.path.join(BASE_DIR, 'uploads_tmp')
+UPLOAD_SESSION_TTL_HOURS = 24              # بارگذاری‌های نیمه‌کاره یا استفاده‌نشده پس از این مدت حذف می‌شوند
@@ -2,11 +2,19 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 # ===== مدل جدید را ایمپورت کنید =====
-from .models import User, Process, ProcessStep, Request, RequestHistory, Notification
-from django.urls import path
-from django.shortcuts import render
-from .utils import generate_process_graph, generate_org_chart_graph
-from django.utils.html import format_html
+from .models import User, Process, ProcessStep, Request, RequestHistory, Notification, OutgoingEmail, ProfileCapture
+from django.urls import path, reverse
+from django.shortcuts import get_object_or_404, render
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse, JsonResponse
+from .utils import (
+    generate_process_graph, org_chart_graph_error, get_org_chart_svg, GraphRenderBusy, GraphRenderPending,
+    get_org_chart_levels, get_org_subordinates, ORG_CHART_INITIAL_DEPTH,
+)
+from django.utils.html import format_html, format_html_join
+from .due_dates import recompute_due_dates
+from .profiling import load_capture, top_functions
+from django.utils import timezone
 from jalali_date.widgets import AdminSplitJalaliDateTime
 from django.db import models# ===== تغییر نهایی و صحیح: ایمپورت کردن ویجت درست برای تاریخ و زمان =====
 from jalali_date.widgets import AdminSplitJalaliDateTime
@@ -43,11 +51,35 @@ class ProcessAdmin(admin.ModelAdmin):
             extra_context['process_graph_svg'] = "ابتدا مراحل فرایند را ذخیره کنید تا گراف نمایش داده شود."
         return super().change_view(request, object_id, form_url, extra_context=extra_context)
 
+    def save_formset(self, request, form, formset, change):
+        super().save_formset(request, form, formset, change)
+        # مراحل معمولاً همین‌جا (inline) ویرایش می‌شوند؛ مانند ProcessStepAdmin.save_model سررسیدها به‌روز می‌شوند
+        step_ids = [step.id for step, fields in getattr(formset, 'changed_objects', []) if 'deadline_days' in fields]
+        if step_ids:
+            stats = recompute_due_dates(step_ids=step_ids)
+            self.message_user(request, f"سررسید {stats['updated']} درخواست باز در مراحل تغییرکرده به‌روز شد.")
+
 @admin.register(ProcessStep)
 class ProcessStepAdmin(admin.ModelAdmin):
     
     list_display = ('process', 'name', 'step_order', 'responsible_unit', 'default_responsible_user', 'deadline_days')
     list_filter = ('process', 'responsible_unit')
+    # select_related خودکار جنگو کلیدهای خارجی nullable را دنبال نمی‌کند
+    list_select_related = ('process', 'default_responsible_user')
+    actions = ['recompute_due_dates_action']
+
+    @admin.action(description="محاسبه مجدد سررسید درخواست‌های باز این مراحل")
+    def recompute_due_dates_action(self, request, queryset):
+        stats = recompute_due_dates(step_ids=list(queryset.values_list('id', flat=True)))
+        self.message_user(request, f"سررسید {stats['updated']} درخواست از {stats['scanned']} درخواست باز به‌روز شد.")
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # با تغییر مهلت مرحله، سررسید درخواست‌هایی که اکنون در این مرحله‌اند هم به‌روز می‌شود
+        if change and 'deadline_days' in form.changed_data:
+            stats = recompute_due_dates(step_ids=[obj.id])
+            self.message_user(request, f"سررسید {stats['updated']} درخواست باز در این مرحله به‌روز شد.")
+
     def get_fieldsets(self, request, obj=None):
         fieldsets = super().get_fieldsets(request, obj)
         ProcessStep._meta.get_field('default_responsible_user').help_text = \
@@ -66,19 +98,45 @@ class CustomUserAdmin(UserAdmin):
         urls = super().get_urls()
         custom_urls = [
             path('org-chart/', self.admin_site.admin_view(self.org_chart_view), name='user_org_chart'),
+            path('org-chart/svg/', self.admin_site.admin_view(self.org_chart_svg_view), name='user_org_chart_svg'),
+            path('org-chart/tree/', self.admin_site.admin_view(self.org_chart_tree_view), name='user_org_chart_tree'),
+            path('org-chart/children/<int:user_id>/', self.admin_site.admin_view(self.org_chart_children_view), name='user_org_chart_children'),
         ]
         return custom_urls + urls
 
     def org_chart_view(self, request):
-        root_users = User.objects.filter(manager__isnull=True).prefetch_related('subordinates')
-        org_chart_svg = generate_org_chart_graph(root_users)
+        # صفحه بلافاصله نمایش داده می‌شود و گراف از org_chart_svg_view دریافت می‌شود
         context = dict(
            self.admin_site.each_context(request),
            title="چارت سازمانی",
-           org_chart_svg=org_chart_svg,
         )
         return render(request, "admin/org_chart.html", context)
 
+    def org_chart_svg_view(self, request):
+        try:
+            org_chart_svg = get_org_chart_svg()
+        except GraphRenderPending:
+            return HttpResponse(status=202, headers={'Retry-After': '2'})
+        except GraphRenderBusy:
+            return HttpResponse(status=503, headers={'Retry-After': '5'})
+        except Exception as e:
+            org_chart_svg = org_chart_graph_error(e)
+        return HttpResponse(org_chart_svg, content_type='text/html; charset=utf-8')
+
+    def org_chart_tree_view(self, request):
+        """نمایش درختی چارت سازمانی؛ فقط چند سطح اول بارگذاری و بقیه با کلیک باز می‌شوند."""
+        depth = request.GET.get('depth', '')
+        depth = int(depth) if depth.isdigit() and int(depth) > 0 else ORG_CHART_INITIAL_DEPTH
+        context = dict(
+           self.admin_site.each_context(request),
+           title="چارت سازمانی",
+           nodes=get_org_chart_levels(min(depth, 5)),
+        )
+        return render(request, "admin/org_chart_tree.html", context)
+
+    def org_chart_children_view(self, request, user_id):
+        return JsonResponse({'subordinates': get_org_subordinates(user_id)})
+
     def changelist_view(self, request, extra_context=None):
         extra_context = extra_context or {}
         extra_context['show_org_chart_button'] = True
@@ -88,6 +146,68 @@ class CustomUserAdmin(UserAdmin):
 class RequestHistoryAdmin(JalaliModelAdmin):
     list_display = ('request', 'step', 'action_user', 'action_type', 'timestamp')
     list_filter = ('action_type',)
+    # نمایش درخواست و مرحله به نام فرایند و ثبت‌کننده نیاز دارد (__str__ مدل‌ها)
+    list_select_related = ('request__process', 'request__initiator_user', 'step__process', 'action_user')
+
+@admin.register(ProfileCapture)
+class ProfileCaptureAdmin(JalaliModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'view_name', 'status_code', 'duration_ms', 'query_count', 'query_ms', 'reason', 'user')
+    list_filter = ('reason', 'view_name', 'status_code')
+    list_select_related = ('user',)
+    search_fields = ('path',)
+    fields = readonly_fields = (
+        'created_at', 'reason', 'method', 'path', 'view_name', 'status_code', 'user', 'duration_ms',
+        'query_count', 'query_ms', 'sample_count', 'folded_stacks_link', 'hot_frames', 'sql_log',
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path('<int:capture_id>/folded/', self.admin_site.admin_view(self.folded_stacks_view), name='core_profilecapture_folded'),
+        ]
+        return custom_urls + urls
+
+    def folded_stacks_view(self, request, capture_id):
+        """پشته‌های تاشده به صورت متن، قابل استفاده در flamegraph.pl یا speedscope."""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        # پروفایل‌های قدیمی با هر ذخیره حذف می‌شوند؛ لینک‌های کهنه 404 می‌گیرند
+        data = load_capture(get_object_or_404(ProfileCapture, id=capture_id)) or {}
+        lines = (f"{stack} {count}" for stack, count in data.get('samples', {}).items())
+        response = HttpResponse('\n'.join(lines), content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="profile-{capture_id}.folded"'
+        return response
+
+    @admin.display(description="فایل flamegraph")
+    def folded_stacks_link(self, obj):
+        return format_html('<a href="{}">دانلود پشته‌های تاشده</a>', reverse('admin:core_profilecapture_folded', args=[obj.id]))
+
+    @admin.display(description="پرهزینه‌ترین توابع (تعداد نمونه)")
+    def hot_frames(self, obj):
+        data = load_capture(obj)
+        if data is None:
+            return "فایل پروفایل در دسترس نیست."
+        rows = format_html_join(
+            '', '<tr><td dir="ltr">{}</td><td>{}</td><td>{}</td></tr>', top_functions(data.get('samples', {})),
+        )
+        return format_html('<table><tr><th>تابع</th><th>خود تابع</th><th>شامل فراخوانی‌ها</th></tr>{}</table>', rows)
+
+    @admin.display(description="لاگ SQL")
+    def sql_log(self, obj):
+        data = load_capture(obj)
+        if data is None:
+            return "فایل پروفایل در دسترس نیست."
+        rows = format_html_join(
+            '', '<tr><td>{}</td><td dir="ltr"><code>{}</code></td></tr>',
+            ((query['ms'], query['sql']) for query in data.get('queries', [])),
+        )
+        return format_html('<table><tr><th>میلی‌ثانیه</th><th>کوئری</th></tr>{}</table>', rows)
 
 # ===== مدل جدید را در ادمین رجیستر کنید =====
 @admin.register(Notification)
@@ -95,4 +215,16 @@ class NotificationAdmin(JalaliModelAdmin):
     list_display = ('user', 'message', 'is_read', 'created_at')
     list_filter = ('is_read', 'user')
 
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(JalaliModelAdmin):
+    list_display = ('to_email', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to_email', 'subject')
+    actions = ['requeue_emails']
+
+    @admin.action(description="ارسال مجدد ایمیل‌های انتخاب‌شده")
+    def requeue_emails(self, request, queryset):
+        updated = queryset.exclude(status='SENT').update(status='PENDING', attempts=0, next_attempt_at=timezone.now(), lease_token=None)
+        self.message_user(request, f"{updated} ایمیل دوباره در صف ارسال قرار گرفت.")
+
 admin.site.register(User, CustomUserAdmin)
\ No newline at end of file
@@ -0,0 +1,245 @@
+# core/analytics.py
+
+import bisect
+from collections import defaultdict
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from .models import (
+    User, Request, RequestHistory, ProcessStep, StepDailyStats, UserDailyStats, AnalyticsWatermark,
+    DWELL_HISTOGRAM_BOUNDS,
+)
+from .process_definitions import get_process_definition
+
+# اقداماتی که درخواست را از مرحله فعلی خارج می‌کنند (نظرها در آمار حساب نمی‌شوند)
+TRANSITION_ACTIONS = ('APPROVED', 'REJECTED', 'RETURNED', 'RESUBMITTED')
+WATERMARK_NAME = 'sla'
+# ردیف‌های تازه‌تر از این مدت ممکن است هنوز در تراکنش باز باشند؛ در اجرای بعدی پردازش می‌شوند
+COMMIT_LAG = timedelta(seconds=60)
+
+def _is_recent(timestamp, cutoff):
+    # فقط ردیف‌های ثبت‌شده در چند ثانیه اخیر منتظر می‌مانند؛ زمان‌های آینده (داده وارداتی) پردازش می‌شوند
+    return cutoff <= timestamp <= cutoff + COMMIT_LAG
+
+def _dwell_bucket(seconds):
+    return bisect.bisect_left(DWELL_HISTOGRAM_BOUNDS, seconds / 3600)
+
+def _empty_histogram():
+    return [0] * (len(DWELL_HISTOGRAM_BOUNDS) + 1)
+
+class _Rollup:
+    """مقادیر افزایشی یک دسته، به تفکیک (مرحله، روز) و (کاربر، روز)."""
+
+    def __init__(self):
+        self.steps = defaultdict(lambda: {'arrivals': 0, 'completions': 0, 'breaches': 0, 'dwell_seconds': 0, 'dwell_histogram': _empty_histogram()})
+        self.users = defaultdict(lambda: {'completions': 0, 'breaches': 0, 'dwell_seconds': 0})
+
+    def arrive(self, step_id, at):
+        self.steps[(step_id, timezone.localdate(at))]['arrivals'] += 1
+
+    def complete(self, step_id, user_id, at, dwell_seconds, breached):
+        day = timezone.localdate(at)
+        step = self.steps[(step_id, day)]
+        step['completions'] += 1
+        step['dwell_seconds'] += dwell_seconds
+        step['breaches'] += breached
+        step['dwell_histogram'][_dwell_bucket(dwell_seconds)] += 1
+        user = self.users[(user_id, day)]
+        user['completions'] += 1
+        user['dwell_seconds'] += dwell_seconds
+        user['breaches'] += breached
+
+def _apply(model, owner_field, values):
+    """
+    مقادیر افزایشی را با مقادیر فعلی جمع می‌زند و همه ردیف‌ها را با یک upsert گروهی
+    (INSERT ... ON CONFLICT DO UPDATE) می‌نویسد.
+    """
+    if not values:
+        return
+    owner_ids = {owner_id for owner_id, _ in values}
+    days = {day for _, day in values}
+    fields = list(next(iter(values.values())))
+    existing = {
+        (row[owner_field], row['day']): row
+        for row in model.objects.filter(**{f'{owner_field}_id__in': owner_ids, 'day__in': days}).values(owner_field, 'day', *fields)
+    }
+    rows = []
+    for (owner_id, day), increments in values.items():
+        current = existing.get((owner_id, day), {})
+        merged = {}
+        for field, value in increments.items():
+            if field == 'dwell_histogram':
+                merged[field] = [a + b for a, b in zip(current.get(field) or _empty_histogram(), value)]
+            else:
+                merged[field] = current.get(field, 0) + value
+        rows.append(model(day=day, **{f'{owner_field}_id': owner_id}, **merged))
+    model.objects.bulk_create(
+        rows, batch_size=500, update_conflicts=True,
+        unique_fields=[owner_field, 'day'], update_fields=fields,
+    )
+
+def _collect_arrivals(rollup, watermark, cutoff, batch_size):
+    rows = list(
+        Request.objects.filter(id__gt=watermark.last_request_id).order_by('id')
+        .values_list('id', 'process_id', 'created_at')[:batch_size]
+    )
+    processed = 0
+    first_steps = {}
+    for request_id, process_id, created_at in rows:
+        if _is_recent(created_at, cutoff):
+            break
+        if process_id not in first_steps:
+            first_steps[process_id] = get_process_definition(process_id).first_step
+        first_step = first_steps[process_id]
+        if first_step:
+            rollup.arrive(first_step.id, created_at)
+        watermark.last_request_id = request_id
+        processed += 1
+    return processed, len(rows) == batch_size and processed == len(rows)
+
+def _collect_transitions(rollup, watermark, cutoff, batch_size):
+    rows = list(
+        RequestHistory.objects.filter(id__gt=watermark.last_history_id, action_type__in=TRANSITION_ACTIONS).order_by('id')
+        .values_list('id', 'request_id', 'step_id', 'to_step_id', 'action_user_id', 'action_type', 'timestamp')[:batch_size]
+    )
+    has_more = len(rows) == batch_size
+    ready = []
+    for row in rows:
+        if _is_recent(row[6], cutoff):
+            has_more = False
+            break
+        ready.append(row)
+    if not ready:
+        return 0, False
+
+    # زمان ورود به هر مرحله = اقدام انتقالی قبلی همان درخواست (یا زمان ثبت)؛ فقط تاریخچه همین درخواست‌ها خوانده می‌شود
+    request_ids = {row[1] for row in ready}
+    timelines = defaultdict(list)
+    for request_id, history_id, step_id, timestamp in (
+        RequestHistory.objects.filter(request_id__in=request_ids, action_type__in=TRANSITION_ACTIONS)
+        .order_by('request_id', 'id').values_list('request_id', 'id', 'step_id', 'timestamp')
+    ):
+        timelines[request_id].append((history_id, step_id, timestamp))
+    requests = {
+        request_id: (created_at, current_step_id)
+        for request_id, created_at, current_step_id in Request.objects.filter(id__in=request_ids).values_list('id', 'created_at', 'current_step_id')
+    }
+    step_ids = {row[2] for row in ready} - {None}
+    deadlines = dict(ProcessStep.objects.filter(id__in=step_ids).values_list('id', 'deadline_days'))
+
+    for history_id, request_id, step_id, to_step_id, user_id, action_type, timestamp in ready:
+        timeline = timelines[request_id]
+        position = next(index for index, item in enumerate(timeline) if item[0] == history_id)
+        created_at, current_step_id = requests[request_id]
+        entered_at = timeline[position - 1][2] if position else created_at
+
+        if step_id is not None:
+            dwell = max(int((timestamp - entered_at).total_seconds()), 0)
+            deadline_days = deadlines.get(step_id)
+            breached = deadline_days is not None and dwell > deadline_days * 86400
+            rollup.complete(step_id, user_id, timestamp, dwell, int(breached))
+
+        if action_type != 'REJECTED':
+            if to_step_id is None and position + 1 < len(timeline):
+                # ردیف‌های قدیمی مرحله مقصد ندارند؛ از مرحله اقدام بعدی همان درخواست استنتاج می‌شود
+                to_step_id = timeline[position + 1][1]
+            elif to_step_id is None:
+                to_step_id = current_step_id
+            if to_step_id is not None:
+                rollup.arrive(to_step_id, timestamp)
+        watermark.last_history_id = history_id
+    return len(ready), has_more
+
+def update_analytics(batch_size=5000, log=None):
+    """
+    ردیف‌های جدید درخواست و تاریخچه (بعد از watermark) را به جداول تجمیعی اضافه می‌کند.
+    هر دسته همراه با جابه‌جایی watermark در یک تراکنش ثبت می‌شود؛ فقط یک نمونه هم‌زمان اجرا شود.
+    """
+    log = log or (lambda message: None)
+    totals = {'requests': 0, 'history': 0}
+    while True:
+        cutoff = timezone.now() - COMMIT_LAG
+        with transaction.atomic():
+            watermark, _ = AnalyticsWatermark.objects.get_or_create(name=WATERMARK_NAME)
+            rollup = _Rollup()
+            requests, more_requests = _collect_arrivals(rollup, watermark, cutoff, batch_size)
+            history, more_history = _collect_transitions(rollup, watermark, cutoff, batch_size)
+            _apply(StepDailyStats, 'step', rollup.steps)
+            _apply(UserDailyStats, 'user', rollup.users)
+            watermark.save()
+        totals['requests'] += requests
+        totals['history'] += history
+        if requests or history:
+            log(f"{totals['requests']} درخواست و {totals['history']} اقدام پردازش شد.")
+        if not (more_requests or more_history):
+            return totals
+
+def reset_analytics():
+    """حذف همه داده‌های تجمیعی تا اجرای بعدی آن‌ها را از ابتدا بسازد."""
+    with transaction.atomic():
+        StepDailyStats.objects.all().delete()
+        UserDailyStats.objects.all().delete()
+        AnalyticsWatermark.objects.filter(name=WATERMARK_NAME).delete()
+
+# ===== گزارش‌ها (فقط از جداول تجمیعی خوانده می‌شوند) =====
+def dwell_percentile(histogram, fraction):
+    """صدک تقریبی مدت توقف (ساعت) از روی هیستوگرام؛ مرز بالای سطلی که صدک در آن است."""
+    total = sum(histogram)
+    if not total:
+        return None
+    threshold = total * fraction
+    cumulative = 0
+    for index, count in enumerate(histogram):
+        cumulative += count
+        if cumulative >= threshold:
+            return DWELL_HISTOGRAM_BOUNDS[index] if index < len(DWELL_HISTOGRAM_BOUNDS) else None
+    return None
+
+def _summarize(row):
+    completions = row['completions']
+    row['mean_dwell_hours'] = row['dwell_seconds'] / completions / 3600 if completions else None
+    row['breach_rate'] = row['breaches'] * 100 / completions if completions else None
+    return row
+
+def step_report(start, end):
+    """آمار هر مرحله در بازه [start, end] به همراه تعداد درخواست‌های در جریان (WIP) فعلی."""
+    totals = defaultdict(lambda: {'arrivals': 0, 'completions': 0, 'breaches': 0, 'dwell_seconds': 0, 'dwell_histogram': _empty_histogram()})
+    for step_id, arrivals, completions, breaches, dwell_seconds, histogram in StepDailyStats.objects.filter(day__range=(start, end)).values_list(
+        'step_id', 'arrivals', 'completions', 'breaches', 'dwell_seconds', 'dwell_histogram',
+    ):
+        row = totals[step_id]
+        row['arrivals'] += arrivals
+        row['completions'] += completions
+        row['breaches'] += breaches
+        row['dwell_seconds'] += dwell_seconds
+        row['dwell_histogram'] = [a + b for a, b in zip(row['dwell_histogram'], histogram or _empty_histogram())]
+
+    # WIP = همه ورودی‌ها منهای همه خروجی‌ها (روی ردیف‌های روزانه، مستقل از اندازه تاریخچه)
+    wip = {
+        step_id: (arrivals or 0) - (completions or 0)
+        for step_id, arrivals, completions in StepDailyStats.objects.values('step_id').annotate(
+            total_arrivals=Sum('arrivals'), total_completions=Sum('completions'),
+        ).values_list('step_id', 'total_arrivals', 'total_completions')
+    }
+    report = []
+    for step in ProcessStep.objects.filter(id__in=set(totals) | set(wip)).select_related('process').order_by('process__name', 'step_order'):
+        row = totals[step.id]
+        row.update(step=step, wip=max(wip.get(step.id, 0), 0), p90_dwell_hours=dwell_percentile(row['dwell_histogram'], 0.9))
+        report.append(_summarize(row))
+    return report
+
+def user_report(start, end, user_ids=None):
+    """آمار اقدامات هر کاربر در بازه [start, end]؛ در صورت تعیین user_ids فقط همان کاربران."""
+    stats = UserDailyStats.objects.filter(day__range=(start, end))
+    if user_ids is not None:
+        stats = stats.filter(user_id__in=user_ids)
+    rows = stats.values('user_id').annotate(
+        completions=Sum('completions'), breaches=Sum('breaches'), dwell_seconds=Sum('dwell_seconds'),
+    ).order_by('-completions')
+    users = User.objects.in_bulk([row['user_id'] for row in rows])
+    return [_summarize(dict(row, user=users[row['user_id']])) for row in rows if row['user_id'] in users]
+
+def default_report_range(days=30):
+    end = timezone.localdate()
+    return end - timedelta(days=days - 1), end
@@ -0,0 +1,15 @@
+# core/context_processors.py
+
+from .utils import get_manager_ids
+
+def navigation(request):
+    """
+    پرچم‌های منوی کناری. به صورت تابع برگردانده می‌شوند تا فقط در صفحاتی که منو رندر می‌شود
+    (و حداکثر یک بار) محاسبه شوند.
+    """
+    user = getattr(request, 'user', None)
+
+    def show_analytics_link():
+        return bool(user and user.is_authenticated and (user.is_staff or user.id in get_manager_ids()))
+
+    return {'show_analytics_link': show_analytics_link}
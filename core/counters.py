@@ -0,0 +1,97 @@
+# core/counters.py
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Value
+from django.db.models.functions import Greatest
+from .models import User, Request, Notification, UserCounter
+
+def adjust_counters(user_id, unread_notifications=0, open_tasks=0, open_requests=0, last_notification_id=None):
+    """
+    شمارنده‌های یک کاربر را با یک UPDATE اتمیک تغییر می‌دهد.
+    باید بعد از نوشتن تغییر اصلی و در همان تراکنش فراخوانی شود؛ اگر ردیف شمارنده هنوز
+    وجود نداشته باشد، مقدار آن از روی داده‌های اصلی محاسبه می‌شود.
+    """
+    if not user_id:
+        return
+    changes = {}
+    if unread_notifications:
+        changes['unread_notifications'] = F('unread_notifications') + unread_notifications
+    if open_tasks:
+        changes['open_tasks'] = F('open_tasks') + open_tasks
+    if open_requests:
+        changes['open_requests'] = F('open_requests') + open_requests
+    if last_notification_id:
+        changes['last_notification_id'] = Greatest(F('last_notification_id'), Value(last_notification_id))
+    if not changes:
+        return
+    if not UserCounter.objects.filter(user_id=user_id).update(**changes):
+        rebuild_counters([user_id])
+
+def move_open_task(old_assignee_id, new_assignee_id):
+    """یک وظیفه باز از کارتابل یک کاربر به کارتابل کاربر دیگر منتقل (یا بسته) شده است."""
+    if old_assignee_id == new_assignee_id:
+        return
+    adjust_counters(old_assignee_id, open_tasks=-1)
+    adjust_counters(new_assignee_id, open_tasks=1)
+
+def get_counters(user):
+    """خواندن شمارنده‌ها با یک جستجوی کلید اصلی."""
+    counters = UserCounter.objects.filter(user_id=user.id).first()
+    if counters is None:
+        rebuild_counters([user.id])
+        counters = UserCounter.objects.get(user_id=user.id)
+    return counters
+
+def rebuild_counters(user_ids=None, batch_size=1000):
+    """
+    شمارنده‌ها را از روی جداول اصلی (به صورت گروهی و دسته‌ای) دوباره محاسبه می‌کند.
+    تعداد کاربران پردازش‌شده را برمی‌گرداند.
+    """
+    users = User.objects.order_by('id').values_list('id', flat=True)
+    if user_ids is not None:
+        users = users.filter(id__in=list(user_ids))
+
+    total = 0
+    chunk = []
+    for user_id in users.iterator(chunk_size=batch_size):
+        chunk.append(user_id)
+        if len(chunk) >= batch_size:
+            total += _rebuild_chunk(chunk)
+            chunk = []
+    if chunk:
+        total += _rebuild_chunk(chunk)
+    return total
+
+def _rebuild_chunk(user_ids):
+    notifications = {
+        row['user_id']: row
+        for row in Notification.objects.filter(user_id__in=user_ids).values('user_id').annotate(
+            unread=Count('id', filter=Q(is_read=False)), last_id=Max('id'),
+        ).order_by()
+    }
+    open_tasks = dict(
+        Request.objects.filter(current_assignee_id__in=user_ids, status='IN_PROGRESS')
+        .values('current_assignee_id').annotate(total=Count('id')).order_by()
+        .values_list('current_assignee_id', 'total')
+    )
+    open_requests = dict(
+        Request.objects.filter(initiator_user_id__in=user_ids, status='IN_PROGRESS')
+        .values('initiator_user_id').annotate(total=Count('id')).order_by()
+        .values_list('initiator_user_id', 'total')
+    )
+    counters = [
+        UserCounter(
+            user_id=user_id,
+            unread_notifications=notifications.get(user_id, {}).get('unread', 0),
+            open_tasks=open_tasks.get(user_id, 0),
+            open_requests=open_requests.get(user_id, 0),
+            last_notification_id=notifications.get(user_id, {}).get('last_id') or 0,
+        )
+        for user_id in user_ids
+    ]
+    with transaction.atomic():
+        UserCounter.objects.bulk_create(
+            counters, update_conflicts=True, unique_fields=['user'],
+            update_fields=['unread_notifications', 'open_tasks', 'open_requests', 'last_notification_id'],
+        )
+    return len(counters)
@@ -0,0 +1,85 @@
+# core/due_dates.py
+
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from .models import Request, RequestHistory, DeadlineChange
+
+def _step_entered_at():
+    """زمان ورود درخواست به وضعیت فعلی: آخرین اقدام انتقالی ثبت‌شده در تاریخچه (نظرها حساب نمی‌شوند)."""
+    last_transition = (
+        RequestHistory.objects.filter(request=OuterRef('pk')).exclude(action_type='COMMENTED')
+        .order_by('-timestamp').values('timestamp')[:1]
+    )
+    return Coalesce(Subquery(last_transition), F('created_at'))
+
+def recompute_due_dates(step_ids=None, process_ids=None, batch_size=2000, dry_run=False, log=None):
+    """
+    سررسید درخواست‌های باز را از روی زمان ورود به مرحله فعلی و مهلت فعلی آن مرحله دوباره محاسبه می‌کند.
+    درخواست‌ها به ترتیب شناسه و دسته‌ای خوانده می‌شوند و فقط ردیف‌هایی که سررسیدشان عوض شده
+    نوشته می‌شوند. خروجی: دیکشنری تعداد بررسی‌شده و به‌روزشده.
+    """
+    log = log or (lambda message: None)
+    requests = Request.objects.filter(status='IN_PROGRESS', current_step__isnull=False)
+    if step_ids is not None:
+        requests = requests.filter(current_step_id__in=list(step_ids))
+    if process_ids is not None:
+        requests = requests.filter(process_id__in=list(process_ids))
+    requests = requests.annotate(entered_at=_step_entered_at(), deadline_days=F('current_step__deadline_days'))
+
+    stats = {'scanned': 0, 'updated': 0}
+    last_id = 0
+    while True:
+        rows = list(
+            requests.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'due_date', 'entered_at', 'deadline_days')[:batch_size]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        stats['scanned'] += len(rows)
+
+        # ردیف‌هایی که سررسیدشان عوض می‌شود بر اساس مهلت مرحله گروه‌بندی می‌شوند تا هر گروه با یک
+        # UPDATE محاسباتی (زمان ورود + مهلت) در خود دیتابیس نوشته شود
+        changed = {}
+        for request_id, due_date, entered_at, deadline_days in rows:
+            new_due_date = entered_at + timedelta(days=deadline_days) if deadline_days is not None else None
+            if new_due_date != due_date:
+                changed.setdefault(deadline_days, []).append(request_id)
+        if dry_run:
+            stats['updated'] += sum(len(group) for group in changed.values())
+        elif changed:
+            with transaction.atomic():
+                for deadline_days, request_ids in changed.items():
+                    stats['updated'] += _write_due_dates(request_ids, deadline_days)
+        log(f"{stats['scanned']} درخواست بررسی شد، {stats['updated']} سررسید تغییر کرد.")
+    return stats
+
+def _write_due_dates(request_ids, deadline_days):
+    """
+    سررسید ردیف‌هایی را می‌نویسد که هنوز باز و در مرحله‌ای با همان مهلت خوانده‌شده‌اند؛ درخواستی که
+    بین خواندن دسته و نوشتن، مرحله یا وضعیتش عوض شده کنار گذاشته می‌شود. ردیف‌ها پیش از UPDATE
+    قفل می‌شوند تا DeadlineChange دقیقاً برای ردیف‌های نوشته‌شده و با مقدار ذخیره‌شده در دیتابیس
+    ثبت شود. خروجی: تعداد ردیف‌های به‌روزشده.
+    """
+    if deadline_days is None:
+        same_deadline = {'current_step__deadline_days__isnull': True}
+        new_value = None
+    else:
+        same_deadline = {'current_step__deadline_days': deadline_days}
+        new_value = _step_entered_at() + timedelta(days=deadline_days)
+    locked_ids = list(
+        Request.objects.select_for_update(of=('self',))
+        .filter(id__in=request_ids, status='IN_PROGRESS', **same_deadline)
+        .values_list('id', flat=True)
+    )
+    if not locked_ids:
+        return 0
+    Request.objects.filter(id__in=locked_ids).update(due_date=new_value)
+    # جدول تغییرات سررسید هم به‌روز می‌شود تا زمان‌بند (run_scheduler) از سررسیدهای جدید باخبر شود
+    DeadlineChange.objects.bulk_create([
+        DeadlineChange(request_id=request_id, due_date=due_date)
+        for request_id, due_date in Request.objects.filter(id__in=locked_ids).values_list('id', 'due_date')
+    ])
+    return len(locked_ids)
@@ -0,0 +1,51 @@
+# core/events.py
+
+import asyncio
+import threading
+
+class NotificationBroker:
+    """
+    انتشار/اشتراک درون‌پروسه‌ای اعلان‌ها برای جریان SSE.
+    هر تب باز یک صف asyncio روی حلقه رویداد ASGI دارد؛ publish از هر رشته‌ای (مثلاً
+    ویوهای sync که جنگو در thread اجرا می‌کند) قابل فراخوانی است.
+    نکته: مشترکان فقط در همان پروسه دیده می‌شوند؛ در اجرای چندپروسه‌ای، تب‌هایی که به
+    پروسه دیگری وصل‌اند پیام را از مسیر پشتیبان (polling) دریافت می‌کنند.
+    """
+
+    def __init__(self, queue_size=100):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._queue_size = queue_size
+
+    def subscribe(self, user_id):
+        subscription = (asyncio.get_running_loop(), asyncio.Queue(maxsize=self._queue_size))
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(user_id)
+            if subscriptions:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[user_id]
+
+    def publish(self, user_id, payload):
+        with self._lock:
+            subscriptions = list(self._subscribers.get(user_id, ()))
+        for loop, queue in subscriptions:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, payload)
+            except RuntimeError:
+                # حلقه رویداد بسته شده است؛ اشتراک هنگام خروج ژنراتور حذف می‌شود
+                pass
+
+    @staticmethod
+    def _put(queue, payload):
+        try:
+            queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            pass
+
+notification_broker = NotificationBroker()
@@ -0,0 +1,127 @@
+# core/exports.py
+
+import csv
+import json
+from asgiref.sync import sync_to_async
+from datetime import datetime, time, timedelta
+from django.utils import timezone
+from .models import Request, RequestHistory
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_CHUNK_SIZE = 2000
+
+REQUEST_COLUMNS = ['request_id', 'process', 'status', 'initiator', 'current_step', 'current_assignee', 'created_at', 'updated_at', 'due_date']
+HISTORY_COLUMNS = ['history_id', 'history_step', 'history_to_step', 'history_action', 'history_user', 'history_timestamp', 'history_comments', 'history_attachment']
+
+class _Echo:
+    """شیء شبه‌فایل برای csv.writer که به جای نوشتن، همان خط را برمی‌گرداند."""
+    def write(self, value):
+        return value
+
+def export_queryset(process_id=None, status=None, start=None, end=None):
+    """درخواست‌ها با فیلتر فرایند، وضعیت و بازه تاریخ ثبت (روزهای start و end هم شامل می‌شوند)."""
+    requests = Request.objects.all()
+    if process_id:
+        requests = requests.filter(process_id=process_id)
+    if status:
+        requests = requests.filter(status=status)
+    if start:
+        requests = requests.filter(created_at__gte=timezone.make_aware(datetime.combine(start, time.min)))
+    if end:
+        requests = requests.filter(created_at__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)))
+    return requests
+
+def _user_label(user):
+    # نام کاربری یکتا و پایدار است و خروجی JSONL را برای import_requests قابل بارگذاری می‌کند
+    return user.username if user else ''
+
+def _isoformat(value):
+    return value.isoformat() if value else ''
+
+def iter_request_chunks(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    درخواست‌ها را به ترتیب شناسه و دسته‌ای (keyset) می‌خواند و برای هر دسته تاریخچه را با یک کوئری
+    جداگانه می‌آورد؛ خروجی: دسته‌هایی از (درخواست، فهرست تاریخچه). حافظه مستقل از اندازه کل خروجی است.
+    """
+    queryset = queryset.select_related('process', 'initiator_user', 'current_step', 'current_assignee').order_by('id')
+    last_id = 0
+    while True:
+        requests = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not requests:
+            return
+        last_id = requests[-1].id
+        history = {}
+        for item in RequestHistory.objects.filter(request_id__in=[req.id for req in requests]).select_related('step', 'to_step', 'action_user').order_by('request_id', 'timestamp', 'id'):
+            history.setdefault(item.request_id, []).append(item)
+        yield [(req, history.get(req.id, [])) for req in requests]
+
+def _request_values(req):
+    return {
+        'request_id': req.id,
+        'process': req.process.name,
+        'status': req.status,
+        'initiator': _user_label(req.initiator_user),
+        'current_step': req.current_step.name if req.current_step else '',
+        'current_assignee': _user_label(req.current_assignee),
+        'created_at': _isoformat(req.created_at),
+        'updated_at': _isoformat(req.updated_at),
+        'due_date': _isoformat(req.due_date),
+    }
+
+def _history_values(item):
+    return {
+        'history_id': item.id,
+        'history_step': item.step.name if item.step else '',
+        'history_to_step': item.to_step.name if item.to_step else '',
+        'history_action': item.action_type,
+        'history_user': _user_label(item.action_user),
+        'history_timestamp': _isoformat(item.timestamp),
+        'history_comments': item.comments or '',
+        'history_attachment': item.attachment.name if item.attachment else '',
+    }
+
+def stream_csv(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """CSV با یک ردیف برای هر رکورد تاریخچه (درخواست‌های بدون تاریخچه یک ردیف با ستون‌های خالی دارند)."""
+    writer = csv.writer(_Echo())
+    # BOM تا اکسل متن فارسی را درست نمایش دهد
+    yield '\ufeff' + writer.writerow(REQUEST_COLUMNS + HISTORY_COLUMNS)
+    empty_history = [''] * len(HISTORY_COLUMNS)
+    for chunk in iter_request_chunks(queryset, chunk_size):
+        lines = []
+        for req, history in chunk:
+            request_row = list(_request_values(req).values())
+            if not history:
+                lines.append(writer.writerow(request_row + empty_history))
+            for item in history:
+                lines.append(writer.writerow(request_row + list(_history_values(item).values())))
+        yield ''.join(lines)
+
+def stream_jsonl(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """JSON Lines با یک شیء برای هر درخواست و تاریخچه آن به صورت آرایه تو در تو."""
+    for chunk in iter_request_chunks(queryset, chunk_size):
+        lines = []
+        for req, history in chunk:
+            record = _request_values(req)
+            record['history'] = [_history_values(item) for item in history]
+            lines.append(json.dumps(record, ensure_ascii=False) + '\n')
+        yield ''.join(lines)
+
+def stream_export(queryset, export_format, chunk_size=EXPORT_CHUNK_SIZE):
+    if export_format == 'jsonl':
+        return stream_jsonl(queryset, chunk_size)
+    return stream_csv(queryset, chunk_size)
+
+_EXHAUSTED = object()
+
+async def astream_export(queryset, export_format, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    نسخه async برای ASGI: جنگو iterator همگام را پیش از ارسال کامل در حافظه جمع می‌کند، پس هر دسته
+    جداگانه با sync_to_async (در همان رشته و اتصال دیتابیس) تولید و بلافاصله ارسال می‌شود.
+    """
+    chunks = stream_export(queryset, export_format, chunk_size)
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    while True:
+        chunk = await next_chunk(chunks, _EXHAUSTED)
+        if chunk is _EXHAUSTED:
+            return
+        yield chunk
@@ -0,0 +1,129 @@
+# core/mailer.py
+
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+from . import metrics
+from .models import OutgoingEmail
+
+def enqueue_email(to_email, subject, body):
+    """
+    ایمیل را در جدول outbox ثبت می‌کند؛ اگر داخل یک تراکنش فراخوانی شود، همراه با همان
+    تغییر ثبت (یا برگردانده) می‌شود. ارسال واقعی توسط دستور send_outbox انجام می‌شود.
+    """
+    return OutgoingEmail.objects.create(to_email=to_email, subject=subject, body=body)
+
+def _retry_delay(attempts):
+    """فاصله تلاش مجدد به صورت نمایی (با سقف) رشد می‌کند."""
+    base = getattr(settings, 'EMAIL_OUTBOX_RETRY_BASE', 60)
+    limit = getattr(settings, 'EMAIL_OUTBOX_RETRY_MAX', 6 * 60 * 60)
+    return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), limit))
+
+def claim_pending_emails(batch_size):
+    """
+    یک دسته از ایمیل‌های سررسیده را برای این پردازشگر رزرو می‌کند.
+    زمان تلاش بعدی به اندازه مهلت رزرو جلو برده می‌شود تا پردازشگرهای هم‌زمان آن‌ها را برندارند
+    و اگر این پردازشگر از کار بیفتد، پس از پایان مهلت دوباره قابل برداشت باشند.
+    """
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'EMAIL_OUTBOX_LEASE', 300))
+    token = uuid.uuid4()
+    due = OutgoingEmail.objects.filter(status='PENDING', next_attempt_at__lte=now)
+    ids = list(due.order_by('next_attempt_at', 'id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    due.filter(id__in=ids).update(lease_token=token, next_attempt_at=now + lease)
+    return list(OutgoingEmail.objects.filter(lease_token=token).order_by('id'))
+
+def send_pending_emails(batch_size=None, max_attempts=None, log=None):
+    """
+    یک دسته از ایمیل‌های صف را روی یک اتصال SMTP مشترک ارسال و نتیجه هر کدام را ثبت می‌کند.
+    خروجی: دیکشنری تعداد ارسال‌شده، تلاش مجدد و ناموفق.
+    """
+    batch_size = batch_size or getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 100)
+    max_attempts = max_attempts or getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 8)
+    log = log or (lambda message: None)
+    stats = {'sent': 0, 'retry': 0, 'failed': 0}
+
+    emails = claim_pending_emails(batch_size)
+    if not emails:
+        return stats
+
+    try:
+        connection = get_connection(fail_silently=False)
+        connection.open()
+    except Exception as e:
+        # سرور در دسترس نیست؛ کل دسته با تأخیر دوباره تلاش می‌شود
+        log(f"خطا در اتصال به سرور ایمیل: {e}")
+        for email in emails:
+            _record_failure(email, e, max_attempts, stats)
+        return stats
+
+    try:
+        for email in emails:
+            message = EmailMessage(email.subject, email.body, settings.DEFAULT_FROM_EMAIL, [email.to_email], connection=connection)
+            try:
+                with metrics.timed('email_send_duration_seconds'):
+                    message.send()
+            except Exception as e:
+                log(f"خطا در ارسال ایمیل #{email.id} به {email.to_email}: {e}")
+                _record_failure(email, e, max_attempts, stats)
+                continue
+            OutgoingEmail.objects.filter(id=email.id).update(
+                status='SENT', sent_at=timezone.now(), attempts=email.attempts + 1, lease_token=None, last_error='',
+            )
+            stats['sent'] += 1
+    finally:
+        connection.close()
+    return stats
+
+def _record_failure(email, error, max_attempts, stats):
+    attempts = email.attempts + 1
+    changes = {'attempts': attempts, 'lease_token': None, 'last_error': str(error)[:2000]}
+    if attempts >= max_attempts:
+        changes['status'] = 'FAILED'
+        stats['failed'] += 1
+    else:
+        changes['next_attempt_at'] = timezone.now() + _retry_delay(attempts)
+        stats['retry'] += 1
+    OutgoingEmail.objects.filter(id=email.id).update(**changes)
+
+def send_messages_parallel(messages, workers=1, log=None):
+    """
+    پیام‌ها را بین چند رشته تقسیم می‌کند؛ هر رشته یک اتصال SMTP باز کرده و سهم خود را روی همان
+    اتصال ارسال می‌کند. خروجی: مجموعه اندیس پیام‌هایی که با موفقیت ارسال شدند.
+    """
+    log = log or (lambda message: None)
+    workers = max(1, min(workers, len(messages)))
+    if not messages:
+        return set()
+
+    def deliver(indexes):
+        sent = set()
+        try:
+            connection = get_connection(fail_silently=False)
+            connection.open()
+        except Exception as e:
+            log(f"خطا در اتصال به سرور ایمیل: {e}")
+            return sent
+        try:
+            for index in indexes:
+                message = messages[index]
+                message.connection = connection
+                try:
+                    with metrics.timed('email_send_duration_seconds'):
+                        message.send()
+                except Exception as e:
+                    log(f"خطا در ارسال ایمیل به {', '.join(message.to)}: {e}")
+                    continue
+                sent.add(index)
+        finally:
+            connection.close()
+        return sent
+
+    slices = [range(start, len(messages), workers) for start in range(workers)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return set().union(*executor.map(deliver, slices))
@@ -0,0 +1,34 @@
+# core/management/commands/export_requests.py
+
+import sys
+from datetime import date
+from django.core.management.base import BaseCommand
+from core.exports import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_queryset, stream_export
+from core.models import Request
+
+class Command(BaseCommand):
+    help = 'Streams requests with their history as CSV or JSON Lines to a file or stdout, in constant memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--process', type=int, help='Only export requests of this process id.')
+        parser.add_argument('--status', choices=[value for value, _ in Request.STATUS_CHOICES])
+        parser.add_argument('--start', type=date.fromisoformat, help='Created on or after this date (YYYY-MM-DD).')
+        parser.add_argument('--end', type=date.fromisoformat, help='Created on or before this date (YYYY-MM-DD).')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+        parser.add_argument('--output', help='Output file path; defaults to stdout.')
+
+    def handle(self, *args, **options):
+        queryset = export_queryset(
+            process_id=options['process'], status=options['status'], start=options['start'], end=options['end'],
+        )
+        chunks = stream_export(queryset, options['format'], options['chunk_size'])
+        if not options['output']:
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+            return
+
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f"خروجی در {options['output']} ذخیره شد."))
@@ -0,0 +1,183 @@
+# core/management/commands/import_requests.py
+
+import json
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from core.counters import rebuild_counters
+from core.models import User, Process, ProcessStep, Request, RequestHistory, DeadlineChange
+
+# ===== قالب ورودی =====
+# هر خط یک شیء JSON برای یک درخواست، همان قالب خروجی JSONL دستور export_requests:
+#   process (نام فرایند)، status، initiator و current_assignee (نام کاربری)، current_step (نام مرحله)،
+#   created_at و due_date (ISO 8601)، history: فهرست اقداماتی با کلیدهای history_step،
+#   history_to_step، history_action، history_user، history_timestamp و history_comments.
+# کلیدهای دیگر (مثل request_id و updated_at) نادیده گرفته می‌شوند؛ فایل‌ها بارگذاری نمی‌شوند.
+
+STATUSES = {value for value, _ in Request.STATUS_CHOICES}
+ACTION_TYPES = {value for value, _ in RequestHistory.ACTION_TYPES}
+
+class RecordError(ValueError):
+    """خطای داده در یک خط ورودی؛ آن خط رد می‌شود."""
+
+class Command(BaseCommand):
+    help = ('Bulk-loads requests and their history from a JSON Lines file (the export_requests JSONL format) '
+            'in large transactional batches. Resumable with --offset.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path to the JSONL file.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Requests inserted per transaction.')
+        parser.add_argument('--offset', type=int, default=0, help='Skip this many lines (resume after the last reported offset).')
+        parser.add_argument('--limit', type=int, help='Stop after reading this many lines.')
+        parser.add_argument('--strict', action='store_true', help='Abort on the first invalid line instead of skipping it.')
+
+    def handle(self, *args, **options):
+        self._load_lookups()
+        self.now = timezone.now()
+        batch_size = options['batch_size']
+        started = time.monotonic()
+        totals = {'requests': 0, 'history': 0, 'skipped': 0}
+        counter_user_ids = set()
+        line_number = options['offset']
+        batch = []
+
+        try:
+            source = open(options['path'], encoding='utf-8')
+        except OSError as e:
+            raise CommandError(f"خطا در باز کردن فایل: {e}")
+
+        with source:
+            for index, line in enumerate(source):
+                if index < options['offset']:
+                    continue
+                if options['limit'] is not None and index >= options['offset'] + options['limit']:
+                    break
+                line_number = index + 1
+                if not line.strip():
+                    continue
+                try:
+                    batch.append(self._build(json.loads(line)))
+                except (ValueError, TypeError, AttributeError, KeyError) as e:
+                    if options['strict']:
+                        raise CommandError(f"خط {line_number}: {e}")
+                    totals['skipped'] += 1
+                    self.stderr.write(f"خط {line_number} رد شد: {e}")
+                    continue
+                if len(batch) >= batch_size:
+                    self._flush(batch, totals, counter_user_ids, line_number, started)
+                    batch = []
+        if batch:
+            self._flush(batch, totals, counter_user_ids, line_number, started)
+
+        # bulk_create از مسیر ویوها عبور نمی‌کند؛ شمارنده‌های مسئولان و ثبت‌کنندگان از روی داده محاسبه می‌شود
+        rebuild_counters(counter_user_ids)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{totals['requests']} درخواست و {totals['history']} اقدام در {elapsed:.1f} ثانیه وارد شد "
+            f"({totals['requests'] / max(elapsed, 1e-6):.0f} درخواست در ثانیه)؛ {totals['skipped']} خط رد شد."
+        ))
+
+    # ===== جداول جستجو =====
+    def _load_lookups(self):
+        """همه ارجاعات (کاربر، فرایند، مرحله) یک بار خوانده و در حافظه نگه داشته می‌شوند."""
+        self.users = dict(User.objects.values_list('username', 'id'))
+        self.processes = dict(Process.objects.values_list('name', 'id'))
+        self.steps = {
+            (process_id, name): (step_id, deadline_days)
+            for step_id, process_id, name, deadline_days in ProcessStep.objects.values_list('id', 'process_id', 'name', 'deadline_days')
+        }
+
+    def _user_id(self, username, required=True):
+        if not username:
+            if required:
+                raise RecordError("کاربر مشخص نشده است")
+            return None
+        try:
+            return self.users[username]
+        except KeyError:
+            raise RecordError(f"کاربر «{username}» وجود ندارد")
+
+    def _step(self, process_id, name):
+        if not name:
+            return None, None
+        try:
+            return self.steps[(process_id, name)]
+        except KeyError:
+            raise RecordError(f"مرحله «{name}» در این فرایند وجود ندارد")
+
+    def _datetime(self, value, default=None):
+        if not value:
+            return default
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise RecordError(f"تاریخ نامعتبر: {value}")
+        return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+    # ===== تبدیل هر خط =====
+    def _build(self, record):
+        try:
+            process_id = self.processes[record['process']]
+        except KeyError:
+            raise RecordError(f"فرایند «{record.get('process')}» وجود ندارد")
+        status = record.get('status') or 'IN_PROGRESS'
+        if status not in STATUSES:
+            raise RecordError(f"وضعیت نامعتبر: {status}")
+        created_at = self._datetime(record.get('created_at'), self.now)
+        step_id, deadline_days = self._step(process_id, record.get('current_step'))
+        due_date = self._datetime(record.get('due_date'))
+        if due_date is None and status == 'IN_PROGRESS' and deadline_days is not None:
+            due_date = created_at + timedelta(days=deadline_days)
+
+        req = Request(
+            process_id=process_id,
+            initiator_user_id=self._user_id(record.get('initiator')),
+            current_step_id=step_id,
+            current_assignee_id=self._user_id(record.get('current_assignee'), required=False),
+            status=status,
+            created_at=created_at,
+            due_date=due_date,
+        )
+        history = []
+        for item in record.get('history') or []:
+            action_type = item.get('history_action')
+            if action_type not in ACTION_TYPES:
+                raise RecordError(f"نوع اقدام نامعتبر: {action_type}")
+            history.append(RequestHistory(
+                step_id=self._step(process_id, item.get('history_step'))[0],
+                to_step_id=self._step(process_id, item.get('history_to_step'))[0],
+                action_user_id=self._user_id(item.get('history_user')),
+                action_type=action_type,
+                timestamp=self._datetime(item.get('history_timestamp'), created_at),
+                comments=item.get('history_comments') or None,
+            ))
+        return req, history
+
+    # ===== درج دسته‌ای =====
+    def _flush(self, batch, totals, counter_user_ids, line_number, started):
+        requests = [req for req, _ in batch]
+        with transaction.atomic():
+            Request.objects.bulk_create(requests)
+            history = []
+            for req, items in batch:
+                for item in items:
+                    item.request_id = req.id
+                    history.append(item)
+            RequestHistory.objects.bulk_create(history, batch_size=len(requests))
+            # زمان‌بند مهلت‌ها تغییرات را از این جدول می‌خواند؛ bulk_create سیگنال post_save ندارد
+            DeadlineChange.objects.bulk_create([
+                DeadlineChange(request_id=req.id, due_date=req.due_date)
+                for req in requests if req.status == 'IN_PROGRESS' and req.due_date
+            ])
+
+        counter_user_ids.update(req.current_assignee_id for req in requests if req.current_assignee_id)
+        counter_user_ids.update(req.initiator_user_id for req in requests)
+        totals['requests'] += len(requests)
+        totals['history'] += len(history)
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"{totals['requests']} درخواست وارد شد ({totals['requests'] / max(elapsed, 1e-6):.0f} در ثانیه)؛ "
+            f"برای ادامه: --offset {line_number}"
+        )
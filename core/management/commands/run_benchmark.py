@@ -0,0 +1,212 @@
+# core/management/commands/run_benchmark.py
+
+import io
+import json
+import random
+import statistics
+import threading
+import time
+from django.core import mail
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+from core.models import User, Request
+
+# سناریوهای وب و وزن نسبی هر کدام در ترکیب بار
+WEB_SCENARIOS = {
+    'dashboard': 4,
+    'request_detail_get': 3,
+    'request_detail_post': 1,
+    'notifications': 4,
+}
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+class Command(BaseCommand):
+    help = ('Drives the dashboard, request detail (GET/POST), notifications and send_reminders concurrently '
+            'through the test client and reports throughput and p50/p95/p99 latency. Writes to the database; '
+            'run it against a dataset from generate_workload.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to apply load.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Number of client threads.')
+        parser.add_argument('--sample-size', type=int, default=2000, help='Open requests sampled as targets.')
+        parser.add_argument('--no-reminders', action='store_true', help='Do not run send_reminders alongside the web load.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--label', default='', help='Free-form label stored in the JSON result.')
+        parser.add_argument('--output', help='Write the JSON result to this file.')
+        parser.add_argument('--baseline', help='A previous JSON result to compare p95 latencies against.')
+
+    def handle(self, *args, **options):
+        # ایمیل‌ها در حافظه می‌مانند و testserver به ALLOWED_HOSTS اضافه می‌شود
+        try:
+            setup_test_environment()
+        except RuntimeError:
+            # از داخل اجرای تست‌ها فراخوانی شده و محیط از قبل آماده است
+            owns_environment = False
+        else:
+            owns_environment = True
+        try:
+            self._benchmark(options)
+        finally:
+            if owns_environment:
+                teardown_test_environment()
+
+    def _benchmark(self, options):
+        rng = random.Random(options['seed'])
+        targets = list(
+            Request.objects.filter(status='IN_PROGRESS', current_assignee__isnull=False)
+            .values_list('id', 'current_assignee_id', 'version')[:options['sample_size'] * 5]
+        )
+        if not targets:
+            raise CommandError('درخواست باز برای سنجش وجود ندارد؛ ابتدا generate_workload را اجرا کنید.')
+        rng.shuffle(targets)
+        targets = targets[:options['sample_size']]
+        # هر درخواست حداکثر یک بار تایید می‌شود تا POSTها با تعارض نسخه برنگردند
+        self.approvals = list(targets)
+        self.targets = targets
+        self.users = User.objects.in_bulk({user_id for _, user_id, _ in targets})
+        self.lock = threading.Lock()
+        self.timings = {name: [] for name in WEB_SCENARIOS}
+        self.errors = {name: 0 for name in WEB_SCENARIOS}
+        connection.close()
+
+        deadline = time.monotonic() + options['duration']
+        threads = [
+            threading.Thread(target=self._web_worker, args=(random.Random(options['seed'] + index + 1), deadline))
+            for index in range(options['concurrency'])
+        ]
+        if not options['no_reminders']:
+            self.timings['send_reminders'] = []
+            self.errors['send_reminders'] = 0
+            threads.append(threading.Thread(target=self._reminder_worker, args=(deadline,)))
+
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        result = self._result(options, elapsed)
+        self._print(result, options['baseline'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(result, output, ensure_ascii=False, indent=2)
+            self.stdout.write(f"نتیجه در {options['output']} ذخیره شد.")
+
+    # ===== کارگرها =====
+    def _web_worker(self, rng, deadline):
+        clients = {}
+        names = list(WEB_SCENARIOS)
+        weights = list(WEB_SCENARIOS.values())
+        try:
+            while time.monotonic() < deadline:
+                name = rng.choices(names, weights=weights)[0]
+                request_id, user_id, version = rng.choice(self.targets)
+                if name == 'request_detail_post':
+                    with self.lock:
+                        if self.approvals:
+                            request_id, user_id, version = self.approvals.pop()
+                        else:
+                            name = 'request_detail_get'
+                started = time.perf_counter()
+                try:
+                    client = clients.get(user_id)
+                    if client is None:
+                        client = Client()
+                        client.force_login(self.users[user_id])
+                        clients[user_id] = client
+                        started = time.perf_counter()
+                    if name == 'dashboard':
+                        response = client.get(reverse('dashboard'))
+                    elif name == 'request_detail_get':
+                        response = client.get(reverse('request_detail', args=[request_id]))
+                    elif name == 'request_detail_post':
+                        response = client.post(reverse('request_detail', args=[request_id]), {
+                            'action': 'approve', 'version': version, 'comments': 'benchmark',
+                        })
+                    else:
+                        response = client.get(reverse('get_notifications'))
+                    failed = response.status_code >= 400
+                except Exception as e:
+                    print(f"خطا در سناریو {name}: {e}")
+                    failed = True
+                self._record(name, time.perf_counter() - started, failed)
+        finally:
+            connection.close()
+
+    def _reminder_worker(self, deadline):
+        try:
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                failed = False
+                try:
+                    # بدون محدودیت تکرار تا هر اجرا همه درخواست‌های معوق را پردازش کند
+                    call_command('send_reminders', throttle_hours=0, stdout=io.StringIO())
+                except Exception as e:
+                    print(f"خطا در send_reminders: {e}")
+                    failed = True
+                mail.outbox = []
+                self._record('send_reminders', time.perf_counter() - started, failed)
+        finally:
+            connection.close()
+
+    def _record(self, name, seconds, failed):
+        with self.lock:
+            self.timings[name].append(seconds * 1000)
+            if failed:
+                self.errors[name] += 1
+
+    # ===== گزارش =====
+    def _result(self, options, elapsed):
+        scenarios = {}
+        for name, timings in self.timings.items():
+            timings.sort()
+            scenarios[name] = {
+                'count': len(timings),
+                'errors': self.errors[name],
+                'throughput_per_second': round(len(timings) / elapsed, 2),
+                'mean_ms': round(statistics.fmean(timings), 2) if timings else 0.0,
+                'p50_ms': round(percentile(timings, 0.50), 2),
+                'p95_ms': round(percentile(timings, 0.95), 2),
+                'p99_ms': round(percentile(timings, 0.99), 2),
+            }
+        total = sum(scenario['count'] for name, scenario in scenarios.items() if name in WEB_SCENARIOS)
+        return {
+            'label': options['label'],
+            'finished_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'duration_seconds': round(elapsed, 2),
+            'concurrency': options['concurrency'],
+            'requests_in_database': Request.objects.count(),
+            'web_throughput_per_second': round(total / elapsed, 2),
+            'scenarios': scenarios,
+        }
+
+    def _print(self, result, baseline_path):
+        baseline = {}
+        if baseline_path:
+            with open(baseline_path, encoding='utf-8') as source:
+                baseline = json.load(source).get('scenarios', {})
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"\n{result['web_throughput_per_second']} درخواست وب در ثانیه با {result['concurrency']} رشته "
+            f"در {result['duration_seconds']} ثانیه (میلی‌ثانیه):"
+        ))
+        for name, scenario in result['scenarios'].items():
+            line = (
+                f"  {name:<20} n={scenario['count']:<6} err={scenario['errors']:<4} {scenario['throughput_per_second']:8.2f}/s   "
+                f"p50 {scenario['p50_ms']:8.2f}  p95 {scenario['p95_ms']:8.2f}  p99 {scenario['p99_ms']:8.2f}"
+            )
+            previous = baseline.get(name)
+            if previous and previous.get('p95_ms'):
+                line += f"   p95 x{scenario['p95_ms'] / previous['p95_ms']:.2f} نسبت به مبنا"
+            self.stdout.write(line)
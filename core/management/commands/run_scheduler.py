@@ -0,0 +1,188 @@
+# core/management/commands/run_scheduler.py
+
+import heapq
+import time
+from datetime import timedelta
+from itertools import groupby
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils import timezone
+from core.analytics import COMMIT_LAG
+from core.models import Request, DeadlineChange
+from core.reminders import (
+    build_escalation_message, build_reminder_message, deliver, escalation_delay, recently_reminded, reminder_throttle,
+)
+
+REMINDER = 'reminder'
+ESCALATION = 'escalation'
+
+class Command(BaseCommand):
+    help = (
+        'Runs a long-lived scheduler that keeps upcoming deadlines in memory, follows changes through the '
+        'DeadlineChange table and sends reminders and escalations as soon as deadlines pass. Run a single instance.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=2, help='Maximum seconds between two checks of the DeadlineChange table.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of rows read per query when applying changes or firing deadlines.')
+        parser.add_argument('--workers', type=int, default=2, help='Number of parallel SMTP connections.')
+        parser.add_argument('--retention-hours', type=float, default=24, help='Processed DeadlineChange rows older than this are deleted.')
+        parser.add_argument('--once', action='store_true', help='Fire everything that is already due and exit.')
+
+    def handle(self, *args, **options):
+        self._start(options)
+        self.stdout.write(self.style.SUCCESS(f"{len(self.deadlines)} سررسید باز بارگذاری شد."))
+
+        last_prune = time.monotonic()
+        try:
+            while True:
+                self._apply_changes()
+                fired = self._fire_due(timezone.now())
+                if options['once'] and not fired:
+                    break
+                if fired:
+                    continue
+                if time.monotonic() - last_prune > 3600:
+                    self._prune()
+                    last_prune = time.monotonic()
+                time.sleep(self._sleep_seconds())
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS('زمان‌بند متوقف شد.'))
+
+    # ===== نگهداری صف سررسیدها =====
+    def _start(self, options):
+        self.options = options
+        # صف اولویت (زمان اجرا، شناسه درخواست، نوع، سررسید) و سررسید فعلی هر درخواست؛
+        # ورودی‌هایی که سررسیدشان با مقدار فعلی نخواند هنگام برداشتن نادیده گرفته می‌شوند
+        self.heap = []
+        self.deadlines = {}
+        self.cursor = DeadlineChange.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        # تغییرات خوانده‌شده در بازه COMMIT_LAG (شناسه ← زمان ثبت) و آخرین تغییر اعمال‌شده هر درخواست در آن
+        self.recent_changes = {}
+        self.latest_change = {}
+        self._load()
+
+    def _track(self, request_id, due_date):
+        if due_date is None:
+            self.deadlines.pop(request_id, None)
+            return
+        self.deadlines[request_id] = due_date
+        heapq.heappush(self.heap, (due_date, request_id, REMINDER, due_date))
+
+    def _load(self):
+        open_requests = Request.objects.filter(status='IN_PROGRESS', due_date__isnull=False).values_list('id', 'due_date')
+        for request_id, due_date in open_requests.iterator(chunk_size=5000):
+            self._track(request_id, due_date)
+
+    def _apply_changes(self):
+        while True:
+            changes = list(
+                DeadlineChange.objects.filter(id__gt=self.cursor).order_by('id')
+                .values_list('id', 'request_id', 'due_date', 'created_at')[:self.options['batch_size']]
+            )
+            for change in changes:
+                self.cursor = change[0]
+                self._apply_change(*change)
+            if len(changes) < self.options['batch_size']:
+                break
+
+        # با چند نویسنده هم‌زمان، تغییری با شناسه کمتر ممکن است پس از شناسه‌های بزرگ‌تر commit شود؛
+        # مانند به‌روزرسانی آمار (core/analytics.py) بازه COMMIT_LAG اخیر دوباره خوانده می‌شود
+        window_start = timezone.now() - COMMIT_LAG
+        late_changes = list(
+            DeadlineChange.objects.filter(id__lte=self.cursor, created_at__gte=window_start).order_by('id')
+            .values_list('id', 'request_id', 'due_date', 'created_at')
+        )
+        for change in late_changes:
+            if change[0] not in self.recent_changes:
+                self._apply_change(*change)
+
+        expired = [change_id for change_id, created_at in self.recent_changes.items() if created_at < window_start]
+        for change_id in expired:
+            del self.recent_changes[change_id]
+        self.latest_change = {
+            request_id: change_id for request_id, change_id in self.latest_change.items() if change_id in self.recent_changes
+        }
+
+    def _apply_change(self, change_id, request_id, due_date, created_at):
+        self.recent_changes[change_id] = created_at
+        # تغییرات یک درخواست زیر قفل ردیف آن ثبت می‌شوند؛ تغییر دیررسِ قدیمی‌تر، جدیدتر را بازنویسی نمی‌کند
+        if change_id < self.latest_change.get(request_id, 0):
+            return
+        self.latest_change[request_id] = change_id
+        if self.deadlines.get(request_id) != due_date:
+            self._track(request_id, due_date)
+
+    def _sleep_seconds(self):
+        poll = self.options['poll_interval']
+        if not self.heap:
+            return poll
+        until_next = (self.heap[0][0] - timezone.now()).total_seconds()
+        return min(poll, max(until_next, 0))
+
+    def _prune(self):
+        cutoff = timezone.now() - timedelta(hours=self.options['retention_hours'])
+        DeadlineChange.objects.filter(id__lte=self.cursor, created_at__lt=cutoff).delete()
+
+    # ===== اجرای سررسیدها =====
+    def _fire_due(self, now):
+        due = {REMINDER: [], ESCALATION: []}
+        count = 0
+        while self.heap and self.heap[0][0] <= now:
+            fire_at, request_id, kind, due_date = heapq.heappop(self.heap)
+            if self.deadlines.get(request_id) != due_date:
+                continue
+            due[kind].append((fire_at, request_id, due_date))
+            count += 1
+        if not count:
+            return 0
+
+        # همه موارد سررسیده یک‌جا پردازش می‌شوند تا هر گیرنده فقط یک ایمیل بگیرد؛ خواندن از دیتابیس دسته‌ای است
+        ids = sorted({request_id for entries in due.values() for _, request_id, _ in entries})
+        requests = {}
+        open_requests = Request.objects.filter(status='IN_PROGRESS').select_related('process', 'current_assignee__manager')
+        for start in range(0, len(ids), self.options['batch_size']):
+            requests.update(open_requests.in_bulk(ids[start:start + self.options['batch_size']]))
+        throttle = reminder_throttle()
+
+        reminders = []
+        for fire_at, request_id, due_date in due[REMINDER]:
+            req = requests.get(request_id)
+            if req is None or req.due_date != due_date:
+                continue
+            # یادآوری تا باز بودن درخواست با فاصله throttle تکرار می‌شود؛ ارجاع به مدیر یک بار برنامه‌ریزی می‌شود
+            heapq.heappush(self.heap, (now + throttle, request_id, REMINDER, due_date))
+            if fire_at == due_date:
+                heapq.heappush(self.heap, (due_date + escalation_delay(), request_id, ESCALATION, due_date))
+            if req.current_assignee and req.current_assignee.email:
+                reminders.append(req)
+
+        escalations = []
+        for fire_at, request_id, due_date in due[ESCALATION]:
+            req = requests.get(request_id)
+            if req is None or req.due_date != due_date:
+                continue
+            heapq.heappush(self.heap, (now + throttle, request_id, ESCALATION, due_date))
+            manager = req.current_assignee.manager if req.current_assignee else None
+            if manager and manager.email:
+                escalations.append(req)
+
+        sent = self._deliver(reminders, lambda req: req.current_assignee, build_reminder_message, now - throttle, now)
+        escalated = self._deliver(escalations, lambda req: req.current_assignee.manager, build_escalation_message, now - throttle, now)
+        if sent or escalated:
+            self.stdout.write(f"{timezone.localtime(now):%Y-%m-%d %H:%M:%S} یادآوری: {sent}، ارجاع به مدیر: {escalated}")
+        return count
+
+    def _deliver(self, requests, recipient_of, build_message, throttle_since, now):
+        recent = recently_reminded(((req.id, recipient_of(req).id) for req in requests), throttle_since)
+        requests = sorted((req for req in requests if (req.id, recipient_of(req).id) not in recent), key=lambda req: recipient_of(req).id)
+        groups = []
+        for _, recipient_requests in groupby(requests, key=lambda req: recipient_of(req).id):
+            recipient_requests = list(recipient_requests)
+            groups.append((recipient_of(recipient_requests[0]), recipient_requests))
+        sent, _ = deliver(
+            groups, build_message, now, workers=self.options['workers'],
+            log=lambda message: self.stdout.write(self.style.ERROR(message)),
+        )
+        return sent
@@ -0,0 +1,36 @@
+# core/management/commands/send_outbox.py
+
+import time
+from django.core.management.base import BaseCommand
+from core.mailer import send_pending_emails
+
+class Command(BaseCommand):
+    help = 'Delivers queued outgoing emails in batches over a shared SMTP connection, retrying failures with backoff.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Maximum number of emails sent per connection.')
+        parser.add_argument('--max-attempts', type=int, default=None, help='Attempts before an email is marked as failed.')
+        parser.add_argument('--loop', action='store_true', help='Keep running and poll the outbox instead of draining it once.')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to sleep between polls when the outbox is empty (with --loop).')
+
+    def handle(self, *args, **options):
+        totals = {'sent': 0, 'retry': 0, 'failed': 0}
+        try:
+            while True:
+                stats = send_pending_emails(options['batch_size'], options['max_attempts'], log=self._error)
+                for key, value in stats.items():
+                    totals[key] += value
+                if any(stats.values()):
+                    self.stdout.write(f"ارسال شده: {stats['sent']}، تلاش مجدد: {stats['retry']}، ناموفق: {stats['failed']}")
+                    continue
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(
+            f"پایان: {totals['sent']} ایمیل ارسال شد، {totals['retry']} برای تلاش مجدد زمان‌بندی شد و {totals['failed']} ناموفق ماند."
+        ))
+
+    def _error(self, message):
+        self.stdout.write(self.style.ERROR(message))
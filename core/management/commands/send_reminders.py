@@ -1,65 +1,102 @@
 # core/management/commands/send_reminders.py
 
+import time
+from datetime import timedelta
+from itertools import groupby
 from django.core.management.base import BaseCommand
+from django.db.models import Q
 from django.utils import timezone
 from core.models import Request
-from django.core.mail import send_mail
-from django.conf import settings
-from django.urls import reverse
+from core.reminders import build_reminder_message, deliver, recently_reminded, reminder_throttle
 
 class Command(BaseCommand):
-    help = 'Sends reminder emails for overdue requests.'
+    help = 'Sends one reminder email per assignee listing their overdue requests, skipping recently reminded ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Number of overdue requests fetched and processed per batch.')
+        parser.add_argument('--workers', type=int, default=4, help='Number of parallel SMTP connections.')
+        parser.add_argument('--throttle-hours', type=float, default=None, help='Skip requests reminded to the same assignee within this many hours.')
+        parser.add_argument('--dry-run', action='store_true', help='Build the reminders and report timings without sending or logging anything.')
 
     def handle(self, *args, **options):
-        # درخواست‌های در حال بررسی که تاریخ سررسید آن‌ها گذشته است را پیدا کن
-        overdue_requests = Request.objects.filter(
-            status='IN_PROGRESS',
-            due_date__isnull=False,
-            due_date__lt=timezone.now()
+        started = time.monotonic()
+        now = timezone.now()
+        throttle = reminder_throttle() if options['throttle_hours'] is None else timedelta(hours=options['throttle_hours'])
+        self.now = now
+        self.dry_run = options['dry_run']
+        self.workers = options['workers']
+        self.stats = {'scanned': 0, 'throttled': 0, 'recipients': 0, 'sent': 0, 'failed': 0}
+
+        # درخواست‌های در حال بررسی که تاریخ سررسید آن‌ها گذشته است، مرتب بر اساس مسئول
+        # تا یادآوری‌های هر گیرنده پشت سر هم برسند و بدون نگه‌داشتن کل نتیجه گروه‌بندی شوند
+        overdue_requests = (
+            Request.objects.overdue(now)
+            .filter(current_assignee__isnull=False)
+            .exclude(current_assignee__email='')
+            .select_related('current_assignee', 'process')
+            .order_by('current_assignee_id', 'id')
         )
+        rows = self._unthrottled(overdue_requests, now - throttle, options['chunk_size'])
+
+        pending, pending_rows = [], 0
+        for _, recipient_requests in groupby(rows, key=lambda req: req.current_assignee_id):
+            recipient_requests = list(recipient_requests)
+            pending.append(recipient_requests)
+            pending_rows += len(recipient_requests)
+            if pending_rows >= options['chunk_size']:
+                self._flush(pending)
+                pending, pending_rows = [], 0
+        self._flush(pending)
 
-        if not overdue_requests.exists():
+        elapsed = time.monotonic() - started
+        stats = self.stats
+        if not stats['scanned']:
             self.stdout.write(self.style.SUCCESS('هیچ درخواست معوقی یافت نشد.'))
             return
+        prefix = '[اجرای آزمایشی] ' if self.dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}{stats['scanned']} درخواست معوق بررسی شد؛ {stats['throttled']} مورد اخیراً یادآوری شده بود. "
+            f"{stats['recipients']} گیرنده، {stats['sent']} ایمیل ارسال شد، {stats['failed']} ناموفق. "
+            f"زمان: {elapsed:.2f} ثانیه ({stats['scanned'] / max(elapsed, 1e-6):.0f} درخواست در ثانیه)."
+        ))
 
-        self.stdout.write(f'تعداد {overdue_requests.count()} درخواست معوق یافت شد. در حال ارسال ایمیل...')
-
-        for req in overdue_requests:
-            recipient = req.current_assignee
-            if recipient and recipient.email:
-                subject = f"یادآوری: وظیفه معوق در سیستم اتوماسیون - درخواست #{req.id}"
-                
-                # ساخت لینک مستقیم به درخواست
-                # برای این کار باید اسکیم و دامنه را به صورت دستی تنظیم کنیم چون در کامند به request دسترسی نداریم
-                domain = "your-domain.com" # <-- آدرس دامنه خود را اینجا وارد کنید
-                scheme = "https"
-                request_url = f"{scheme}://{domain}{reverse('request_detail', args=[req.id])}"
-
-                message = f"""
-کاربر گرامی {recipient.get_full_name() or recipient.username}،
+    def _unthrottled(self, queryset, throttle_since, chunk_size):
+        """
+        ردیف‌ها را دسته‌ای می‌خواند و مواردی را که اخیراً به همان گیرنده یادآوری شده‌اند کنار می‌گذارد.
+        دسته‌ها با keyset روی (مسئول، شناسه) خوانده می‌شوند تا هنگام ثبت یادآوری‌ها cursor بازی روی
+        جدول نماند (در SQLite، cursor باز قفل خواندن را نگه می‌دارد و با نوشتن ویوها بن‌بست می‌سازد).
+        """
+        chunk = list(queryset[:chunk_size])
+        while chunk:
+            last = chunk[-1]
+            yield from self._filter_chunk(chunk, throttle_since)
+            if len(chunk) < chunk_size:
+                return
+            chunk = list(queryset.filter(
+                Q(current_assignee_id__gt=last.current_assignee_id) | Q(current_assignee_id=last.current_assignee_id, id__gt=last.id)
+            )[:chunk_size])
 
-این یک یادآوری است که مهلت انجام وظیفه زیر به پایان رسیده است:
+    def _filter_chunk(self, chunk, throttle_since):
+        self.stats['scanned'] += len(chunk)
+        recent = recently_reminded(((req.id, req.current_assignee_id) for req in chunk), throttle_since)
+        for req in chunk:
+            if (req.id, req.current_assignee_id) in recent:
+                self.stats['throttled'] += 1
+            else:
+                yield req
 
-- شناسه درخواست: #{req.id}
-- فرایند: {req.process.name}
-- تاریخ سررسید: {req.due_date.strftime('%Y-%m-%d')}
-
-لطفاً در اسرع وقت جهت بررسی و اقدام به سیستم مراجعه فرمایید:
-{request_url}
-
-با تشکر،
-سیستم اتوماسیون
-"""
-                try:
-                    send_mail(
-                        subject,
-                        message,
-                        settings.DEFAULT_FROM_EMAIL,
-                        [recipient.email],
-                        fail_silently=False,
-                    )
-                    self.stdout.write(self.style.SUCCESS(f'ایمیل یادآوری برای درخواست #{req.id} به {recipient.email} ارسال شد.'))
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f'خطا در ارسال ایمیل برای درخواست #{req.id}: {e}'))
-        
-        self.stdout.write(self.style.SUCCESS('عملیات ارسال یادآوری‌ها به پایان رسید.'))
\ No newline at end of file
+    def _flush(self, groups):
+        if not groups:
+            return
+        self.stats['recipients'] += len(groups)
+        groups = [(requests[0].current_assignee, requests) for requests in groups]
+        if self.dry_run:
+            for recipient, requests in groups:
+                build_reminder_message(recipient, requests)
+            return
+        sent, failed = deliver(
+            groups, build_reminder_message, self.now, workers=self.workers,
+            log=lambda message: self.stdout.write(self.style.ERROR(message)),
+        )
+        self.stats['sent'] += sent
+        self.stats['failed'] += failed
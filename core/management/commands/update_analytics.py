@@ -0,0 +1,32 @@
+# core/management/commands/update_analytics.py
+
+import time
+from django.core.management.base import BaseCommand
+from core.analytics import reset_analytics, update_analytics
+
+class Command(BaseCommand):
+    help = 'Folds new requests and history rows into the per-step and per-user daily SLA rollup tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--rebuild', action='store_true', help='Delete the rollups and rebuild them from the whole history.')
+        parser.add_argument('--loop', action='store_true', help='Keep running and fold in new rows periodically.')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds between runs with --loop.')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            reset_analytics()
+            self.stdout.write('داده‌های تجمیعی قبلی حذف شد.')
+        try:
+            while True:
+                started = time.monotonic()
+                totals = update_analytics(options['batch_size'], log=self.stdout.write if options['verbosity'] > 1 else None)
+                elapsed = time.monotonic() - started
+                self.stdout.write(self.style.SUCCESS(
+                    f"{totals['requests']} درخواست جدید و {totals['history']} اقدام جدید در {elapsed:.2f} ثانیه به آمار اضافه شد."
+                ))
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
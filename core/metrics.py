@@ -0,0 +1,347 @@
+# core/metrics.py
+
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from django.conf import settings
+
+# ===== تعریف متریک‌ها =====
+# نام: (نوع، توضیح، مرزهای هیستوگرام)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+METRICS = {
+    'http_requests_total': ('counter', 'HTTP requests by URL name, method and status code.', None),
+    'http_request_duration_seconds': ('histogram', 'Time until the response (first byte for streaming responses) by URL name.', LATENCY_BUCKETS),
+    'db_queries_per_request': ('histogram', 'SQL queries executed per HTTP request by URL name.', QUERY_COUNT_BUCKETS),
+    'db_query_duration_seconds_total': ('counter', 'Total time spent in SQL by URL name.', None),
+    'graph_render_duration_seconds': ('histogram', 'Graphviz dot subprocess run time by result.', LATENCY_BUCKETS),
+    'email_send_duration_seconds': ('histogram', 'SMTP send time per message by result.', LATENCY_BUCKETS),
+}
+
+class MetricsRegistry:
+    """
+    نگه‌داری متریک‌های یک پروسه در حافظه و نوشتن دوره‌ای آن‌ها در یک فایل JSON مخصوص همان پروسه.
+    endpoint متریک‌ها فایل‌های همه پروسه‌ها (وب و دستورات مدیریتی) را جمع می‌زند؛ فایل پروسه‌های
+    خاتمه‌یافته (هنگام خروج، یا در اولین collect پس از کشته شدن پروسه) در metrics-archive.json ادغام
+    و حذف می‌شود تا شمارنده‌ها کاهش پیدا نکنند و تعداد فایل‌ها محدود بماند.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._path = None
+        self._counters = {}
+        self._histograms = {}
+        self._dirty = False
+        self._last_flush = 0.0
+
+    def _check_fork(self):
+        # پروسه فرزند (مثلاً کارگرهای gunicorn با preload) مقادیر والد را به ارث نمی‌برد
+        if os.getpid() != self._pid:
+            self._reset()
+
+    @staticmethod
+    def _key(name, labels):
+        return json.dumps([name, sorted(labels.items())], ensure_ascii=False)
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._check_fork()
+            key = self._key(name, labels)
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._dirty = True
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        with self._lock:
+            self._check_fork()
+            key = self._key(name, labels)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            index = bisect_left(buckets, value)
+            if index < len(buckets):
+                histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+            self._dirty = True
+
+    def snapshot(self):
+        with self._lock:
+            self._check_fork()
+            return {
+                'counters': dict(self._counters),
+                'histograms': {key: {**value, 'buckets': list(value['buckets'])} for key, value in self._histograms.items()},
+            }
+
+    # ===== ذخیره در فایل =====
+    def _file_path(self, directory):
+        if self._path is None:
+            # زمان شروع در نام فایل است تا پروسه جدیدی با همان pid فایل قبلی را بازنویسی نکند
+            self._path = os.path.join(directory, f"metrics-{self._pid}-{time.time_ns()}.json")
+        return self._path
+
+    def flush(self, force=False):
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._check_fork()
+            if not self._dirty or (not force and now - self._last_flush < getattr(settings, 'METRICS_FLUSH_INTERVAL', 1)):
+                return
+            self._last_flush = now
+            self._dirty = False
+            data = {
+                'counters': dict(self._counters),
+                'histograms': {key: {**value, 'buckets': list(value['buckets'])} for key, value in self._histograms.items()},
+            }
+            path = self._file_path(directory)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            _write_json(path, data)
+        except OSError as e:
+            print(f"خطا در ذخیره متریک‌ها: {e}")
+
+    def close(self):
+        """هنگام خروج پروسه: آخرین مقادیر نوشته و فایل پروسه در بایگانی مشترک ادغام می‌شود."""
+        self.flush(force=True)
+        directory = getattr(settings, 'METRICS_DIR', None)
+        with self._lock:
+            self._check_fork()
+            path, self._path = self._path, None
+        if directory and path:
+            try:
+                archive_process_files(directory, [os.path.basename(path)])
+            except OSError as e:
+                print(f"خطا در بایگانی متریک‌ها: {e}")
+
+    def collect(self):
+        """
+        مجموع متریک‌های همه پروسه‌ها؛ بدون METRICS_DIR فقط همین پروسه. فایل پروسه‌های خاتمه‌یافته
+        (که فرصت close نداشته‌اند) پیش از جمع زدن در بایگانی ادغام می‌شوند تا تعداد فایل‌ها رشد نکند.
+        """
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory:
+            return self.snapshot()
+        self.flush(force=True)
+        try:
+            dead = [name for name in _process_files(directory) if not _pid_alive(_file_pid(name))]
+            if dead:
+                archive_process_files(directory, dead)
+        except OSError as e:
+            print(f"خطا در بایگانی متریک‌ها: {e}")
+
+        archive = _read_json(os.path.join(directory, ARCHIVE_FILE)) or {}
+        merged = set(archive.get('merged', []))
+        totals = {'counters': {}, 'histograms': {}}
+        _add_totals(totals, archive)
+        for name in _process_files(directory):
+            # فایلی که ادغام شده ولی هنوز حذف نشده دو بار شمرده نمی‌شود
+            if name not in merged:
+                _add_totals(totals, _read_json(os.path.join(directory, name)) or {})
+        return totals
+
+# ===== بایگانی فایل پروسه‌های خاتمه‌یافته =====
+# مقادیر پروسه‌های تمام‌شده (کارگرهای راه‌اندازی‌شده مجدد، اجراهای cron دستورات) در یک فایل
+# metrics-archive.json جمع می‌شوند تا شمارنده‌ها کم نشوند و تعداد فایل‌ها محدود بماند. نام فایل‌های
+# ادغام‌شده تا حذف شدنشان در بایگانی می‌ماند تا قطع شدن کار بین ادغام و حذف باعث شمارش دوباره نشود.
+ARCHIVE_FILE = 'metrics-archive.json'
+ARCHIVE_LOCK_FILE = 'metrics-archive.lock'
+ARCHIVE_LOCK_TIMEOUT = 10
+
+def _process_files(directory):
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [name for name in names if name.startswith('metrics-') and name.endswith('.json') and name != ARCHIVE_FILE]
+
+def _file_pid(name):
+    try:
+        return int(name.split('-')[1])
+    except (IndexError, ValueError):
+        return None
+
+def _pid_alive(pid):
+    # روی ویندوز os.kill پروسه را می‌کشد؛ آنجا فقط close هنگام خروج بایگانی می‌کند
+    if pid is None or os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as source:
+            return json.load(source)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(path, data):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as output:
+        json.dump(data, output, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+def _add_totals(totals, data):
+    for key, value in data.get('counters', {}).items():
+        totals['counters'][key] = totals['counters'].get(key, 0) + value
+    for key, value in data.get('histograms', {}).items():
+        total = totals['histograms'].get(key)
+        if total is None:
+            totals['histograms'][key] = {**value, 'buckets': list(value['buckets'])}
+            continue
+        total['buckets'] = [a + b for a, b in zip(total['buckets'], value['buckets'])]
+        total['sum'] += value['sum']
+        total['count'] += value['count']
+
+@contextmanager
+def _archive_lock(directory):
+    # قفل فایلی با O_EXCL که روی همه سیستم‌عامل‌ها کار می‌کند؛ قفل رهاشده پس از مهلت شکسته می‌شود
+    path = os.path.join(directory, ARCHIVE_LOCK_FILE)
+    deadline = time.monotonic() + ARCHIVE_LOCK_TIMEOUT
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > ARCHIVE_LOCK_TIMEOUT:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                raise OSError(f"قفل بایگانی متریک‌ها ({path}) آزاد نشد.")
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def archive_process_files(directory, names):
+    """فایل‌های پروسه names را به بایگانی اضافه و سپس حذف می‌کند."""
+    os.makedirs(directory, exist_ok=True)
+    archive_path = os.path.join(directory, ARCHIVE_FILE)
+    with _archive_lock(directory):
+        archive = _read_json(archive_path) or {'counters': {}, 'histograms': {}, 'merged': []}
+        existing = set(_process_files(directory))
+        merged = [name for name in archive.get('merged', []) if name in existing]
+        pending = [name for name in names if name in existing and name not in merged]
+        for name in pending:
+            data = _read_json(os.path.join(directory, name))
+            if data is not None:
+                _add_totals(archive, data)
+            merged.append(name)
+        archive['merged'] = merged
+        _write_json(archive_path, archive)
+        for name in merged:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+registry = MetricsRegistry()
+atexit.register(registry.close)
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+@contextmanager
+def timed(name, **labels):
+    """
+    زمان اجرای بلوک را در هیستوگرام name ثبت می‌کند؛ برچسب result برابر ok یا error است.
+    بیرون از درخواست‌های وب (مثلاً send_outbox --loop) هم متریک‌ها به صورت دوره‌ای در فایل نوشته می‌شوند.
+    """
+    started = time.perf_counter()
+    result = 'error'
+    try:
+        yield
+        result = 'ok'
+    finally:
+        registry.observe(name, time.perf_counter() - started, result=result, **labels)
+        registry.flush()
+
+# ===== شمارش کوئری‌های هر درخواست =====
+# wrapper روی همه اتصال‌ها نصب می‌شود و فقط وقتی میان‌افزار آمار درخواست جاری را تنظیم کرده باشد
+# اندازه می‌گیرد؛ contextvar به رشته‌ای که ویوهای sync در ASGI اجرا می‌شوند هم منتقل می‌شود.
+current_query_stats = contextvars.ContextVar('current_query_stats', default=None)
+
+def query_wrapper(execute, sql, params, many, context):
+    stats = current_query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats['count'] += 1
+        stats['seconds'] += time.perf_counter() - started
+
+def install_query_wrapper(connection):
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+# ===== خروجی Prometheus =====
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(items, extra=()):
+    items = list(items) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in items) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render_prometheus():
+    """متن قالب Prometheus (text exposition format 0.0.4) برای مجموع متریک‌ها."""
+    data = collect_grouped()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in data.get(name, []):
+            if kind == 'counter':
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value['buckets']):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {value['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+    return '\n'.join(lines) + '\n'
+
+def collect_grouped():
+    """متریک‌های جمع‌شده، گروه‌بندی‌شده بر اساس نام: {name: [(labels, value), ...]}"""
+    totals = registry.collect()
+    grouped = {}
+    for section in ('counters', 'histograms'):
+        for key, value in sorted(totals[section].items()):
+            name, labels = json.loads(key)
+            if name in METRICS:
+                grouped.setdefault(name, []).append(([tuple(item) for item in labels], value))
+    return grouped
@@ -0,0 +1,110 @@
+# core/middleware.py
+
+import random
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from . import metrics, profiling
+
+def _view_label(request):
+    # نام URL به جای مسیر تا تعداد سری‌های زمانی محدود بماند
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+class MetricsMiddleware:
+    """
+    برای هر درخواست تعداد، زمان پاسخ و تعداد/زمان کوئری‌های SQL را به تفکیک نام URL ثبت می‌کند.
+    هم در WSGI و هم در ASGI کار می‌کند؛ برای پاسخ‌های جریانی زمان تا ساخته شدن پاسخ سنجیده می‌شود.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        stats = {'count': 0, 'seconds': 0.0}
+        token = metrics.current_query_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current_query_stats.reset(token)
+        self._record(request, response, time.perf_counter() - started, stats)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        stats = {'count': 0, 'seconds': 0.0}
+        token = metrics.current_query_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current_query_stats.reset(token)
+        self._record(request, response, time.perf_counter() - started, stats)
+        return response
+
+    @staticmethod
+    def _record(request, response, seconds, stats):
+        view = _view_label(request)
+        metrics.inc('http_requests_total', view=view, method=request.method, status=response.status_code)
+        metrics.observe('http_request_duration_seconds', seconds, view=view)
+        metrics.observe('db_queries_per_request', stats['count'], view=view)
+        metrics.inc('db_query_duration_seconds_total', stats['seconds'], view=view)
+        metrics.registry.flush()
+
+class ProfilingMiddleware:
+    """
+    پروفایل نمونه‌برداری (پشته‌ها و لاگ SQL) برای درخواست‌هایی که به صورت تصادفی انتخاب شده‌اند،
+    کندتر از PROFILING_SLOW_THRESHOLD بوده‌اند یا ادمین با هدر X-Profile درخواست کرده است.
+    فقط sync است تا در ASGI هم ویو در همان رشته میان‌افزار اجرا و نمونه‌برداری شود؛ با
+    PROFILING_ENABLED=False از زنجیره میان‌افزارها حذف می‌شود و هزینه‌ای ندارد.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sampled = random.random() < getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+        requested = bool(request.headers.get('X-Profile')) and request.user.is_staff
+        slow_threshold = getattr(settings, 'PROFILING_SLOW_THRESHOLD', None)
+        if not (sampled or requested or slow_threshold is not None):
+            return self.get_response(request)
+
+        thread_id = threading.get_ident()
+        sql_log = {'count': 0, 'seconds': 0.0, 'queries': []}
+        token = profiling.current_sql_log.set(sql_log)
+        samples = profiling.sampler.watch(thread_id)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - started
+            profiling.sampler.unwatch(thread_id)
+            profiling.current_sql_log.reset(token)
+
+        if requested:
+            reason = 'REQUESTED'
+        elif slow_threshold is not None and duration >= slow_threshold:
+            reason = 'SLOW'
+        elif sampled:
+            reason = 'SAMPLED'
+        else:
+            return response
+        try:
+            capture = profiling.save_capture(reason, request, response, duration, samples, sql_log)
+        except Exception as e:
+            print(f"خطا در ذخیره پروفایل: {e}")
+            return response
+        if requested:
+            response['X-Profile-Id'] = str(capture.id)
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_request_current_assignee_request_current_step_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='request',
+            name='due_date',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='تاریخ سررسید'),
+        ),
+    ]
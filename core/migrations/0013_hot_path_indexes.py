@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_request_due_date_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'is_read', '-created_at'], name='notification_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['user', '-created_at'], name='notification_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(fields=['current_assignee', 'status', '-created_at', '-id'], name='request_inbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(condition=models.Q(('status', 'IN_PROGRESS')), fields=['current_assignee', '-created_at', '-id'], name='request_open_inbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(fields=['initiator_user', '-created_at', '-id'], name='request_outbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requesthistory',
+            index=models.Index(fields=['request', 'timestamp'], name='history_timeline_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counters', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='کاربر')),
+                ('unread_notifications', models.IntegerField(default=0, verbose_name='اعلان\u200cهای خوانده\u200cنشده')),
+                ('open_tasks', models.IntegerField(default=0, verbose_name='وظایف باز در کارتابل')),
+                ('last_notification_id', models.BigIntegerField(default=0, verbose_name='شناسه آخرین اعلان')),
+            ],
+        ),
+    ]
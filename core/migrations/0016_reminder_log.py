@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_outgoing_email'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReminderLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_sent_at', models.DateTimeField(verbose_name='زمان آخرین یادآوری')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminder_logs', to=settings.AUTH_USER_MODEL, verbose_name='گیرنده')),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminder_logs', to='core.request', verbose_name='درخواست')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('request', 'recipient'), name='unique_reminder_per_recipient')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_reminder_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeadlineChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('request_id', models.BigIntegerField(verbose_name='شناسه درخواست')),
+                ('due_date', models.DateTimeField(blank=True, null=True, verbose_name='سررسید جدید')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='زمان ثبت')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_deadline_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='request',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False, verbose_name='نسخه'),
+        ),
+    ]
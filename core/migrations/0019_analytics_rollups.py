@@ -0,0 +1,59 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_request_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsWatermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='نام')),
+                ('last_history_id', models.BigIntegerField(default=0, verbose_name='آخرین شناسه تاریخچه')),
+                ('last_request_id', models.BigIntegerField(default=0, verbose_name='آخرین شناسه درخواست')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='آخرین به\u200cروزرسانی')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='requesthistory',
+            name='to_step',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.processstep', verbose_name='مرحله مقصد'),
+        ),
+        migrations.CreateModel(
+            name='StepDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='روز')),
+                ('arrivals', models.PositiveIntegerField(default=0, verbose_name='ورودی')),
+                ('completions', models.PositiveIntegerField(default=0, verbose_name='خروجی')),
+                ('breaches', models.PositiveIntegerField(default=0, verbose_name='تعداد تأخیر از مهلت')),
+                ('dwell_seconds', models.BigIntegerField(default=0, verbose_name='مجموع مدت توقف (ثانیه)')),
+                ('dwell_histogram', models.JSONField(default=list, verbose_name='هیستوگرام مدت توقف')),
+                ('step', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='core.processstep', verbose_name='مرحله')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('step', 'day'), name='unique_step_daily_stats')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='روز')),
+                ('completions', models.PositiveIntegerField(default=0, verbose_name='اقدامات انجام\u200cشده')),
+                ('breaches', models.PositiveIntegerField(default=0, verbose_name='تعداد تأخیر از مهلت')),
+                ('dwell_seconds', models.BigIntegerField(default=0, verbose_name='مجموع مدت توقف (ثانیه)')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to=settings.AUTH_USER_MODEL, verbose_name='کاربر')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'day'), name='unique_user_daily_stats')],
+            },
+        ),
+    ]
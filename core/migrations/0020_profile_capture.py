@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_analytics_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileCapture',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='زمان ثبت')),
+                ('reason', models.CharField(choices=[('SAMPLED', 'نمونه\u200cگیری تصادفی'), ('SLOW', 'کندتر از آستانه'), ('REQUESTED', 'درخواست ادمین (هدر)')], max_length=20, verbose_name='دلیل ثبت')),
+                ('method', models.CharField(max_length=10, verbose_name='متد')),
+                ('path', models.CharField(max_length=500, verbose_name='مسیر')),
+                ('view_name', models.CharField(blank=True, max_length=200, verbose_name='نام ویو')),
+                ('status_code', models.PositiveSmallIntegerField(verbose_name='کد پاسخ')),
+                ('duration_ms', models.FloatField(verbose_name='مدت (میلی\u200cثانیه)')),
+                ('query_count', models.PositiveIntegerField(default=0, verbose_name='تعداد کوئری')),
+                ('query_ms', models.FloatField(default=0, verbose_name='زمان کوئری\u200cها (میلی\u200cثانیه)')),
+                ('sample_count', models.PositiveIntegerField(default=0, verbose_name='تعداد نمونه')),
+                ('file_name', models.CharField(max_length=100, verbose_name='فایل پروفایل')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='کاربر')),
+            ],
+            options={
+                'verbose_name': 'پروفایل درخواست',
+                'verbose_name_plural': 'پروفایل\u200cهای درخواست',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
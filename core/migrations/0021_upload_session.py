@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:38
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_profile_capture'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255, verbose_name='نام فایل')),
+                ('size', models.BigIntegerField(verbose_name='حجم کل (بایت)')),
+                ('received', models.BigIntegerField(default=0, verbose_name='حجم دریافت\u200cشده (بایت)')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='زمان شروع')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='آخرین تکه')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='کاربر')),
+            ],
+        ),
+    ]
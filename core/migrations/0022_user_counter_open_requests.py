@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:55
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_open_requests(apps, schema_editor):
+    # ردیف‌های موجود شمارنده با مقدار واقعی پر می‌شوند؛ ردیف‌های جدید با rebuild_counters ساخته می‌شوند
+    Request = apps.get_model('core', 'Request')
+    UserCounter = apps.get_model('core', 'UserCounter')
+    totals = (
+        Request.objects.filter(status='IN_PROGRESS').values('initiator_user_id')
+        .annotate(total=Count('id')).order_by().values_list('initiator_user_id', 'total')
+    )
+    for user_id, total in totals:
+        UserCounter.objects.filter(user_id=user_id).update(open_requests=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_upload_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercounter',
+            name='open_requests',
+            field=models.IntegerField(default=0, verbose_name='درخواست\u200cهای ارسالی در حال بررسی'),
+        ),
+        migrations.RunPython(fill_open_requests, migrations.RunPython.noop),
+    ]
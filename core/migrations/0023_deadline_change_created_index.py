@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_user_counter_open_requests'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deadlinechange',
+            index=models.Index(fields=['created_at'], name='deadline_change_created_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:07
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_deadline_change_created_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='request',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='تاریخ ثبت'),
+        ),
+        migrations.AlterField(
+            model_name='requesthistory',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='زمان اقدام'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:08
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_request_timestamps_default'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='notification_unread_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='request',
+            name='request_open_inbox_idx',
+        ),
+    ]
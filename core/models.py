@@ -1,9 +1,16 @@
 # core/models.py
 
+import uuid
+from datetime import timedelta
 from django.db import models
+from django.db.models import Case, Q, Value, When
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone # ایمپورت جدید
 
+# درخواستی که کمتر از این مدت تا سررسیدش مانده باشد «فوری» است
+# (معادل remaining_days <= 1 در deadline_status)
+URGENT_DEADLINE_WINDOW = timedelta(days=2)
+
 # مدل سفارشی کاربر برای اضافه کردن فیلد مدیر
 class User(AbstractUser):
     manager = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='subordinates')
@@ -36,6 +43,28 @@ class ProcessStep(models.Model):
     def __str__(self):
         return f"{self.process.name} - مرحله {self.step_order}: {self.name}"
 
+# ===== محاسبه وضعیت سررسید در سمت دیتابیس =====
+class RequestQuerySet(models.QuerySet):
+    def with_deadline_status(self, now=None):
+        """وضعیت سررسید (overdue / urgent / normal) را به صورت ستون deadline_state به کوئری اضافه می‌کند."""
+        now = now or timezone.now()
+        return self.annotate(deadline_state=Case(
+            When(~Q(status='IN_PROGRESS') | Q(due_date__isnull=True), then=Value('normal')),
+            When(due_date__lt=now, then=Value('overdue')),
+            When(due_date__lt=now + URGENT_DEADLINE_WINDOW, then=Value('urgent')),
+            default=Value('normal'),
+            output_field=models.CharField(),
+        ))
+
+    def overdue(self, now=None):
+        """درخواست‌های در حال بررسی که سررسیدشان گذشته است (از ایندکس due_date استفاده می‌کند)."""
+        now = now or timezone.now()
+        return self.filter(status='IN_PROGRESS', due_date__lt=now)
+
+    def urgent(self, now=None):
+        now = now or timezone.now()
+        return self.filter(status='IN_PROGRESS', due_date__gte=now, due_date__lt=now + URGENT_DEADLINE_WINDOW)
+
 # جدول اصلی برای هر درخواست ثبت شده
 class Request(models.Model):
     STATUS_CHOICES = [
@@ -57,10 +86,23 @@ class Request(models.Model):
     )
     
     status = models.CharField("وضعیت", max_length=20, choices=STATUS_CHOICES, default='IN_PROGRESS')
-    created_at = models.DateTimeField("تاریخ ثبت", auto_now_add=True)
+    # زمان ثبت (و زمان اقدام در تاریخچه) را مسیرهای نوشتن خودشان می‌دهند تا سررسید از همان لحظه محاسبه شود
+    created_at = models.DateTimeField("تاریخ ثبت", default=timezone.now, editable=False)
     updated_at = models.DateTimeField("آخرین بروزرسانی", auto_now=True)
     # ===== فیلد جدید برای تاریخ سررسید =====
-    due_date = models.DateTimeField("تاریخ سررسید", null=True, blank=True)
+    due_date = models.DateTimeField("تاریخ سررسید", null=True, blank=True, db_index=True)
+    # ===== نسخه برای کنترل هم‌زمانی خوش‌بینانه (با هر انتقال یک واحد افزایش می‌یابد) =====
+    version = models.PositiveIntegerField("نسخه", default=1, editable=False)
+
+    objects = RequestQuerySet.as_manager()
+
+    class Meta:
+        # ایندکس‌ها دقیقاً مطابق مسیرهای پرتکرار: کارتابل ورودی و درخواست‌های ارسالی داشبورد. برای هر مسیر
+        # فقط یک ایندکس ترکیبی نگه داشته می‌شود (نسخه جزئی در MySQL پشتیبانی نمی‌شود و هر درج را گران‌تر می‌کند)
+        indexes = [
+            models.Index(fields=['current_assignee', 'status', '-created_at', '-id'], name='request_inbox_idx'),
+            models.Index(fields=['initiator_user', '-created_at', '-id'], name='request_outbox_idx'),
+        ]
 
     def __str__(self):
         return f"درخواست {self.id} برای {self.process.name} توسط {self.initiator_user.username}"
@@ -68,6 +110,9 @@ class Request(models.Model):
     # ===== متد کمکی برای بررسی وضعیت سررسید =====
     @property
     def deadline_status(self):
+        # اگر کوئری با with_deadline_status ساخته شده باشد، مقدار محاسبه‌شده در دیتابیس استفاده می‌شود
+        if 'deadline_state' in self.__dict__:
+            return self.deadline_state
         if self.status != 'IN_PROGRESS' or not self.due_date:
             return "normal"
         
@@ -93,14 +138,19 @@ class RequestHistory(models.Model):
     ]
     request = models.ForeignKey(Request, on_delete=models.CASCADE, related_name='history', verbose_name="درخواست")
     step = models.ForeignKey(ProcessStep, on_delete=models.PROTECT, null=True, blank=True, verbose_name="مرحله")
+    # مرحله‌ای که درخواست پس از این اقدام وارد آن شد (برای محاسبه ورودی‌ها در آمار)
+    to_step = models.ForeignKey(ProcessStep, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="مرحله مقصد")
     action_user = models.ForeignKey(User, on_delete=models.PROTECT, verbose_name="اقدام کننده")
     action_type = models.CharField("نوع اقدام", max_length=50, choices=ACTION_TYPES)
-    timestamp = models.DateTimeField("زمان اقدام", auto_now_add=True)
+    timestamp = models.DateTimeField("زمان اقدام", default=timezone.now, editable=False)
     comments = models.TextField("توضیحات", blank=True, null=True)
     attachment = models.FileField("فایل پیوست", upload_to='attachments/%Y/%m/%d/', null=True, blank=True)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['request', 'timestamp'], name='history_timeline_idx'),
+        ]
 
     def __str__(self):
         return f"تاریخچه برای درخواست {self.request.id} در مرحله {self.step.name if self.step else 'N/A'}"
@@ -115,6 +165,170 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'is_read', '-created_at'], name='notification_feed_idx'),
+        ]
+
+    def __str__(self):
+        return f"اعلان برای {self.user.username}: {self.message}"
+
+# ===== شمارنده‌های تجمیعی هر کاربر (به جای COUNT(*) در هر بار بارگذاری) =====
+class UserCounter(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='counters', verbose_name="کاربر")
+    unread_notifications = models.IntegerField("اعلان‌های خوانده‌نشده", default=0)
+    open_tasks = models.IntegerField("وظایف باز در کارتابل", default=0)
+    open_requests = models.IntegerField("درخواست‌های ارسالی در حال بررسی", default=0)
+    last_notification_id = models.BigIntegerField("شناسه آخرین اعلان", default=0)
+
+    def __str__(self):
+        return f"شمارنده‌های {self.user.username}"
+
+# ===== صف خروجی ایمیل‌ها (outbox) =====
+class OutgoingEmail(models.Model):
+    STATUS_CHOICES = [
+        ('PENDING', 'در انتظار ارسال'),
+        ('SENT', 'ارسال شده'),
+        ('FAILED', 'ناموفق'),
+    ]
+    to_email = models.EmailField("گیرنده")
+    subject = models.CharField("موضوع", max_length=255)
+    body = models.TextField("متن")
+    status = models.CharField("وضعیت", max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.PositiveIntegerField("تعداد تلاش", default=0)
+    next_attempt_at = models.DateTimeField("زمان تلاش بعدی", default=timezone.now)
+    lease_token = models.UUIDField("شناسه برداشت", null=True, blank=True, editable=False)
+    last_error = models.TextField("آخرین خطا", blank=True)
+    created_at = models.DateTimeField("زمان ایجاد", auto_now_add=True)
+    sent_at = models.DateTimeField("زمان ارسال", null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['next_attempt_at', 'id'], condition=Q(status='PENDING'), name='outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"ایمیل به {self.to_email}: {self.subject}"
+
+# ===== سابقه یادآوری‌های ارسال‌شده (برای جلوگیری از ارسال تکراری) =====
+class ReminderLog(models.Model):
+    request = models.ForeignKey(Request, on_delete=models.CASCADE, related_name='reminder_logs', verbose_name="درخواست")
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reminder_logs', verbose_name="گیرنده")
+    last_sent_at = models.DateTimeField("زمان آخرین یادآوری")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['request', 'recipient'], name='unique_reminder_per_recipient'),
+        ]
+
+    def __str__(self):
+        return f"یادآوری درخواست {self.request_id} برای {self.recipient_id}"
+
+# ===== جدول تغییرات سررسید (خوراک زمان‌بند run_scheduler) =====
+class DeadlineChange(models.Model):
+    # کلید خارجی نیست تا حذف درخواست هم قابل ثبت باشد
+    request_id = models.BigIntegerField("شناسه درخواست")
+    due_date = models.DateTimeField("سررسید جدید", null=True, blank=True)
+    created_at = models.DateTimeField("زمان ثبت", auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        # بازخوانی بازه اخیر در run_scheduler و حذف ردیف‌های قدیمی بر اساس زمان ثبت
+        indexes = [models.Index(fields=['created_at'], name='deadline_change_created_idx')]
 
     def __str__(self):
-        return f"اعلان برای {self.user.username}: {self.message}"
\ No newline at end of file
+        return f"تغییر سررسید درخواست {self.request_id}"
+
+# ===== جداول تجمیعی آمار SLA (به‌روزرسانی تدریجی توسط دستور update_analytics) =====
+# مرزهای بالای سطل‌های هیستوگرام مدت توقف (ساعت)؛ سطل آخر بی‌انتهاست
+DWELL_HISTOGRAM_BOUNDS = [1, 2, 4, 8, 12, 24, 48, 72, 120, 168, 240, 336, 504, 720, 1440]
+
+class StepDailyStats(models.Model):
+    day = models.DateField("روز")
+    step = models.ForeignKey(ProcessStep, on_delete=models.CASCADE, related_name='daily_stats', verbose_name="مرحله")
+    arrivals = models.PositiveIntegerField("ورودی", default=0)
+    completions = models.PositiveIntegerField("خروجی", default=0)
+    breaches = models.PositiveIntegerField("تعداد تأخیر از مهلت", default=0)
+    dwell_seconds = models.BigIntegerField("مجموع مدت توقف (ثانیه)", default=0)
+    dwell_histogram = models.JSONField("هیستوگرام مدت توقف", default=list)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['step', 'day'], name='unique_step_daily_stats'),
+        ]
+
+    def __str__(self):
+        return f"آمار مرحله {self.step_id} در {self.day}"
+
+class UserDailyStats(models.Model):
+    day = models.DateField("روز")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_stats', verbose_name="کاربر")
+    completions = models.PositiveIntegerField("اقدامات انجام‌شده", default=0)
+    breaches = models.PositiveIntegerField("تعداد تأخیر از مهلت", default=0)
+    dwell_seconds = models.BigIntegerField("مجموع مدت توقف (ثانیه)", default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='unique_user_daily_stats'),
+        ]
+
+    def __str__(self):
+        return f"آمار کاربر {self.user_id} در {self.day}"
+
+class AnalyticsWatermark(models.Model):
+    # آخرین شناسه‌های پردازش‌شده از جداول منبع؛ فقط ردیف‌های جدیدتر از این نقطه خوانده می‌شوند
+    name = models.CharField("نام", max_length=50, primary_key=True)
+    last_history_id = models.BigIntegerField("آخرین شناسه تاریخچه", default=0)
+    last_request_id = models.BigIntegerField("آخرین شناسه درخواست", default=0)
+    updated_at = models.DateTimeField("آخرین به‌روزرسانی", auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+# ===== پروفایل‌های ثبت‌شده از درخواست‌های وب (میان‌افزار ProfilingMiddleware) =====
+class ProfileCapture(models.Model):
+    REASON_CHOICES = [
+        ('SAMPLED', 'نمونه‌گیری تصادفی'),
+        ('SLOW', 'کندتر از آستانه'),
+        ('REQUESTED', 'درخواست ادمین (هدر)'),
+    ]
+
+    created_at = models.DateTimeField("زمان ثبت", auto_now_add=True)
+    reason = models.CharField("دلیل ثبت", max_length=20, choices=REASON_CHOICES)
+    method = models.CharField("متد", max_length=10)
+    path = models.CharField("مسیر", max_length=500)
+    view_name = models.CharField("نام ویو", max_length=200, blank=True)
+    status_code = models.PositiveSmallIntegerField("کد پاسخ")
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="کاربر")
+    duration_ms = models.FloatField("مدت (میلی‌ثانیه)")
+    query_count = models.PositiveIntegerField("تعداد کوئری", default=0)
+    query_ms = models.FloatField("زمان کوئری‌ها (میلی‌ثانیه)", default=0)
+    sample_count = models.PositiveIntegerField("تعداد نمونه", default=0)
+    # فایل JSON (پشته‌های نمونه‌برداری‌شده و لاگ SQL) در PROFILING_DIR؛ خارج از MEDIA_ROOT تا عمومی نباشد
+    file_name = models.CharField("فایل پروفایل", max_length=100)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "پروفایل درخواست"
+        verbose_name_plural = "پروفایل‌های درخواست"
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+# ===== بارگذاری تکه‌ای و قابل ادامه پیوست‌ها (core/uploads.py) =====
+class UploadSession(models.Model):
+    # شناسه همان توکنی است که فرم اقدام درخواست در فیلد attachment_token می‌فرستد
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', verbose_name="کاربر")
+    file_name = models.CharField("نام فایل", max_length=255)
+    size = models.BigIntegerField("حجم کل (بایت)")
+    received = models.BigIntegerField("حجم دریافت‌شده (بایت)", default=0)
+    created_at = models.DateTimeField("زمان شروع", auto_now_add=True)
+    updated_at = models.DateTimeField("آخرین تکه", auto_now=True)
+
+    def __str__(self):
+        return f"بارگذاری {self.file_name} ({self.received}/{self.size})"
+
+    @property
+    def is_complete(self):
+        return self.received >= self.size
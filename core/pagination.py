@@ -0,0 +1,92 @@
+# core/pagination.py
+
+import base64
+import json
+from django.db import models
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+# تعداد ردیف‌های هر صفحه در جداول داشبورد
+DASHBOARD_PAGE_SIZE = 25
+
+def _field_name(order):
+    return order.lstrip('-')
+
+def encode_cursor(obj, ordering):
+    """مقادیر ستون‌های مرتب‌سازی آخرین ردیف صفحه را به یک رشته امن برای URL تبدیل می‌کند."""
+    values = [getattr(obj, _field_name(order)) for order in ordering]
+    # isoformat دقت میکروثانیه را حفظ می‌کند (DjangoJSONEncoder آن را به میلی‌ثانیه کوتاه می‌کند)
+    values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+    raw = json.dumps(values)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, model, ordering):
+    """نشانگر صفحه را برمی‌گرداند؛ در صورت نامعتبر بودن، None (یعنی صفحه اول)."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(values, list) or len(values) != len(ordering):
+        return None
+    decoded = []
+    for order, value in zip(ordering, values):
+        field = model._meta.get_field(_field_name(order))
+        if value is not None and isinstance(field, models.DateTimeField):
+            value = parse_datetime(value)
+            if value is None:
+                return None
+        decoded.append(value)
+    return decoded
+
+def _keyset_filter(model, ordering, values):
+    """
+    شرط «بعد از نشانگر» برای مرتب‌سازی چندستونی؛ برای (-created_at, -id):
+    created_at < v1 OR (created_at = v1 AND id < v2)
+    مقادیر NULL ستون‌های nullable همیشه در انتهای ترتیب قرار می‌گیرند.
+    """
+    condition = Q()
+    equal_prefix = Q()
+    for order, value in zip(ordering, values):
+        name = _field_name(order)
+        if value is None:
+            equal_prefix &= Q(**{f"{name}__isnull": True})
+            continue
+        lookup = 'lt' if order.startswith('-') else 'gt'
+        after = Q(**{f"{name}__{lookup}": value})
+        if model._meta.get_field(name).null:
+            after |= Q(**{f"{name}__isnull": True})
+        condition |= equal_prefix & after
+        equal_prefix &= Q(**{name: value})
+    return condition
+
+def _order_by(model, ordering):
+    # فقط برای ستون‌های nullable ترتیب NULLS LAST اعمال می‌شود تا ایندکس‌های معمولی قابل استفاده بمانند
+    expressions = []
+    for order in ordering:
+        name = _field_name(order)
+        if model._meta.get_field(name).null:
+            expression = F(name).desc(nulls_last=True) if order.startswith('-') else F(name).asc(nulls_last=True)
+            expressions.append(expression)
+        else:
+            expressions.append(order)
+    return expressions
+
+def keyset_page(queryset, cursor=None, ordering=('-created_at', '-id'), page_size=DASHBOARD_PAGE_SIZE):
+    """
+    صفحه‌بندی بر اساس نشانگر (keyset): به جای OFFSET، ردیف‌های بعد از آخرین ردیف صفحه
+    قبل خوانده می‌شوند؛ هزینه هر صفحه مستقل از تعداد کل ردیف‌هاست.
+    خروجی: (ردیف‌ها، نشانگر صفحه بعد یا None)
+    """
+    model = queryset.model
+    queryset = queryset.order_by(*_order_by(model, ordering))
+    values = decode_cursor(cursor, model, ordering)
+    if values is not None:
+        queryset = queryset.filter(_keyset_filter(model, ordering, values))
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1], ordering)
+    return rows, next_cursor
@@ -0,0 +1,95 @@
+# core/process_definitions.py
+
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+from django.conf import settings
+from .models import ProcessStep, User
+from .utils import get_process_graph_version
+
+# نسخه فشرده و تغییرناپذیر یک مرحله (فقط اطلاعات لازم برای مسیریابی و نمایش)
+CompiledStep = namedtuple('CompiledStep', [
+    'id', 'name', 'step_order', 'responsible_unit', 'deadline_days', 'default_responsible_user_id',
+])
+
+class ProcessDefinition:
+    """
+    تعریف کامپایل‌شده یک فرایند: مراحل مرتب‌شده به همراه جستجوی مرحله اول/بعدی/قبلی و
+    مسئولان پیش‌فرض. پس از ساخت تغییر نمی‌کند و بین درخواست‌های یک پروسه به اشتراک گذاشته می‌شود.
+    """
+
+    def __init__(self, process_id, version, steps, default_assignees):
+        self.process_id = process_id
+        self.version = version
+        self.steps = tuple(steps)
+        self._positions = MappingProxyType({step.id: index for index, step in enumerate(self.steps)})
+        self._default_assignees = MappingProxyType(default_assignees)
+
+    @property
+    def first_step(self):
+        return self.steps[0] if self.steps else None
+
+    def get_step(self, step_id):
+        position = self._positions.get(step_id)
+        return None if position is None else self.steps[position]
+
+    def next_step(self, step_id):
+        position = self._positions.get(step_id)
+        if position is None or position + 1 >= len(self.steps):
+            return None
+        return self.steps[position + 1]
+
+    def previous_steps(self, step_id):
+        """مراحلی که درخواست می‌تواند به آن‌ها بازگردانده شود (به ترتیب)."""
+        position = self._positions.get(step_id)
+        return self.steps[:position] if position else ()
+
+    def default_assignee(self, step):
+        """مسئول پیش‌فرض مرحله (نمونه کاربر) یا None؛ این نمونه‌ها مشترک‌اند و نباید تغییر داده شوند."""
+        if step is None or step.default_responsible_user_id is None:
+            return None
+        return self._default_assignees.get(step.default_responsible_user_id)
+
+# کش درون‌پروسه‌ای تعریف‌ها: {process_id: (تعریف، زمان آخرین بررسی نسخه)}. اعتبار هر مورد با نسخه
+# فرایند (همان نسخه‌ای که با تغییر مراحل یا مسئولان در signals عوض می‌شود) سنجیده می‌شود، اما نسخه
+# هر PROCESS_DEFINITION_TTL ثانیه یک بار از کش مشترک خوانده می‌شود؛ پس پروسه‌های دیگر تغییرات را
+# حداکثر با همین تأخیر می‌بینند. پروسه‌ای که تغییر را ذخیره کرده، تعریف را فوراً کنار می‌گذارد.
+_definitions = {}
+_definitions_lock = threading.Lock()
+
+def _compile_process(process_id, version):
+    steps = [
+        CompiledStep(*values)
+        for values in ProcessStep.objects.filter(process_id=process_id).order_by('step_order', 'id').values_list(
+            'id', 'name', 'step_order', 'responsible_unit', 'deadline_days', 'default_responsible_user_id',
+        )
+    ]
+    user_ids = {step.default_responsible_user_id for step in steps} - {None}
+    default_assignees = User.objects.in_bulk(user_ids) if user_ids else {}
+    return ProcessDefinition(process_id, version, steps, default_assignees)
+
+def get_process_definition(process_id):
+    """
+    تعریف کامپایل‌شده فرایند؛ در فاصله PROCESS_DEFINITION_TTL از آخرین بررسی بدون کوئری و بدون
+    خواندن کش مشترک، و پس از آن تا وقتی نسخه فرایند عوض نشده فقط با خواندن نسخه برگردانده می‌شود.
+    """
+    now = time.monotonic()
+    entry = _definitions.get(process_id)
+    if entry is not None and now - entry[1] < getattr(settings, 'PROCESS_DEFINITION_TTL', 5):
+        return entry[0]
+    # نسخه قبل از خواندن مراحل گرفته می‌شود تا تغییر هم‌زمان به کامپایل مجدد در بررسی بعدی منجر شود
+    version = get_process_graph_version(process_id)
+    if entry is not None and entry[0].version == version:
+        definition = entry[0]
+    else:
+        definition = _compile_process(process_id, version)
+    with _definitions_lock:
+        _definitions[process_id] = (definition, now)
+    return definition
+
+def forget_process_definitions(*process_ids):
+    """تعریف فرایندها را در همین پروسه باطل می‌کند تا تغییر ذخیره‌شده بدون انتظار برای TTL دیده شود."""
+    with _definitions_lock:
+        for process_id in process_ids:
+            _definitions.pop(process_id, None)
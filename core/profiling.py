@@ -0,0 +1,179 @@
+# core/profiling.py
+
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .models import ProfileCapture
+
+MAX_STACK_DEPTH = 128
+MAX_LOGGED_QUERIES = 500
+
+class StackSampler:
+    """
+    یک رشته نمونه‌بردار برای کل پروسه که هر interval ثانیه پشته رشته‌های تحت نظر را از
+    sys._current_frames() می‌خواند و به صورت «پشته‌های تاشده» (قالب flamegraph) می‌شمارد.
+    وقتی رشته‌ای تحت نظر نیست، رشته نمونه‌بردار منتظر می‌ماند و هزینه‌ای ندارد.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._watched = {}
+        self._thread = None
+        self._pid = None
+
+    def _ensure_thread(self):
+        # پس از fork رشته والد در پروسه فرزند وجود ندارد
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._watched = {}
+            self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+            self._thread.start()
+
+    def watch(self, thread_id):
+        samples = Counter()
+        with self._lock:
+            self._ensure_thread()
+            self._watched[thread_id] = samples
+        self._wakeup.set()
+        return samples
+
+    def unwatch(self, thread_id):
+        with self._lock:
+            return self._watched.pop(thread_id, Counter())
+
+    def _run(self):
+        interval = getattr(settings, 'PROFILING_INTERVAL', 0.01)
+        own_id = threading.get_ident()
+        while True:
+            with self._lock:
+                watched = dict(self._watched)
+                if not watched:
+                    self._wakeup.clear()
+            if not watched:
+                self._wakeup.wait()
+                continue
+            frames = sys._current_frames()
+            for thread_id, samples in watched.items():
+                frame = frames.get(thread_id)
+                if frame is not None and thread_id != own_id:
+                    samples[_collapse(frame)] += 1
+            del frames
+            time.sleep(interval)
+
+def _frame_label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', os.path.basename(code.co_filename))
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}:{frame.f_lineno}"
+
+def _collapse(frame):
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+sampler = StackSampler()
+
+# ===== لاگ SQL درخواست در حال پروفایل =====
+# فقط متن کوئری (بدون پارامترها) ذخیره می‌شود تا داده حساس کاربران در فایل‌ها نماند
+current_sql_log = contextvars.ContextVar('current_sql_log', default=None)
+
+def sql_log_wrapper(execute, sql, params, many, context):
+    log = current_sql_log.get()
+    if log is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        log['count'] += 1
+        elapsed = time.perf_counter() - started
+        log['seconds'] += elapsed
+        if len(log['queries']) < MAX_LOGGED_QUERIES:
+            log['queries'].append({'sql': sql, 'many': many, 'ms': round(elapsed * 1000, 3)})
+
+def install_sql_log_wrapper(connection):
+    if sql_log_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_log_wrapper)
+
+# ===== ذخیره و نگه‌داری پروفایل‌ها =====
+def profiling_dir():
+    return getattr(settings, 'PROFILING_DIR', None) or os.path.join(settings.BASE_DIR, 'profiles')
+
+def top_functions(samples, limit=30):
+    """پرهزینه‌ترین فریم‌ها: (فریم، نمونه‌های خود فریم، نمونه‌های شامل فراخوانی‌های داخلی)."""
+    own, inclusive = Counter(), Counter()
+    for stack, count in samples.items():
+        frames = stack.split(';')
+        own[frames[-1]] += count
+        for frame in set(frames):
+            inclusive[frame] += count
+    return [(frame, own[frame], inclusive[frame]) for frame, _ in inclusive.most_common(limit) if frame]
+
+def save_capture(reason, request, response, duration, samples, sql_log):
+    """پروفایل را در یک فایل JSON می‌نویسد، رکورد ProfileCapture را می‌سازد و موارد قدیمی را حذف می‌کند."""
+    directory = profiling_dir()
+    file_name = f"{uuid.uuid4().hex}.json"
+    match = getattr(request, 'resolver_match', None)
+    user = getattr(request, 'user', None)
+    payload = {
+        'method': request.method,
+        'path': request.get_full_path(),
+        'view_name': match.view_name if match else '',
+        'status_code': response.status_code,
+        'duration_ms': round(duration * 1000, 3),
+        'interval': getattr(settings, 'PROFILING_INTERVAL', 0.01),
+        'samples': dict(samples.most_common()),
+        'queries': sql_log['queries'],
+        'query_count': sql_log['count'],
+    }
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, file_name), 'w', encoding='utf-8') as output:
+        json.dump(payload, output, ensure_ascii=False)
+
+    capture = ProfileCapture.objects.create(
+        reason=reason,
+        method=request.method,
+        path=payload['path'][:500],
+        view_name=payload['view_name'][:200],
+        status_code=response.status_code,
+        user=user if user is not None and user.is_authenticated else None,
+        duration_ms=payload['duration_ms'],
+        query_count=sql_log['count'],
+        query_ms=round(sql_log['seconds'] * 1000, 3),
+        sample_count=sum(samples.values()),
+        file_name=file_name,
+    )
+    prune_captures()
+    return capture
+
+def prune_captures():
+    """پروفایل‌های قدیمی‌تر از PROFILING_RETENTION_DAYS و بیش از PROFILING_MAX_CAPTURES حذف می‌شوند."""
+    cutoff = timezone.now() - timedelta(days=getattr(settings, 'PROFILING_RETENTION_DAYS', 7))
+    keep_ids = ProfileCapture.objects.filter(created_at__gte=cutoff).order_by('-created_at', '-id').values_list(
+        'id', flat=True,
+    )[:getattr(settings, 'PROFILING_MAX_CAPTURES', 200)]
+    # سیگنال post_delete برای هر رکورد حذف‌شده فایل آن را هم پاک می‌کند
+    ProfileCapture.objects.exclude(id__in=list(keep_ids)).delete()
+
+def load_capture(capture):
+    try:
+        with open(os.path.join(profiling_dir(), capture.file_name), encoding='utf-8') as source:
+            return json.load(source)
+    except (OSError, ValueError):
+        return None
+
+def delete_capture_file(capture):
+    try:
+        os.remove(os.path.join(profiling_dir(), capture.file_name))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,92 @@
+# core/reminders.py
+
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.urls import reverse
+from .mailer import send_messages_parallel
+from .models import ReminderLog
+
+def reminder_throttle():
+    """فاصله مجاز بین دو یادآوری برای یک درخواست و یک گیرنده."""
+    return timedelta(hours=getattr(settings, 'REMINDER_THROTTLE_HOURS', 24))
+
+def escalation_delay():
+    """مدتی پس از سررسید که درخواست هنوز باز است و به مدیر مسئول اطلاع داده می‌شود."""
+    return timedelta(hours=getattr(settings, 'REMINDER_ESCALATION_HOURS', 48))
+
+def recently_reminded(pairs, since):
+    """از میان زوج‌های (درخواست، گیرنده)، آن‌هایی که بعد از since یادآوری شده‌اند را برمی‌گرداند."""
+    pairs = set(pairs)
+    if not pairs:
+        return set()
+    request_ids = {request_id for request_id, _ in pairs}
+    recent = ReminderLog.objects.filter(request_id__in=request_ids, last_sent_at__gte=since).values_list('request_id', 'recipient_id')
+    return pairs.intersection(recent)
+
+def _request_line(req):
+    # در کامندها به request دسترسی نداریم؛ آدرس پایه سایت از تنظیمات خوانده می‌شود
+    site_url = getattr(settings, 'SITE_URL', 'https://your-domain.com').rstrip('/')
+    return (
+        f"- درخواست #{req.id} | فرایند: {req.process.name} | تاریخ سررسید: {req.due_date.strftime('%Y-%m-%d')}\n"
+        f"  {site_url}{reverse('request_detail', args=[req.id])}"
+    )
+
+def build_reminder_message(recipient, requests):
+    """یک ایمیل یادآوری برای همه وظایف معوق یک مسئول."""
+    if len(requests) == 1:
+        subject = f"یادآوری: وظیفه معوق در سیستم اتوماسیون - درخواست #{requests[0].id}"
+    else:
+        subject = f"یادآوری: {len(requests)} وظیفه معوق در سیستم اتوماسیون"
+    lines = "\n".join(_request_line(req) for req in requests)
+    message = f"""
+کاربر گرامی {recipient.get_full_name() or recipient.username}،
+
+این یک یادآوری است که مهلت انجام وظایف زیر به پایان رسیده است:
+
+{lines}
+
+لطفاً در اسرع وقت جهت بررسی و اقدام به سیستم مراجعه فرمایید.
+
+با تشکر،
+سیستم اتوماسیون
+"""
+    return EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [recipient.email])
+
+def build_escalation_message(manager, requests):
+    """یک ایمیل برای مدیر، شامل وظایف زیرمجموعه‌اش که مدت زیادی از سررسیدشان گذشته است."""
+    subject = f"ارجاع به مدیر: {len(requests)} وظیفه معوق در کارتابل زیرمجموعه شما"
+    lines = "\n".join(
+        f"{_request_line(req)}\n  مسئول: {req.current_assignee.get_full_name() or req.current_assignee.username}"
+        for req in requests
+    )
+    message = f"""
+کاربر گرامی {manager.get_full_name() or manager.username}،
+
+مهلت انجام وظایف زیر در کارتابل همکاران شما مدتی است که به پایان رسیده است:
+
+{lines}
+
+با تشکر،
+سیستم اتوماسیون
+"""
+    return EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [manager.email])
+
+def deliver(groups, build_message, now, workers=1, log=None):
+    """
+    برای هر گروه (گیرنده، درخواست‌ها) یک ایمیل می‌سازد، آن‌ها را به صورت موازی ارسال می‌کند و
+    یادآوری‌های موفق را در ReminderLog ثبت می‌کند. خروجی: (تعداد ارسال‌شده، تعداد ناموفق).
+    """
+    if not groups:
+        return 0, 0
+    messages = [build_message(recipient, requests) for recipient, requests in groups]
+    sent_indexes = send_messages_parallel(messages, workers=workers, log=log)
+    logs = [
+        ReminderLog(request_id=req.id, recipient_id=groups[index][0].id, last_sent_at=now)
+        for index in sent_indexes for req in groups[index][1]
+    ]
+    ReminderLog.objects.bulk_create(
+        logs, batch_size=1000, update_conflicts=True,
+        unique_fields=['request', 'recipient'], update_fields=['last_sent_at'],
+    )
+    return len(sent_indexes), len(messages) - len(sent_indexes)
@@ -0,0 +1,85 @@
+# core/signals.py
+
+from django.contrib.auth.models import Group
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from .models import User, ProcessStep, Request, DeadlineChange, ProfileCapture
+from .metrics import install_query_wrapper
+from .process_definitions import forget_process_definitions
+from .profiling import delete_capture_file, install_sql_log_wrapper
+from .utils import bump_process_graph_version, bump_org_chart_version
+
+# فیلدهایی از کاربر که در برچسب گره‌های گراف فرایند نمایش داده می‌شوند
+PROCESS_GRAPH_USER_FIELDS = {'first_name', 'last_name', 'username'}
+# فیلدهایی از مسئولان پیش‌فرض که در تعریف کامپایل‌شده فرایند (process_definitions) نگه داشته می‌شوند
+PROCESS_DEFINITION_USER_FIELDS = PROCESS_GRAPH_USER_FIELDS | {'email'}
+# فیلدهایی از کاربر که در ساختار یا برچسب‌های چارت سازمانی اثر دارند
+ORG_CHART_USER_FIELDS = PROCESS_GRAPH_USER_FIELDS | {'manager'}
+
+def _invalidate_processes(*process_ids):
+    # نسخه مشترک برای پروسه‌های دیگر و تعریف کامپایل‌شده همین پروسه، هر دو باطل می‌شوند
+    bump_process_graph_version(*process_ids)
+    forget_process_definitions(*process_ids)
+
+@receiver([post_save, post_delete], sender=ProcessStep)
+def invalidate_process_graph_on_step_change(sender, instance, **kwargs):
+    _invalidate_processes(instance.process_id)
+
+@receiver(post_save, sender=User)
+def invalidate_process_graph_on_user_change(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        return
+    # ذخیره‌هایی مثل به‌روزرسانی last_login روی برچسب‌ها و تعریف فرایند اثری ندارند
+    if update_fields is not None and not PROCESS_DEFINITION_USER_FIELDS.intersection(update_fields):
+        return
+    process_ids = ProcessStep.objects.filter(default_responsible_user=instance).values_list('process_id', flat=True).distinct()
+    _invalidate_processes(*process_ids)
+
+@receiver(pre_delete, sender=User)
+def invalidate_process_graph_on_user_delete(sender, instance, **kwargs):
+    # با حذف کاربر، مسئول پیش‌فرض مراحل با UPDATE خالی می‌شود و سیگنال مرحله اجرا نمی‌شود
+    process_ids = ProcessStep.objects.filter(default_responsible_user=instance).values_list('process_id', flat=True).distinct()
+    _invalidate_processes(*process_ids)
+
+# ===== باطل کردن کش چارت سازمانی =====
+@receiver(post_save, sender=User)
+def invalidate_org_chart_on_user_change(sender, instance, created, update_fields=None, **kwargs):
+    if not created and update_fields is not None and not ORG_CHART_USER_FIELDS.intersection(update_fields):
+        return
+    bump_org_chart_version()
+
+@receiver(post_delete, sender=User)
+def invalidate_org_chart_on_user_delete(sender, instance, **kwargs):
+    bump_org_chart_version()
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_org_chart_on_group_membership_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_org_chart_version()
+
+@receiver([post_save, post_delete], sender=Group)
+def invalidate_org_chart_on_group_change(sender, **kwargs):
+    bump_org_chart_version()
+
+# ===== ثبت تغییرات سررسید برای زمان‌بند =====
+@receiver(post_save, sender=Request)
+def record_deadline_change_on_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'due_date', 'status'}.intersection(update_fields):
+        return
+    due_date = instance.due_date if instance.status == 'IN_PROGRESS' else None
+    DeadlineChange.objects.create(request_id=instance.id, due_date=due_date)
+
+@receiver(post_delete, sender=Request)
+def record_deadline_change_on_delete(sender, instance, **kwargs):
+    DeadlineChange.objects.create(request_id=instance.id, due_date=None)
+
+# ===== سنجش کوئری‌ها برای متریک‌ها و پروفایل هر درخواست =====
+@receiver(connection_created)
+def install_query_wrappers(sender, connection, **kwargs):
+    install_query_wrapper(connection)
+    install_sql_log_wrapper(connection)
+
+@receiver(post_delete, sender=ProfileCapture)
+def delete_profile_file(sender, instance, **kwargs):
+    delete_capture_file(instance)
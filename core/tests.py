@@ -1,3 +1,854 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from asgiref.sync import sync_to_async
+from datetime import timedelta
+from unittest import mock
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from .counters import get_counters, rebuild_counters
+from .due_dates import _write_due_dates, recompute_due_dates
+from .exports import HISTORY_COLUMNS, REQUEST_COLUMNS, astream_export, export_queryset, stream_export
+from .management.commands.run_scheduler import Command as SchedulerCommand
+from .events import NotificationBroker, notification_broker
+from .metrics import ARCHIVE_FILE, MetricsRegistry
+from .mailer import claim_pending_emails, send_pending_emails
+from .uploads import temp_path
+from .views import _notification_events, _notification_payload
+from .process_definitions import get_process_definition
+from .utils import GraphRenderFailed, bump_org_chart_version, bump_process_graph_version, process_graph_error
+from .models import User, Process, ProcessStep, Request, RequestHistory, Notification, OutgoingEmail, ProfileCapture, DeadlineChange, UploadSession
 
-# Create your tests here.
+# ===== داده پایه تست‌ها =====
+# یک مدیر (ادمین)، یک کاربر زیردست او و یک فرایند سه‌مرحله‌ای؛ کش محلی و بدون متریک و پروفایل
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    METRICS_DIR=None,
+    PROFILING_ENABLED=False,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class FixtureTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.counter = 0
+        self.manager = self.make_user(is_staff=True, is_superuser=True)
+        self.user = self.make_user(manager=self.manager)
+        self.process = Process.objects.create(name='فرایند آزمایشی')
+        self.steps = [
+            ProcessStep.objects.create(
+                process=self.process, name=f"مرحله {order}", step_order=order, responsible_unit='واحد',
+                default_responsible_user=self.manager if order > 1 else None, deadline_days=2,
+            )
+            for order in range(1, 4)
+        ]
+
+    # ===== ساخت داده =====
+    def make_user(self, **fields):
+        self.counter += 1
+        return User.objects.create_user(
+            username=f"user{self.counter}", password='pass', email=f"user{self.counter}@example.com",
+            first_name=f"کاربر {self.counter}", **fields,
+        )
+
+    def make_request(self, initiator=None, assignee=None, **fields):
+        initiator = initiator or self.make_user(manager=self.manager)
+        fields.setdefault('current_step', self.steps[1])
+        return Request.objects.create(
+            process=self.process, initiator_user=initiator, current_assignee=assignee or self.user, **fields,
+        )
+
+    def add_history(self, req, count):
+        for _ in range(count):
+            RequestHistory.objects.create(
+                request=req, step=self.steps[0], to_step=self.steps[1], action_user=self.make_user(),
+                action_type='APPROVED', comments='تایید شد',
+            )
+
+    def add_notifications(self, user, count):
+        for _ in range(count):
+            Notification.objects.create(user=user, request=self.make_request(), message='وظیفه جدید')
+
+    # ===== ارسال درخواست =====
+    def login(self, user):
+        # ورود فقط هنگام تغییر کاربر، تا کوئری‌های ساخت نشست در شمارش ویو نیاید
+        if getattr(self, 'logged_in_user', None) != user:
+            self.client.force_login(user)
+            self.logged_in_user = user
+
+    def get(self, url, user=None, **extra):
+        self.login(user or self.user)
+        response = self.client.get(url, **extra)
+        self.assertLess(response.status_code, 400, url)
+        return response
+
+    def post(self, url, data, user=None):
+        self.login(user or self.user)
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302, url)
+        return response
+
+# ===== بودجه کوئری ویوها و دستورات =====
+# هر تست داده را در چند اندازه می‌سازد و بررسی می‌کند که تعداد کوئری‌ها با تعداد ردیف‌ها رشد نکند
+# (N+1) و از بودجه تعیین‌شده بیشتر نشود. در صورت خطا، SQL اجراشده در پیام تست چاپ می‌شود.
+class QueryBudgetTestCase(FixtureTestCase):
+    SIZES = (2, 12)
+
+    def assertConstantQueries(self, grow, run, budget, prepare=None):
+        """
+        grow(n) داده را n واحد بزرگ‌تر می‌کند و run() ویو یا دستور را اجرا می‌کند؛ یک اجرای اولیه
+        کش‌ها را گرم می‌کند و اجرای دوم شمرده می‌شود. برای اقدام‌هایی که وضعیت را تغییر می‌دهند،
+        prepare() پیش از هر اجرا و بیرون از شمارش هدف تازه‌ای می‌سازد که به run داده می‌شود.
+        """
+        measured = []
+        current = 0
+        for size in self.SIZES:
+            grow(size - current)
+            current = size
+            for attempt in range(2):
+                args = (prepare(),) if prepare else ()
+                if attempt == 0:
+                    run(*args)
+                    continue
+                with CaptureQueriesContext(connection) as context:
+                    run(*args)
+            measured.append((size, context))
+
+        counts = [len(context) for _, context in measured]
+        size, context = measured[-1]
+        if len(set(counts)) > 1 or counts[-1] > budget:
+            queries = '\n'.join(f"{index}. {query['sql']}" for index, query in enumerate(context.captured_queries, start=1))
+            self.fail(
+                f"تعداد کوئری‌ها در اندازه‌های {list(self.SIZES)} برابر {counts} است (بودجه: {budget}).\n"
+                f"کوئری‌های اندازه {size}:\n{queries}"
+            )
+
+class ViewQueryBudgetTests(QueryBudgetTestCase):
+    def test_dashboard(self):
+        def grow(count):
+            for _ in range(count):
+                self.make_request()
+                self.make_request(initiator=self.user, assignee=self.make_user())
+            self.add_notifications(self.user, count)
+        self.assertConstantQueries(grow, lambda: self.get(reverse('dashboard')), budget=6)
+
+    def test_dashboard_requests_page(self):
+        def grow(count):
+            for _ in range(count):
+                self.make_request()
+        self.assertConstantQueries(
+            grow, lambda: self.get(reverse('dashboard_requests_page', args=['received'])), budget=3,
+        )
+
+    def test_request_detail(self):
+        req = self.make_request()
+        self.assertConstantQueries(
+            lambda count: self.add_history(req, count),
+            lambda: self.get(reverse('request_detail', args=[req.id])), budget=5,
+        )
+
+    def test_get_notifications(self):
+        self.assertConstantQueries(
+            lambda count: self.add_notifications(self.user, count),
+            lambda: self.get(reverse('get_notifications')), budget=4,
+        )
+
+    def test_analytics(self):
+        def grow(count):
+            for _ in range(count):
+                self.make_request()
+        self.assertConstantQueries(grow, lambda: self.get(reverse('analytics'), user=self.manager), budget=6)
+
+    # ===== اقدام‌ها =====
+    def grow_inboxes(self, count):
+        # کارتابل و اعلان‌های کاربر و مدیر بزرگ‌تر می‌شوند؛ هزینه اقدام نباید به آن‌ها وابسته باشد
+        for _ in range(count):
+            self.make_request()
+            self.make_request(assignee=self.manager)
+        self.add_notifications(self.manager, count)
+        self.history_size = getattr(self, 'history_size', 0) + count
+
+    def prepare_request(self, **fields):
+        def prepare():
+            req = self.make_request(**fields)
+            self.add_history(req, self.history_size)
+            return req
+        return prepare
+
+    def act(self, action, **data):
+        return lambda req: self.post(
+            reverse('request_detail', args=[req.id]), {'action': action, 'version': req.version, **data},
+        )
+
+    def test_request_detail_approve(self):
+        self.assertConstantQueries(self.grow_inboxes, self.act('approve', comments='تایید'), budget=15, prepare=self.prepare_request())
+
+    def test_request_detail_return(self):
+        self.assertConstantQueries(
+            self.grow_inboxes, self.act('return', comments='اصلاح شود', return_step_id='initiator'), budget=22,
+            prepare=self.prepare_request(),
+        )
+
+    def test_request_detail_resubmit(self):
+        self.assertConstantQueries(
+            self.grow_inboxes, self.act('resubmit', comments='اصلاح شد'), budget=15,
+            prepare=self.prepare_request(initiator=self.user, current_step=self.steps[0]),
+        )
+
+    def test_create_request(self):
+        self.assertConstantQueries(
+            self.grow_inboxes, lambda: self.get(reverse('create_request', args=[self.process.id])), budget=15,
+        )
+
+class AdminQueryBudgetTests(QueryBudgetTestCase):
+    def changelist(self, model):
+        return lambda: self.get(reverse(f"admin:core_{model._meta.model_name}_changelist"), user=self.manager)
+
+    def test_request_history_changelist(self):
+        req = self.make_request()
+        self.assertConstantQueries(lambda count: self.add_history(req, count), self.changelist(RequestHistory), budget=5)
+
+    def test_notification_changelist(self):
+        self.assertConstantQueries(
+            lambda count: self.add_notifications(self.make_user(), count), self.changelist(Notification), budget=6,
+        )
+
+    def test_process_step_changelist(self):
+        def grow(count):
+            for _ in range(count):
+                process = Process.objects.create(name=f"فرایند {self.counter}")
+                ProcessStep.objects.create(
+                    process=process, name='مرحله', step_order=1, responsible_unit='واحد',
+                    default_responsible_user=self.make_user(),
+                )
+        self.assertConstantQueries(grow, self.changelist(ProcessStep), budget=7)
+
+    def test_user_changelist(self):
+        def grow(count):
+            for _ in range(count):
+                self.make_user(manager=self.make_user())
+        self.assertConstantQueries(grow, self.changelist(User), budget=6)
+
+    def test_outgoing_email_changelist(self):
+        def grow(count):
+            OutgoingEmail.objects.bulk_create([
+                OutgoingEmail(to_email='a@example.com', subject='موضوع', body='متن') for _ in range(count)
+            ])
+        self.assertConstantQueries(grow, self.changelist(OutgoingEmail), budget=5)
+
+    def test_profile_capture_changelist(self):
+        def grow(count):
+            ProfileCapture.objects.bulk_create([
+                ProfileCapture(
+                    reason='SLOW', method='GET', path='/', status_code=200, user=self.make_user(),
+                    duration_ms=10, file_name='missing.json',
+                )
+                for _ in range(count)
+            ])
+        self.assertConstantQueries(grow, self.changelist(ProfileCapture), budget=7)
+
+    def test_org_chart_tree(self):
+        def grow(count):
+            for _ in range(count):
+                middle = self.make_user(manager=self.manager)
+                self.make_user(manager=middle)
+        self.assertConstantQueries(
+            grow, lambda: self.get(reverse('admin:user_org_chart_tree'), user=self.manager), budget=6,
+        )
+
+    def test_org_chart_svg(self):
+        def grow(count):
+            for _ in range(count):
+                self.make_user(manager=self.make_user(manager=self.manager))
+
+        # هر اجرا چارت را از نو می‌سازد (نسخه باطل می‌شود)؛ خود Graphviz اجرا نمی‌شود
+        with mock.patch('core.utils._run_dot', return_value='<svg></svg>'):
+            self.assertConstantQueries(
+                grow, lambda _: self.get(reverse('admin:user_org_chart_svg'), user=self.manager), budget=4,
+                prepare=bump_org_chart_version,
+            )
+
+    def test_org_chart_children(self):
+        def grow(count):
+            for _ in range(count):
+                self.make_user(manager=self.make_user(manager=self.manager))
+        self.assertConstantQueries(
+            grow, lambda: self.get(reverse('admin:user_org_chart_children', args=[self.manager.id]), user=self.manager),
+            budget=4,
+        )
+
+class CommandQueryBudgetTests(QueryBudgetTestCase):
+    def test_send_reminders(self):
+        overdue = timezone.now() - timedelta(days=3)
+
+        def grow(count):
+            for _ in range(count):
+                assignee = self.make_user()
+                for _ in range(2):
+                    self.make_request(assignee=assignee, due_date=overdue)
+
+        # بدون محدودیت تکرار تا هر اجرا همه درخواست‌های معوق را دوباره پردازش کند
+        self.assertConstantQueries(
+            grow, lambda: call_command('send_reminders', throttle_hours=0, workers=1, stdout=io.StringIO()), budget=3,
+        )
+
+# ===== رفتار =====
+class DueDateTests(FixtureTestCase):
+    def process_change_data(self, **deadline_days):
+        data = {
+            'name': self.process.name, 'description': '', 'is_active': 'on',
+            'steps-TOTAL_FORMS': len(self.steps), 'steps-INITIAL_FORMS': len(self.steps),
+            'steps-MIN_NUM_FORMS': 0, 'steps-MAX_NUM_FORMS': 1000,
+        }
+        for index, step in enumerate(self.steps):
+            prefix = f"steps-{index}-"
+            data.update({
+                f"{prefix}id": step.id, f"{prefix}process": self.process.id, f"{prefix}name": step.name,
+                f"{prefix}step_order": step.step_order, f"{prefix}responsible_unit": step.responsible_unit,
+                f"{prefix}default_responsible_user": step.default_responsible_user_id or '',
+                f"{prefix}deadline_days": deadline_days.get(step.name, step.deadline_days),
+            })
+        return data
+
+    def test_inline_deadline_change_updates_due_dates(self):
+        req = self.make_request()
+        self.add_history(req, 1)
+        entered_at = req.history.get().timestamp
+        self.client.force_login(self.manager)
+        response = self.client.post(
+            reverse('admin:core_process_change', args=[self.process.id]),
+            self.process_change_data(**{self.steps[1].name: 5}),
+        )
+        self.assertEqual(response.status_code, 302)
+        req.refresh_from_db()
+        self.assertEqual(req.due_date, entered_at + timedelta(days=5))
+        # زمان‌بند همان مقداری را می‌بیند که در دیتابیس ذخیره شده است
+        self.assertEqual(DeadlineChange.objects.filter(request_id=req.id).last().due_date, req.due_date)
+
+    def test_recompute_after_transitions_changes_nothing(self):
+        # سررسیدهایی که ایجاد، تایید، بازگشت و اقدام گروهی نوشته‌اند با محاسبه دوباره یکسان‌اند
+        self.client.force_login(self.user)
+        for _ in range(3):
+            self.client.post(reverse('create_request', args=[self.process.id]))
+        approved, bulk_approved, returned = Request.objects.order_by('id')
+        self.client.force_login(self.manager)
+        for req in (approved, bulk_approved):
+            self.client.post(reverse('request_detail', args=[req.id]), {'action': 'approve', 'version': req.version})
+        self.client.post(reverse('request_detail', args=[returned.id]), {
+            'action': 'return', 'version': returned.version, 'comments': 'اصلاح شود', 'return_step_id': 'initiator',
+        })
+        self.client.post(reverse('bulk_request_action'), {'action': 'approve', 'request_ids': [bulk_approved.id]})
+        self.assertEqual(
+            list(Request.objects.order_by('id').values_list('current_step', flat=True)),
+            [self.steps[1].id, self.steps[2].id, self.steps[0].id],
+        )
+
+        changes = DeadlineChange.objects.count()
+        self.assertEqual(recompute_due_dates(), {'scanned': 3, 'updated': 0})
+        self.assertEqual(DeadlineChange.objects.count(), changes)
+
+    def test_recompute_skips_request_that_left_the_step(self):
+        req = self.make_request()
+        old_deadline = self.steps[1].deadline_days
+        # درخواست بین خواندن دسته و نوشتن به مرحله‌ای با مهلت دیگر رفته است
+        self.steps[2].deadline_days = old_deadline + 4
+        self.steps[2].save()
+        Request.objects.filter(id=req.id).update(current_step=self.steps[2], due_date=None)
+        changes = DeadlineChange.objects.count()
+        self.assertEqual(_write_due_dates([req.id], old_deadline), 0)
+        req.refresh_from_db()
+        self.assertIsNone(req.due_date)
+        self.assertEqual(DeadlineChange.objects.count(), changes)
+
+class TransitionTests(FixtureTestCase):
+    def post_action(self, user, req, action, **data):
+        self.client.force_login(user)
+        return self.client.post(reverse('request_detail', args=[req.id]), {'action': action, **data})
+
+    def test_stale_version_conflicts_without_double_transition(self):
+        req = self.make_request(assignee=self.manager)
+        version = req.version
+        self.post_action(self.manager, req, 'approve', version=version)
+        self.post_action(self.manager, req, 'approve', version=version)
+        req.refresh_from_db()
+        self.assertEqual(req.version, version + 1)
+        self.assertEqual(req.current_step, self.steps[2])
+        self.assertEqual(req.history.filter(action_type='APPROVED').count(), 1)
+
+    def test_initiator_cannot_resubmit_request_in_managers_inbox(self):
+        req = self.make_request(initiator=self.user, assignee=self.manager)
+        version = req.version
+        self.post_action(self.user, req, 'resubmit', version=version)
+        req.refresh_from_db()
+        self.assertEqual((req.version, req.current_assignee), (version, self.manager))
+        self.assertFalse(req.history.exists())
+        self.assertFalse(Notification.objects.filter(request=req).exists())
+
+    def test_resubmit_returned_request(self):
+        req = self.make_request(initiator=self.user, assignee=self.user, current_step=self.steps[0])
+        self.post_action(self.user, req, 'resubmit', version=req.version, comments='اصلاح شد')
+        req.refresh_from_db()
+        self.assertEqual(req.current_assignee, self.manager)
+        self.assertEqual(req.history.get().action_type, 'RESUBMITTED')
+
+class BulkActionTests(FixtureTestCase):
+    def test_partial_conflicts_apply_only_to_valid_requests(self):
+        self.steps[2].default_responsible_user = None
+        self.steps[2].save()
+        movable = self.make_request()
+        # ثبت‌کننده مدیر ندارد و مرحله بعد مسئول پیش‌فرض ندارد
+        stuck = self.make_request(initiator=self.make_user())
+        # پیش از ارسال فرم به کارتابل کاربر دیگری رفته است
+        elsewhere = self.make_request(assignee=self.make_user())
+        versions = {req.id: req.version for req in (movable, stuck, elsewhere)}
+
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('bulk_request_action'), {
+            'action': 'approve', 'request_ids': [movable.id, stuck.id, elsewhere.id],
+        })
+        self.assertEqual(response.status_code, 302)
+
+        for req in (movable, stuck, elsewhere):
+            req.refresh_from_db()
+        self.assertEqual((movable.current_step, movable.current_assignee), (self.steps[2], self.manager))
+        self.assertEqual(movable.version, versions[movable.id] + 1)
+        self.assertEqual((stuck.version, stuck.current_assignee), (versions[stuck.id], self.user))
+        self.assertEqual(elsewhere.version, versions[elsewhere.id])
+        self.assertEqual(RequestHistory.objects.filter(action_type='APPROVED').count(), 1)
+        self.assertEqual(get_counters(self.user).open_tasks, Request.objects.filter(current_assignee=self.user, status='IN_PROGRESS').count())
+
+class DashboardCountTests(FixtureTestCase):
+    def test_counts_follow_search_filters(self):
+        received = [self.make_request() for _ in range(3)]
+        self.make_request(initiator=self.user, assignee=self.manager)
+        self.make_request(initiator=self.user, assignee=self.manager, status='APPROVED')
+        rebuild_counters()
+
+        def counts(**params):
+            context = self.get(reverse('dashboard'), data=params).context
+            return context['received_count'], context['in_progress_sent_count']
+
+        self.assertEqual(counts(), (3, 1))
+        self.assertEqual(counts(search_received_id=received[0].id), (1, 1))
+        self.assertEqual(counts(search_received_deadline='overdue'), (0, 1))
+        self.assertEqual(counts(search_sent_status='APPROVED'), (3, 0))
+        self.assertEqual(counts(search_sent_process=self.process.id, search_received_id=received[1].id), (1, 1))
+
+class NotificationFeedTests(FixtureTestCase):
+    def notify(self, count):
+        created = [
+            Notification.objects.create(user=self.user, request=self.make_request(), message='وظیفه جدید')
+            for _ in range(count)
+        ]
+        rebuild_counters([self.user.id])
+        return created
+
+    def test_unchanged_feed_returns_not_modified(self):
+        self.notify(2)
+        etag = self.get(reverse('get_notifications'))['ETag']
+        response = self.get(reverse('get_notifications'), HTTP_IF_NONE_MATCH=f'"0-0", W/{etag}')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        # هدری که برچسب فعلی فقط زیررشته‌ای از آن است، تطابق حساب نمی‌شود
+        self.assertEqual(self.get(reverse('get_notifications'), HTTP_IF_NONE_MATCH=f'{etag}-stale').status_code, 200)
+
+    def test_changed_unread_count_returns_new_feed(self):
+        first, second = self.notify(2)
+        etag = self.get(reverse('get_notifications'))['ETag']
+        self.client.post(reverse('mark_notifications_as_read'), {'ids': [first.id]})
+        response = self.get(reverse('get_notifications'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['count'], 1)
+        self.assertEqual([item['id'] for item in response.json()['notifications']], [second.id])
+
+    def test_since_returns_only_newer_notifications(self):
+        first, second, third = self.notify(3)
+        data = self.get(reverse('get_notifications'), data={'since': first.id}).json()
+        self.assertEqual([item['id'] for item in data['notifications']], [third.id, second.id])
+        self.assertEqual((data['count'], data['last_id']), (3, third.id))
+
+    def test_mark_all_read_uses_single_update(self):
+        self.notify(3)
+        self.login(self.user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('mark_notifications_as_read'), {'all': '1'})
+        self.assertEqual(response.json(), {'updated': 3})
+        updates = [query['sql'] for query in context.captured_queries if query['sql'].startswith('UPDATE "core_notification"')]
+        self.assertEqual(len(updates), 1)
+        self.assertFalse(Notification.objects.filter(user=self.user, is_read=False).exists())
+        self.assertEqual(get_counters(self.user).unread_notifications, 0)
+
+class ExportTests(FixtureTestCase):
+    def setUp(self):
+        super().setUp()
+        self.with_history = self.make_request(initiator=self.user)
+        self.add_history(self.with_history, 2)
+        self.without_history = self.make_request(status='APPROVED', current_step=None)
+
+    def export(self, export_format):
+        response = self.get(reverse('export_requests'), user=self.manager, data={'format': export_format})
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv_has_one_row_per_history_item(self):
+        content = self.export('csv')
+        self.assertTrue(content.startswith('\ufeff'))
+        header, *rows = csv.reader(io.StringIO(content[1:]))
+        self.assertEqual(header, REQUEST_COLUMNS + HISTORY_COLUMNS)
+        rows = [dict(zip(header, row)) for row in rows]
+        self.assertEqual([row['request_id'] for row in rows], [str(self.with_history.id)] * 2 + [str(self.without_history.id)])
+        self.assertEqual(rows[0]['initiator'], self.user.username)
+        self.assertEqual(rows[0]['history_to_step'], self.steps[1].name)
+        self.assertEqual(rows[2]['history_id'], '')
+
+    def test_jsonl_has_one_record_per_request(self):
+        records = [json.loads(line) for line in self.export('jsonl').splitlines()]
+        self.assertEqual([record['request_id'] for record in records], [self.with_history.id, self.without_history.id])
+        self.assertEqual(len(records[0]['history']), 2)
+        self.assertEqual(records[1]['history'], [])
+        self.assertEqual(records[0]['created_at'], self.with_history.created_at.isoformat())
+
+    async def test_asgi_streams_same_output_in_chunks(self):
+        await self.async_client.aforce_login(self.manager)
+        response = await self.async_client.get(reverse('export_requests'), {'format': 'jsonl'})
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        expected = await sync_to_async(lambda: ''.join(stream_export(export_queryset(), 'jsonl')))()
+        self.assertEqual(b''.join(chunks).decode('utf-8'), expected)
+        streamed = [chunk async for chunk in astream_export(export_queryset(), 'jsonl', chunk_size=1)]
+        self.assertEqual(len(streamed), 2)
+
+class ImportTests(FixtureTestCase):
+    def snapshot(self):
+        return [
+            (
+                req.created_at, req.status, req.initiator_user_id, req.current_assignee_id, req.current_step_id, req.due_date,
+                [(item.timestamp, item.step_id, item.to_step_id, item.action_type) for item in req.history.order_by('timestamp')],
+            )
+            for req in Request.objects.order_by('created_at')
+        ]
+
+    def test_export_import_round_trip(self):
+        started = timezone.now() - timedelta(days=30)
+        for index, status in enumerate(['IN_PROGRESS', 'IN_PROGRESS', 'APPROVED']):
+            created_at = started + timedelta(days=index)
+            req = self.make_request(
+                initiator=self.user if index else None, assignee=self.manager if index else None, status=status,
+                created_at=created_at, due_date=created_at + timedelta(days=2),
+                current_step=self.steps[1] if status == 'IN_PROGRESS' else None,
+            )
+            RequestHistory.objects.create(
+                request=req, step=self.steps[0], to_step=self.steps[1], action_user=self.manager,
+                action_type='APPROVED', timestamp=created_at + timedelta(hours=1),
+            )
+            RequestHistory.objects.create(
+                request=req, step=self.steps[1], action_user=self.user, action_type='COMMENTED',
+                timestamp=created_at + timedelta(hours=2),
+            )
+        expected = self.snapshot()
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'requests.jsonl')
+        call_command('export_requests', format='jsonl', output=path, stderr=io.StringIO())
+        Request.objects.all().delete()
+
+        # دو اجرای جدا: اولی با --limit متوقف می‌شود و دومی از offset گزارش‌شده ادامه می‌دهد
+        call_command('import_requests', path, batch_size=1, limit=1, stdout=io.StringIO())
+        call_command('import_requests', path, batch_size=2, offset=1, stdout=io.StringIO())
+
+        self.assertEqual(self.snapshot(), expected)
+        for user in (self.user, self.manager):
+            counters = get_counters(user)
+            open_requests = Request.objects.filter(status='IN_PROGRESS')
+            self.assertEqual(counters.open_tasks, open_requests.filter(current_assignee=user).count())
+            self.assertEqual(counters.open_requests, open_requests.filter(initiator_user=user).count())
+        self.assertEqual((get_counters(self.manager).open_tasks, get_counters(self.user).open_requests), (1, 1))
+
+class MetricsTests(FixtureTestCase):
+    def test_metrics_access(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        with self.settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        with self.settings(METRICS_ALLOWED_IPS=['127.0.0.1']):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with self.settings(METRICS_ALLOWED_IPS=['10.0.0.1']):
+            self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.manager)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def metrics_dir(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        override = self.settings(METRICS_DIR=directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        return directory
+
+    def write_process_file(self, directory, pid, value):
+        name = f"metrics-{pid}-1.json"
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as output:
+            json.dump({'counters': {'requests': value}, 'histograms': {}}, output)
+        return name
+
+    def dead_pid(self):
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        return process.pid
+
+    def test_collect_archives_files_of_dead_processes_once(self):
+        directory = self.metrics_dir()
+        dead = self.write_process_file(directory, self.dead_pid(), 2)
+        alive = self.write_process_file(directory, os.getpid(), 3)
+        registry = MetricsRegistry()
+        for _ in range(2):
+            self.assertEqual(registry.collect()['counters'], {'requests': 5})
+        self.assertEqual(sorted(os.listdir(directory)), sorted([ARCHIVE_FILE, alive]))
+        self.assertNotIn(dead, os.listdir(directory))
+
+    def test_interrupted_merge_is_not_counted_twice(self):
+        directory = self.metrics_dir()
+        # فایل در بایگانی ادغام شده ولی پیش از حذف، کار قطع شده است
+        dead = self.write_process_file(directory, self.dead_pid(), 2)
+        with open(os.path.join(directory, ARCHIVE_FILE), 'w', encoding='utf-8') as output:
+            json.dump({'counters': {'requests': 2}, 'histograms': {}, 'merged': [dead]}, output)
+        self.assertEqual(MetricsRegistry().collect()['counters'], {'requests': 2})
+        self.assertEqual(os.listdir(directory), [ARCHIVE_FILE])
+
+    def test_close_merges_own_file(self):
+        directory = self.metrics_dir()
+        registry = MetricsRegistry()
+        registry.inc('http_requests_total', view='dashboard')
+        registry.close()
+        self.assertEqual(os.listdir(directory), [ARCHIVE_FILE])
+        self.assertEqual(sum(registry.collect()['counters'].values()), 1)
+
+class NotificationStreamTests(FixtureTestCase):
+    async def test_publish_from_another_thread_reaches_only_subscribers_of_the_user(self):
+        broker = NotificationBroker()
+        subscription = broker.subscribe(1)
+        other = broker.subscribe(2)
+        publisher = threading.Thread(target=broker.publish, args=(1, {'id': 5}))
+        publisher.start()
+        publisher.join()
+        self.assertEqual(await asyncio.wait_for(subscription[1].get(), timeout=1), {'id': 5})
+        self.assertTrue(other[1].empty())
+
+        broker.unsubscribe(1, subscription)
+        broker.unsubscribe(2, other)
+        self.assertEqual(broker._subscribers, {})
+        broker.publish(1, {'id': 6})
+        self.assertTrue(subscription[1].empty())
+
+    async def test_stream_unsubscribes_on_disconnect(self):
+        events = _notification_events(self.user.id)
+        self.assertEqual(await events.__anext__(), "retry: 5000\n\n")
+        notification_broker.publish(self.user.id, {'id': 7})
+        self.assertEqual(await events.__anext__(), 'event: notification\ndata: {"id": 7}\n\n')
+        # بسته شدن اتصال کلاینت ژنراتور را می‌بندد
+        await events.aclose()
+        self.assertNotIn(self.user.id, notification_broker._subscribers)
+
+    def test_transition_publishes_after_commit(self):
+        req = self.make_request(assignee=self.user)
+        with mock.patch.object(notification_broker, 'publish') as publish, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.post(reverse('request_detail', args=[req.id]), {'action': 'approve', 'version': req.version})
+        notification = Notification.objects.get(user=self.manager)
+        publish.assert_called_once_with(self.manager.id, _notification_payload(notification))
+
+    def test_wsgi_returns_no_content(self):
+        self.assertEqual(self.get(reverse('notification_stream')).status_code, 204)
+
+class ProcessDefinitionTests(FixtureTestCase):
+    def change_in_other_process(self, deadline_days):
+        # UPDATE سیگنال ندارد؛ مثل پروسه دیگری فقط نسخه مشترک عوض می‌شود
+        ProcessStep.objects.filter(id=self.steps[0].id).update(deadline_days=deadline_days)
+        bump_process_graph_version(self.process.id)
+
+    def test_version_is_checked_once_per_ttl(self):
+        get_process_definition(self.process.id)
+        with mock.patch('core.process_definitions.get_process_graph_version') as get_version, self.assertNumQueries(0):
+            get_process_definition(self.process.id)
+        get_version.assert_not_called()
+
+        self.change_in_other_process(7)
+        self.assertEqual(get_process_definition(self.process.id).first_step.deadline_days, 2)
+        with self.settings(PROCESS_DEFINITION_TTL=0):
+            self.assertEqual(get_process_definition(self.process.id).first_step.deadline_days, 7)
+            # نسخه تغییرنکرده: فقط نسخه خوانده می‌شود و مراحل دوباره کامپایل نمی‌شوند
+            with self.assertNumQueries(0):
+                get_process_definition(self.process.id)
+
+    def test_saving_step_in_this_process_is_seen_immediately(self):
+        get_process_definition(self.process.id)
+        self.steps[0].deadline_days = 9
+        self.steps[0].save()
+        self.assertEqual(get_process_definition(self.process.id).first_step.deadline_days, 9)
+
+class GraphRenderTests(FixtureTestCase):
+    def test_failed_render_is_not_repeated(self):
+        req = self.make_request()
+        url = reverse('request_graph', args=[req.id])
+        with mock.patch('core.utils._run_dot', side_effect=RuntimeError('dot failed')) as run_dot, \
+                mock.patch('builtins.print'):
+            first = self.get(url)
+            second = self.get(url)
+        self.assertEqual(run_dot.call_count, 1)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.content.decode(), process_graph_error(GraphRenderFailed()))
+
+@override_settings(METRICS_DIR=None, EMAIL_OUTBOX_RETRY_BASE=60, EMAIL_OUTBOX_MAX_ATTEMPTS=3, EMAIL_OUTBOX_LEASE=300)
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.email = OutgoingEmail.objects.create(to_email='a@example.com', subject='موضوع', body='متن')
+
+    def test_claimed_emails_are_leased_and_requeued_after_lease_expires(self):
+        self.assertEqual([email.id for email in claim_pending_emails(10)], [self.email.id])
+        # پردازشگر دوم تا پایان مهلت رزرو آن را برنمی‌دارد
+        self.assertEqual(claim_pending_emails(10), [])
+        # پردازشگر اول از کار افتاده و مهلت رزرو گذشته است
+        OutgoingEmail.objects.filter(id=self.email.id).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual([email.id for email in claim_pending_emails(10)], [self.email.id])
+
+    def test_failures_back_off_then_fail(self):
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            self.assertEqual(send_pending_emails(), {'sent': 0, 'retry': 1, 'failed': 0})
+            self.email.refresh_from_db()
+            self.assertEqual((self.email.status, self.email.attempts, self.email.lease_token), ('PENDING', 1, None))
+            delay = self.email.next_attempt_at - timezone.now()
+            self.assertTrue(timedelta(seconds=50) < delay <= timedelta(seconds=60))
+            # تا سررسید تلاش بعدی برداشته نمی‌شود
+            self.assertEqual(send_pending_emails(), {'sent': 0, 'retry': 0, 'failed': 0})
+
+            OutgoingEmail.objects.filter(id=self.email.id).update(next_attempt_at=timezone.now())
+            send_pending_emails()
+            self.email.refresh_from_db()
+            # تأخیر تلاش دوم دو برابر می‌شود
+            self.assertGreater(self.email.next_attempt_at - timezone.now(), timedelta(seconds=110))
+
+            OutgoingEmail.objects.filter(id=self.email.id).update(next_attempt_at=timezone.now())
+            self.assertEqual(send_pending_emails(), {'sent': 0, 'retry': 0, 'failed': 1})
+            self.email.refresh_from_db()
+            self.assertEqual((self.email.status, self.email.attempts), ('FAILED', 3))
+
+    def test_sent_email_is_not_sent_again(self):
+        self.assertEqual(send_pending_emails()['sent'], 1)
+        self.assertEqual(send_pending_emails()['sent'], 0)
+        self.assertEqual(len(mail.outbox), 1)
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.status, 'SENT')
+
+class SchedulerTests(FixtureTestCase):
+    def start_scheduler(self):
+        scheduler = SchedulerCommand(stdout=io.StringIO())
+        scheduler._start({'batch_size': 500})
+        return scheduler
+
+    def read_only(self, scheduler, change):
+        # زمان‌بند این تغییر را خوانده در حالی که تغییرات با شناسه کمتر هنوز commit نشده بودند
+        scheduler._apply_change(change.id, change.request_id, change.due_date, change.created_at)
+        scheduler.cursor = change.id
+
+    def test_late_committed_change_is_applied(self):
+        late_request, other_request = self.make_request(), self.make_request()
+        scheduler = self.start_scheduler()
+        due_date = timezone.now() + timedelta(days=5)
+        late = DeadlineChange.objects.create(request_id=late_request.id, due_date=due_date)
+        self.read_only(scheduler, DeadlineChange.objects.create(request_id=other_request.id, due_date=due_date))
+        self.assertNotEqual(scheduler.deadlines.get(late.request_id), due_date)
+        scheduler._apply_changes()
+        self.assertEqual(scheduler.deadlines[late.request_id], due_date)
+
+    def test_late_older_change_does_not_override_newer(self):
+        req = self.make_request()
+        scheduler = self.start_scheduler()
+        older_due, newer_due = timezone.now() + timedelta(days=1), timezone.now() + timedelta(days=9)
+        DeadlineChange.objects.create(request_id=req.id, due_date=older_due)
+        self.read_only(scheduler, DeadlineChange.objects.create(request_id=req.id, due_date=newer_due))
+        scheduler._apply_changes()
+        self.assertEqual(scheduler.deadlines[req.id], newer_due)
+
+class ChunkedUploadTests(FixtureTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_override = override_settings(
+            MEDIA_ROOT=os.path.join(directory, 'media'), UPLOAD_TEMP_DIR=os.path.join(directory, 'uploads'),
+            ATTACHMENT_CHUNK_SIZE=10,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.data = bytes(range(25))
+        self.client.force_login(self.user)
+
+    def start(self):
+        response = self.client.post(reverse('upload_start'), {'file_name': 'گزارش.pdf', 'size': len(self.data)})
+        self.assertEqual(response.status_code, 201)
+        return response.json()['token']
+
+    def send(self, token, offset, length=10):
+        return self.client.post(
+            reverse('upload_chunk', args=[token]), self.data[offset:offset + length],
+            content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def test_offset_mismatch_and_resume(self):
+        token = self.start()
+        self.assertEqual(self.send(token, 0).json()['offset'], 10)
+        # تکه تکراری (مثلاً پس از قطع اتصال پیش از دریافت پاسخ) ثبت نمی‌شود و offset درست برمی‌گردد
+        response = self.send(token, 0)
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 10))
+        # ادامه بارگذاری از offset اعلام‌شده توسط سرور
+        offset = self.client.get(reverse('upload_chunk', args=[token])).json()['offset']
+        while offset < len(self.data):
+            offset = self.send(token, offset).json()['offset']
+        state = self.client.get(reverse('upload_chunk', args=[token])).json()
+        self.assertTrue(state['complete'])
+        with open(temp_path(UploadSession.objects.get(id=token)), 'rb') as assembled:
+            self.assertEqual(assembled.read(), self.data)
+
+    def complete_upload(self):
+        token = self.start()
+        for offset in range(0, len(self.data), 10):
+            self.send(token, offset)
+        return token
+
+    def test_completed_upload_is_attached_once(self):
+        token = self.complete_upload()
+        req = self.make_request(initiator=self.user)
+        url = reverse('request_detail', args=[req.id])
+        self.client.post(url, {'action': 'comment', 'comments': 'پیوست', 'attachment_token': token})
+        history = req.history.get()
+        with history.attachment.open('rb') as attachment:
+            self.assertEqual(attachment.read(), self.data)
+        self.assertFalse(UploadSession.objects.filter(id=token).exists())
+        self.client.post(url, {'action': 'comment', 'comments': 'دوباره', 'attachment_token': token})
+        self.assertEqual(req.history.count(), 1)
+
+    def test_foreign_token_is_rejected(self):
+        token = self.complete_upload()
+        self.client.force_login(self.manager)
+        self.assertEqual(self.client.get(reverse('upload_chunk', args=[token])).status_code, 404)
+        req = self.make_request(initiator=self.manager, assignee=self.manager)
+        self.client.post(reverse('request_detail', args=[req.id]), {'action': 'comment', 'comments': 'x', 'attachment_token': token})
+        self.assertFalse(req.history.exists())
+        self.assertTrue(UploadSession.objects.filter(id=token).exists())
@@ -0,0 +1,158 @@
+# core/uploads.py
+
+import os
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+from .models import UploadSession
+
+# اندازه بافر خواندن بدنه درخواست و نوشتن روی دیسک؛ هیچ‌گاه کل تکه در حافظه نگه داشته نمی‌شود
+COPY_BUFFER_SIZE = 64 * 1024
+
+class UploadError(ValueError):
+    pass
+
+class UploadOffsetMismatch(UploadError):
+    """offset ارسالی با حجم ثبت‌شده برابر نیست؛ کلاینت باید از received ادامه دهد."""
+
+    def __init__(self, received):
+        super().__init__(received)
+        self.received = received
+
+def chunk_size():
+    return getattr(settings, 'ATTACHMENT_CHUNK_SIZE', 1024 * 1024)
+
+def max_size():
+    return getattr(settings, 'ATTACHMENT_MAX_SIZE', 512 * 1024 * 1024)
+
+def upload_temp_dir():
+    return getattr(settings, 'UPLOAD_TEMP_DIR', None) or os.path.join(settings.BASE_DIR, 'uploads_tmp')
+
+def temp_path(session):
+    return os.path.join(upload_temp_dir(), f"{session.id.hex}.part")
+
+def session_state(session):
+    return {
+        'token': str(session.id),
+        'file_name': session.file_name,
+        'size': session.size,
+        'offset': session.received,
+        'chunk_size': chunk_size(),
+        'complete': session.is_complete,
+    }
+
+# ===== شروع و دریافت تکه‌ها =====
+def start_upload(user, file_name, size):
+    """یک نشست بارگذاری و فایل خالی موقت آن را می‌سازد؛ بارگذاری‌های منقضی‌شده هم پاک می‌شوند."""
+    file_name = os.path.basename((file_name or '').replace('\\', '/')).strip()
+    if not file_name:
+        raise UploadError("نام فایل مشخص نشده است.")
+    if size <= 0:
+        raise UploadError("فایل خالی قابل بارگذاری نیست.")
+    if size > max_size():
+        raise UploadError(f"حجم فایل بیش از حد مجاز ({max_size() // (1024 * 1024)} مگابایت) است.")
+
+    purge_expired_uploads()
+    session = UploadSession.objects.create(user=user, file_name=file_name[:255], size=size)
+    os.makedirs(upload_temp_dir(), exist_ok=True)
+    open(temp_path(session), 'wb').close()
+    return session
+
+def append_chunk(session, offset, stream, length):
+    """
+    length بایت از stream را در offset فایل موقت می‌نویسد و received را جلو می‌برد. تکه‌ای که
+    کامل دریافت نشود ثبت نمی‌شود و کلاینت همان تکه را دوباره می‌فرستد. پیشروی offset با شرط
+    received=offset انجام می‌شود تا از دو ارسال هم‌زمان یک تکه فقط یکی ثبت شود.
+    """
+    if offset != session.received:
+        raise UploadOffsetMismatch(session.received)
+    if length <= 0 or length > chunk_size() or offset + length > session.size:
+        raise UploadError("اندازه تکه نامعتبر است.")
+
+    path = temp_path(session)
+    written = 0
+    try:
+        with open(path, 'r+b') as output:
+            output.seek(offset)
+            while written < length:
+                data = stream.read(min(COPY_BUFFER_SIZE, length - written))
+                if not data:
+                    break
+                output.write(data)
+                written += len(data)
+    except FileNotFoundError:
+        raise UploadError("فایل موقت این بارگذاری یافت نشد؛ بارگذاری را از ابتدا شروع کنید.")
+    if written != length:
+        raise UploadError("تکه به طور کامل دریافت نشد.")
+
+    updated = UploadSession.objects.filter(id=session.id, received=offset).update(
+        received=offset + length, updated_at=timezone.now(),
+    )
+    if not updated:
+        session.refresh_from_db(fields=['received'])
+        raise UploadOffsetMismatch(session.received)
+    session.received = offset + length
+    return session.received
+
+# ===== پیوست کردن فایل کامل‌شده =====
+class AssembledUpload(File):
+    """
+    فایل کامل‌شده روی دیسک؛ FileSystemStorage به خاطر temporary_file_path آن را به جای خواندن
+    و کپی، مستقیماً به مسیر نهایی جابه‌جا می‌کند (مانند TemporaryUploadedFile در فرم‌های معمولی).
+    """
+
+    def __init__(self, session):
+        super().__init__(None, name=session.file_name)
+        self.session = session
+        self.size = session.size
+
+    def temporary_file_path(self):
+        return temp_path(self.session)
+
+def get_completed_upload(user, token):
+    """نشست کامل‌شده کاربر برای token یا None؛ توکن‌های نامعتبر/ناقص/مصرف‌شده None برمی‌گردانند."""
+    try:
+        session = UploadSession.objects.get(id=uuid.UUID(str(token)), user=user)
+    except (UploadSession.DoesNotExist, ValueError):
+        return None
+    if not session.is_complete or not os.path.exists(temp_path(session)):
+        return None
+    return AssembledUpload(session)
+
+def release_upload(upload):
+    """پس از پردازش فرم: اگر فایل به پیوست منتقل شده، نشست حذف می‌شود؛ وگرنه برای تلاش دوباره می‌ماند."""
+    if not os.path.exists(upload.temporary_file_path()):
+        UploadSession.objects.filter(id=upload.session.id).delete()
+
+# ===== پاک‌سازی =====
+def purge_expired_uploads():
+    """نشست‌ها و فایل‌های موقتی که بیش از UPLOAD_SESSION_TTL_HOURS دست نخورده‌اند حذف می‌شوند."""
+    ttl = timedelta(hours=getattr(settings, 'UPLOAD_SESSION_TTL_HOURS', 24))
+    expired = UploadSession.objects.filter(updated_at__lt=timezone.now() - ttl)
+    for session in expired.only('id'):
+        _remove(temp_path(session))
+    expired.delete()
+
+    # فایل‌های بی‌صاحب (مثلاً نشستی که پیش از حذف فایلش پاک شده) بر اساس زمان تغییر حذف می‌شوند
+    directory = upload_temp_dir()
+    cutoff = time.time() - ttl.total_seconds()
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if name.endswith('.part') and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -10,6 +10,11 @@ urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('', views.dashboard_view, name='dashboard'),
+    path('dashboard/requests/<str:table>/', views.dashboard_requests_page, name='dashboard_requests_page'),
+    path('dashboard/bulk-action/', views.bulk_request_action, name='bulk_request_action'),
+    path('analytics/', views.analytics_view, name='analytics'),
+    path('requests/export/', views.export_requests_view, name='export_requests'),
+    path('metrics', views.metrics_view, name='metrics'),
     path('create-request/<int:process_id>/', views.create_request_view, name='create_request'),
 
 
@@ -44,7 +49,12 @@ urlpatterns = [
          auth_views.PasswordChangeDoneView.as_view(template_name='registration/password_change_done.html'), 
          name='password_change_done'),
     path('request/<int:request_id>/', views.request_detail_view, name='request_detail'),
+    path('request/<int:request_id>/graph/', views.request_graph_view, name='request_graph'),
+    path('uploads/', views.upload_start, name='upload_start'),
+    path('uploads/<uuid:token>/', views.upload_chunk, name='upload_chunk'),
 
     path('notifications/get/', views.get_notifications, name='get_notifications'),
+    path('notifications/stream/', views.notification_stream, name='notification_stream'),
     path('notifications/mark-as-read/<int:notification_id>/', views.mark_notification_as_read, name='mark_notification_as_read'),
+    path('notifications/mark-as-read/', views.mark_notifications_as_read, name='mark_notifications_as_read'),
 ]
\ No newline at end of file
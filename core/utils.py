@@ -1,9 +1,29 @@
 # core/utils.py
 
+import re
+import time
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import graphviz
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db.models import Count, Prefetch
 from django.utils.html import mark_safe
 import textwrap
 import arabic_reshaper
+from django.urls import reverse
+from . import metrics
+from .models import User
+
+# گراف چیده‌شده تا زمان تغییر نسخه مراحل فرایند در کش می‌ماند
+PROCESS_GRAPH_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+# تعداد سطوحی از چارت سازمانی درختی که در بارگذاری اولیه صفحه نمایش داده می‌شوند
+ORG_CHART_INITIAL_DEPTH = 2
+# چارت سازمانی تا زمان تغییر مدیر، نام یا گروه کاربران در کش می‌ماند
+ORG_CHART_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+ORG_CHART_VERSION_KEY = "org_chart:version"
 
 def _fix_persian_text_shape(text):
     if not text:
@@ -13,50 +33,201 @@ def _fix_persian_text_shape(text):
 
 def _post_process_svg(svg_code):
     processed_svg = svg_code.replace('<?xml version="1.0" encoding="UTF-8" standalone="no"?>', '')
-    processed_svg = svg_code.replace('width=', 'class="graph-svg" width=')
+    processed_svg = processed_svg.replace('width=', 'class="graph-svg" width=', 1)
     return mark_safe(processed_svg)
 
-def generate_process_graph(process, highlighted_step_id=None):
+# ===== سرویس رندر گراف: صف محدود با سقف هم‌زمانی و مهلت اجرا =====
+class GraphRenderBusy(Exception):
+    """صف رندر پر است و کار جدیدی پذیرفته نمی‌شود."""
+
+class GraphRenderPending(Exception):
+    """رندر هنوز تمام نشده است؛ نتیجه پس از اتمام در کش قرار می‌گیرد."""
+
+class GraphRenderFailed(Exception):
+    """رندر همین گراف به تازگی ناموفق بوده و تا پایان GRAPH_RENDER_FAILURE_TTL دوباره اجرا نمی‌شود."""
+
+_render_lock = threading.Lock()
+_render_executor = None
+_render_slots = None
+_render_jobs = {}
+
+def _get_render_executor():
+    """استخر رندر به صورت تنبل و پس از fork شدن پروسه وب ساخته می‌شود."""
+    global _render_executor, _render_slots
+    if _render_executor is None:
+        max_workers = getattr(settings, 'GRAPH_RENDER_MAX_WORKERS', 2)
+        queue_size = getattr(settings, 'GRAPH_RENDER_QUEUE_SIZE', 8)
+        _render_slots = threading.BoundedSemaphore(max_workers + queue_size)
+        _render_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='graph-render')
+    return _render_executor
+
+def _run_dot(source, engine):
+    """Graphviz را به صورت یک پروسه جدا اجرا می‌کند؛ با گذشتن مهلت، پروسه کشته می‌شود."""
+    timeout = getattr(settings, 'GRAPH_RENDER_TIMEOUT', 10)
+    with metrics.timed('graph_render_duration_seconds'):
+        result = subprocess.run([engine, '-Tsvg'], input=source.encode('utf-8'), capture_output=True, timeout=timeout)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.decode('utf-8', 'replace').strip())
+    return result.stdout.decode('utf-8')
+
+def _failure_key(cache_key):
+    return f"{cache_key}:failed"
+
+def _render_job(cache_key, source, engine, cache_timeout):
+    try:
+        svg_code = str(_post_process_svg(_run_dot(source, engine)))
+        cache.set(cache_key, svg_code, cache_timeout)
+        return svg_code
+    except Exception:
+        # شکست برای مدت کوتاهی به خاطر سپرده می‌شود تا هر بازدید، پروسه dot تازه‌ای در صف نگذارد
+        cache.set(_failure_key(cache_key), True, getattr(settings, 'GRAPH_RENDER_FAILURE_TTL', 60))
+        raise
+    finally:
+        with _render_lock:
+            _render_jobs.pop(cache_key, None)
+        _render_slots.release()
+
+def render_graph_svg(cache_key, build_dot, cache_timeout, wait=True):
     """
-    نسخه نهایی: استفاده از جدول HTML با تراز افقی و عمودی مشخص برای بهترین نتیجه.
+    SVG را از کش برمی‌گرداند یا اجرای dot را در صف رندر قرار می‌دهد.
+    build_dot در رشته خود درخواست اجرا می‌شود (چون به دیتابیس نیاز دارد) و فقط
+    اجرای Graphviz به صف می‌رود. درخواست‌های هم‌زمان برای یک کلید، منتظر همان کار می‌مانند.
+    با wait=False در صورت آماده نبودن نتیجه، None برمی‌گردد. اگر رندر همین کلید به تازگی ناموفق بوده،
+    بدون اجرای دوباره GraphRenderFailed داده می‌شود.
     """
+    cached = cache.get_many([cache_key, _failure_key(cache_key)])
+    svg_code = cached.get(cache_key)
+    if svg_code is not None:
+        return svg_code
+    if cached.get(_failure_key(cache_key)):
+        raise GraphRenderFailed()
+
+    with _render_lock:
+        future = _render_jobs.get(cache_key)
+
+    if future is None:
+        dot = build_dot()
+        if dot is None:
+            cache.set(cache_key, "", cache_timeout)
+            return ""
+        with _render_lock:
+            future = _render_jobs.get(cache_key)
+            if future is None:
+                executor = _get_render_executor()
+                if not _render_slots.acquire(blocking=False):
+                    raise GraphRenderBusy()
+                try:
+                    future = executor.submit(_render_job, cache_key, dot.source, dot.engine, cache_timeout)
+                except Exception:
+                    _render_slots.release()
+                    raise
+                _render_jobs[cache_key] = future
+
+    if not wait:
+        return future.result() if future.done() else None
     try:
-        dot = graphviz.Digraph(comment=process.name)
-        dot.attr('node', shape='box', style='rounded,filled', fontname='Vazirmatn')
-        dot.attr('edge', fontname='Vazirmatn')
-        dot.attr(rankdir='TB', splines='ortho')
+        return future.result(timeout=getattr(settings, 'GRAPH_RENDER_WAIT_TIMEOUT', 5))
+    except FutureTimeoutError:
+        raise GraphRenderPending()
+
+def _graph_render_error_message(error):
+    if isinstance(error, GraphRenderBusy):
+        return _fix_persian_text_shape("سرور در حال رسم گراف‌های دیگر است؛ لطفاً کمی بعد دوباره تلاش کنید.")
+    if isinstance(error, GraphRenderPending):
+        return _fix_persian_text_shape("گراف در حال آماده‌سازی است؛ لطفاً صفحه را دوباره بارگذاری کنید.")
+    if isinstance(error, GraphRenderFailed):
+        return _fix_persian_text_shape("گراف در حال حاضر در دسترس نیست؛ لطفاً چند دقیقه بعد دوباره تلاش کنید.")
+    return None
+
+# ===== کش نسخه‌دار گراف‌ها =====
+def _get_cache_version(key):
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+def _bump_cache_versions(keys):
+    # نسخه بر اساس زمان ساخته می‌شود تا با پاک شدن کلید از کش، نسخه قدیمی دوباره تولید نشود
+    if keys:
+        version = time.time_ns()
+        cache.set_many({key: version for key in keys}, None)
+
+def _process_graph_version_key(process_id):
+    return f"process_graph:version:{process_id}"
+
+def get_process_graph_version(process_id):
+    """نسخه فعلی مراحل یک فرایند را برمی‌گرداند (در صورت نبود، نسخه جدیدی می‌سازد)."""
+    return _get_cache_version(_process_graph_version_key(process_id))
+
+def bump_process_graph_version(*process_ids):
+    """با تغییر مراحل یا مسئولان، نسخه فرایند عوض می‌شود تا گراف قبلی دیگر استفاده نشود."""
+    _bump_cache_versions([_process_graph_version_key(pid) for pid in process_ids])
+
+def get_org_chart_version():
+    return _get_cache_version(ORG_CHART_VERSION_KEY)
+
+def bump_org_chart_version():
+    """با تغییر ساختار سازمانی (مدیر، نام یا گروه کاربران) چارت کش‌شده باطل می‌شود."""
+    _bump_cache_versions([ORG_CHART_VERSION_KEY])
+
+def get_manager_ids():
+    """
+    شناسه کاربرانی که حداقل یک زیردست دارند. یک کلید کش برای همه کاربران که با نسخه چارت سازمانی
+    (تغییر مدیر کاربران) باطل می‌شود؛ منوی صفحات بدون کوئری از آن استفاده می‌کند.
+    """
+    cache_key = f"org_chart:managers:{get_org_chart_version()}"
+    manager_ids = cache.get(cache_key)
+    if manager_ids is None:
+        manager_ids = set(User.objects.filter(manager__isnull=False).values_list('manager_id', flat=True).distinct())
+        cache.set(cache_key, manager_ids, ORG_CHART_CACHE_TIMEOUT)
+    return manager_ids
+
+def _highlight_svg_node(svg_code, step_id):
+    """کلاس highlighted را بدون اجرای دوباره Graphviz به گره مرحله فعلی اضافه می‌کند."""
+    if not step_id:
+        return svg_code
+    pattern = re.compile(r'(<g id="step-%d" class=")([^"]*)(")' % int(step_id))
+    return pattern.sub(r'\1\2 highlighted\3', svg_code, count=1)
+
+def _build_process_graph(process):
+    """
+    نسخه نهایی: استفاده از جدول HTML با تراز افقی و عمودی مشخص برای بهترین نتیجه.
+    گراف بدون هایلایت ساخته می‌شود تا برای همه مراحل قابل استفاده مجدد باشد.
+    """
+    dot = graphviz.Digraph(comment=process.name)
+    dot.attr('node', shape='box', style='rounded,filled', fontname='Vazirmatn')
+    dot.attr('edge', fontname='Vazirmatn')
+    dot.attr(rankdir='TB', splines='ortho')
+    
+    dot.graph_attr['class'] = 'graph-bg'
+    dot.node_attr['class'] = 'graph-node'
+    dot.edge_attr['class'] = 'graph-edge'
+    
+    steps = list(process.steps.select_related('default_responsible_user').order_by('step_order'))
+    if not steps:
+        return None
+
+    dot.node('start', _fix_persian_text_shape('شروع'), shape='ellipse', **{'class': 'graph-node start'})
+    dot.edge('start', str(steps[0].id))
+
+    for step in steps:
+        wrapped_name = textwrap.fill(step.name, width=25).split('\n')
+        processed_wrapped_name = '<BR/>'.join([_fix_persian_text_shape(line) for line in wrapped_name])
         
-        dot.graph_attr['class'] = 'graph-bg'
-        dot.node_attr['class'] = 'graph-node'
-        dot.edge_attr['class'] = 'graph-edge'
+        responsible_person_str = ""
+        if step.default_responsible_user:
+            responsible_person_str = (
+                step.default_responsible_user.get_full_name() or
+                step.default_responsible_user.username
+            )
+        else:
+            responsible_person_str = "مدیر مستقیم"
         
-        steps = process.steps.order_by('step_order')
-        if not steps:
-            return ""
+        processed_responsible_str = _fix_persian_text_shape(f"({responsible_person_str})")
 
-        dot.node('start', _fix_persian_text_shape('شروع'), shape='ellipse', **{'class': 'graph-node start'})
-        dot.edge('start', str(steps.first().id))
-
-        for step in steps:
-            node_class = 'graph-node'
-            if step.id == highlighted_step_id:
-                node_class += ' highlighted'
-            
-            wrapped_name = textwrap.fill(step.name, width=25).split('\n')
-            processed_wrapped_name = '<BR/>'.join([_fix_persian_text_shape(line) for line in wrapped_name])
-            
-            responsible_person_str = ""
-            if step.default_responsible_user:
-                responsible_person_str = (
-                    step.default_responsible_user.get_full_name() or
-                    step.default_responsible_user.username
-                )
-            else:
-                responsible_person_str = "مدیر مستقیم"
-            
-            processed_responsible_str = _fix_persian_text_shape(f"({responsible_person_str})")
-
-            node_label = f'''<
+        node_label = f'''<
 <TABLE BORDER="0" CELLBORDER="0" CELLSPACING="0">
   <TR>
     <TD ALIGN="CENTER" VALIGN="MIDDLE">
@@ -67,63 +238,185 @@ def generate_process_graph(process, highlighted_step_id=None):
   </TR>
 </TABLE>
 >'''
-            
-            dot.node(str(step.id), node_label, **{'class': node_class})
-
-        for i in range(len(steps) - 1):
-            dot.edge(str(steps[i].id), str(steps[i+1].id))
         
-        dot.node('end', _fix_persian_text_shape('پایان'), shape='ellipse', **{'class': 'graph-node end'})
-        dot.edge(str(steps.last().id), 'end')
+        # شناسه ثابت گره، امکان هایلایت کردن آن را در SVG کش‌شده فراهم می‌کند
+        dot.node(str(step.id), node_label, id=f"step-{step.id}", **{'class': 'graph-node'})
 
-        svg_code = dot.pipe(format='svg').decode('utf-8')
-        return _post_process_svg(svg_code)
+    for i in range(len(steps) - 1):
+        dot.edge(str(steps[i].id), str(steps[i+1].id))
+    
+    dot.node('end', _fix_persian_text_shape('پایان'), shape='ellipse', **{'class': 'graph-node end'})
+    dot.edge(str(steps[-1].id), 'end')
+    return dot
 
-    except Exception as e:
-        print(f"Error generating graph: {e}")
-        return _fix_persian_text_shape("خطا در تولید گراف.")
+def get_process_graph_svg(process, highlighted_step_id=None, wait=True):
+    """
+    گراف فرایند را یک بار برای هر نسخه از مراحل آن می‌سازد و در کش نگه می‌دارد؛
+    هایلایت مرحله فعلی فقط با یک جایگزینی متنی روی SVG کش‌شده اعمال می‌شود.
+    خطاهای صف رندر (GraphRenderBusy / GraphRenderPending) به فراخواننده می‌رسند.
+    """
+    cache_key = f"process_graph:svg:{process.id}:{get_process_graph_version(process.id)}"
+    svg_code = render_graph_svg(cache_key, lambda: _build_process_graph(process), PROCESS_GRAPH_CACHE_TIMEOUT, wait=wait)
+    if svg_code is None:
+        return None
+    if not svg_code:
+        return ""
+    return mark_safe(_highlight_svg_node(svg_code, highlighted_step_id))
+
+def process_graph_error(error):
+    """متن جایگزین گراف فرایند پس از خطای رندر؛ گراف دوباره رندر نمی‌شود."""
+    message = _graph_render_error_message(error)
+    if message:
+        return message
+    print(f"Error generating graph: {error}")
+    return _fix_persian_text_shape("خطا در تولید گراف.")
 
-def generate_org_chart_graph(root_users):
+def generate_process_graph(process, highlighted_step_id=None):
     try:
-        dot = graphviz.Digraph('OrgChart')
-        dot.attr('node', shape='box', style='rounded,filled', fontname='Vazirmatn')
-        dot.attr(rankdir='TB', splines='ortho')
-        
-        dot.graph_attr['class'] = 'graph-bg'
-        dot.node_attr['class'] = 'graph-node'
-        dot.edge_attr['class'] = 'graph-edge'
-        
-        all_users = set()
+        return get_process_graph_svg(process, highlighted_step_id)
+
+    except Exception as e:
+        return process_graph_error(e)
+
+def build_org_tree():
+    """
+    کل ساختار سازمانی را با دو کوئری (کاربران و گروه‌هایشان) بارگذاری می‌کند.
+    خروجی: (users_by_id, children_by_manager_id, root_ids) که children بر اساس شناسه مرتب است.
+    """
+    users = list(
+        User.objects.only('id', 'username', 'first_name', 'last_name', 'manager_id')
+        .prefetch_related(Prefetch('groups', queryset=Group.objects.only('id', 'name').order_by('id')))
+        .order_by('id')
+    )
+    users_by_id = {user.id: user for user in users}
+    children = {}
+    root_ids = []
+    for user in users:
+        if user.manager_id is None or user.manager_id not in users_by_id:
+            root_ids.append(user.id)
+        else:
+            children.setdefault(user.manager_id, []).append(user.id)
+    return users_by_id, children, root_ids
+
+def _first_group_name(user, default='کاربر'):
+    # گروه‌ها از قبل (prefetch) به ترتیب شناسه بارگذاری شده‌اند؛ معادل user.groups.first()
+    groups = user.groups.all()
+    return groups[0].name if groups else default
+
+def _build_org_chart_graph():
+    dot = graphviz.Digraph('OrgChart')
+    dot.attr('node', shape='box', style='rounded,filled', fontname='Vazirmatn')
+    dot.attr(rankdir='TB', splines='ortho')
+    
+    dot.graph_attr['class'] = 'graph-bg'
+    dot.node_attr['class'] = 'graph-node'
+    dot.edge_attr['class'] = 'graph-edge'
+    
+    users_by_id, children, root_ids = build_org_tree()
+    all_users = set()
+
+    # پیمایش غیربازگشتی تا سلسله‌مراتب‌های عمیق به محدودیت بازگشت پایتون برنخورند
+    stack = list(reversed(root_ids))
+    while stack:
+        user_id = stack.pop()
+        if user_id in all_users:
+            continue
+        user = users_by_id[user_id]
         
-        def add_user_and_subordinates(user):
-            if user.id in all_users: return
-            
-            full_name = _fix_persian_text_shape(user.get_full_name() or user.username)
-            group_name = _fix_persian_text_shape(user.groups.first().name if user.groups.exists() else 'کاربر')
+        full_name = _fix_persian_text_shape(user.get_full_name() or user.username)
+        group_name = _fix_persian_text_shape(_first_group_name(user))
 
-            user_label = f'''<
+        user_label = f'''<
 <TABLE BORDER="0" CELLBORDER="0" CELLSPACING="0">
     <TR><TD ALIGN="CENTER" VALIGN="MIDDLE">
     {full_name}<BR/><FONT POINT-SIZE="10">{group_name}</FONT>
     </TD></TR>
 </TABLE>>'''
-            
-            dot.node(str(user.id), user_label)
-            all_users.add(user.id)
-            
-            for subordinate in user.subordinates.all():
-                dot.edge(str(user.id), str(subordinate.id))
-                add_user_and_subordinates(subordinate)
+        
+        dot.node(str(user.id), user_label)
+        all_users.add(user.id)
+        
+        subordinate_ids = children.get(user.id, [])
+        for subordinate_id in subordinate_ids:
+            dot.edge(str(user.id), str(subordinate_id))
+        stack.extend(reversed(subordinate_ids))
+
+    if not all_users:
+        return None
+    return dot
 
-        for user in root_users:
-            add_user_and_subordinates(user)
+def get_org_chart_svg(wait=True):
+    cache_key = f"org_chart:svg:{get_org_chart_version()}"
+    svg_code = render_graph_svg(cache_key, _build_org_chart_graph, ORG_CHART_CACHE_TIMEOUT, wait=wait)
+    if svg_code is None:
+        return None
+    if not svg_code:
+        return _fix_persian_text_shape("هیچ کاربری برای نمایش در چارت سازمانی یافت نشد.")
+    return mark_safe(svg_code)
 
-        if not all_users:
-            return _fix_persian_text_shape("هیچ کاربری برای نمایش در چارت سازمانی یافت نشد.")
+# ===== چارت سازمانی درختی با بارگذاری تدریجی زیرمجموعه‌ها =====
+def _org_level_queryset():
+    """کاربران یک سطح به همراه تعداد زیردستان و گروه‌هایشان (دو کوئری برای هر سطح)."""
+    return (
+        User.objects.only('id', 'username', 'first_name', 'last_name', 'manager_id')
+        .annotate(subordinate_count=Count('subordinates'))
+        .prefetch_related(Prefetch('groups', queryset=Group.objects.only('id', 'name').order_by('id')))
+        .order_by('id')
+    )
 
-        svg_code = dot.pipe(format='svg').decode('utf-8')
-        return _post_process_svg(svg_code)
+def _org_node(user):
+    return {
+        'user': user,
+        'group_name': _first_group_name(user),
+        'subordinate_count': user.subordinate_count,
+        'children': None,
+    }
+
+def get_org_chart_levels(depth=ORG_CHART_INITIAL_DEPTH):
+    """
+    فقط depth سطح اول چارت سازمانی را بارگذاری می‌کند؛ گره‌هایی که زیردستانشان
+    بارگذاری نشده، children=None دارند و در صفحه با get_org_subordinates باز می‌شوند.
+    """
+    roots = [_org_node(user) for user in _org_level_queryset().filter(manager__isnull=True)]
+    level = roots
+    for _ in range(depth - 1):
+        parents = {node['user'].id: node for node in level if node['subordinate_count']}
+        if not parents:
+            break
+        level = []
+        for user in _org_level_queryset().filter(manager_id__in=parents.keys()):
+            node = _org_node(user)
+            parent = parents[user.manager_id]
+            if parent['children'] is None:
+                parent['children'] = []
+            parent['children'].append(node)
+            level.append(node)
+    return roots
+
+def get_org_subordinates(manager_id):
+    """زیردستان مستقیم یک کاربر را برای پاسخ JSON برمی‌گرداند."""
+    return [
+        {
+            'id': user.id,
+            'name': user.get_full_name() or user.username,
+            'group': _first_group_name(user),
+            'subordinate_count': user.subordinate_count,
+            'children_url': reverse('admin:user_org_chart_children', args=[user.id]),
+        }
+        for user in _org_level_queryset().filter(manager_id=manager_id)
+    ]
+
+def org_chart_graph_error(error):
+    """متن جایگزین چارت سازمانی پس از خطای رندر؛ چارت دوباره رندر نمی‌شود."""
+    message = _graph_render_error_message(error)
+    if message:
+        return message
+    print(f"Error generating org chart graph: {error}")
+    return _fix_persian_text_shape("خطا در تولید گراف چارت سازمانی.")
+
+def generate_org_chart_graph():
+    try:
+        return get_org_chart_svg()
 
     except Exception as e:
-        print(f"Error generating org chart graph: {e}")
-        return _fix_persian_text_shape("خطا در تولید گراف چارت سازمانی.")
\ No newline at end of file
+        return org_chart_graph_error(e)
@@ -1,28 +1,79 @@
 # core/views.py
 
+import asyncio
+import json
 import random
+from collections import Counter
 from django.shortcuts import render, redirect
+from django.template.loader import render_to_string
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
-from .models import User, Process, ProcessStep, Request, RequestHistory, Notification
-from django.core.mail import send_mail
+from .models import User, Process, ProcessStep, Request, RequestHistory, Notification, OutgoingEmail, DeadlineChange, UploadSession
 from django.conf import settings
 from django.contrib import messages
-from .utils import generate_process_graph
+from .pagination import keyset_page
+from .utils import get_process_graph_svg, process_graph_error, GraphRenderBusy, GraphRenderPending
 from django.urls import reverse
-from datetime import timedelta
+from datetime import date, timedelta
 from django.utils import timezone
-from django.http import JsonResponse
-from django.db.models import Q
-
-def update_request_due_date(request_obj):
-    """بر اساس مرحله فعلی درخواست، تاریخ سررسید آن را به‌روز می‌کند."""
-    if request_obj.current_step and request_obj.current_step.deadline_days is not None:
-        deadline_days = request_obj.current_step.deadline_days
-        request_obj.due_date = timezone.now() + timedelta(days=deadline_days)
-    else:
-        request_obj.due_date = None
-    request_obj.save(update_fields=['due_date'])
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_POST
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import F, Q
+from .mailer import enqueue_email
+from .process_definitions import get_process_definition
+from .analytics import default_report_range, step_report, user_report
+from .exports import EXPORT_FORMATS, astream_export, export_queryset, stream_export
+from .metrics import render_prometheus
+from .counters import adjust_counters, get_counters, move_open_task
+from .events import notification_broker
+from . import uploads
+
+def compute_due_date(step, now=None):
+    """سررسید درخواستی که اکنون وارد مرحله step (از تعریف کامپایل‌شده فرایند) می‌شود."""
+    if step and step.deadline_days is not None:
+        return (now or timezone.now()) + timedelta(days=step.deadline_days)
+    return None
+
+class TransitionConflict(Exception):
+    """درخواست پس از نمایش فرم (یا هم‌زمان) توسط کاربر دیگری تغییر کرده است."""
+
+def _transition_request(req, expected_version, step, assignee, status='IN_PROGRESS'):
+    """
+    انتقال درخواست به مرحله/مسئول/وضعیت جدید با یک UPDATE که فقط ستون‌های تغییرکرده را می‌نویسد
+    و به نسخه مورد انتظار مشروط است؛ اگر کاربر دیگری زودتر اقدام کرده باشد TransitionConflict می‌دهد.
+    باید داخل تراکنش فراخوانی شود تا تاریخچه و اعلان‌ها همراه آن ثبت یا برگردانده شوند. زمان انتقال در
+    req.updated_at قرار می‌گیرد و ردیف تاریخچه باید با همان زمان ثبت شود؛ سررسید از همین لحظه حساب
+    شده و recompute_due_dates هم آن را از زمان ثبت‌شده در تاریخچه بازسازی می‌کند.
+    """
+    now = timezone.now()
+    new_values = {
+        'status': status,
+        'current_step_id': step.id if step else None,
+        'current_assignee_id': assignee.id if assignee else None,
+        'due_date': compute_due_date(step, now),
+    }
+    changes = {field: value for field, value in new_values.items() if getattr(req, field) != value}
+    changes['updated_at'] = now
+    updated = Request.objects.filter(id=req.id, version=expected_version).update(version=F('version') + 1, **changes)
+    if not updated:
+        raise TransitionConflict
+
+    previous_assignee_id = req.current_assignee_id
+    for field, value in changes.items():
+        setattr(req, field, value)
+    req.current_assignee = assignee
+    req.version = expected_version + 1
+
+    # update() سیگنال‌ها را اجرا نمی‌کند؛ جدول تغییرات سررسید و شمارنده‌ها دستی به‌روز می‌شوند
+    if 'due_date' in changes or 'status' in changes:
+        DeadlineChange.objects.create(request_id=req.id, due_date=req.due_date)
+    move_open_task(previous_assignee_id, req.current_assignee_id)
+    if 'status' in changes:
+        adjust_counters(req.initiator_user_id, open_requests=1 if status == 'IN_PROGRESS' else -1)
+    return req
 
 def send_notification_email(request, recipient, request_obj, action_user, action_type_display, comments):
     if not recipient.email:
@@ -36,19 +87,29 @@ def send_notification_email(request, recipient, request_obj, action_user, action
 یک وظیفه جدید در کارتابل شما قرار گرفت.
 """
     # ... (بقیه متن ایمیل)
-    try:
-        send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [recipient.email], fail_silently=False)
-        print(f"ایمیل اطلاع رسانی با موفقیت به {recipient.email} ارسال شد.")
-    except Exception as e:
-        print(f"خطا در ارسال ایمیل به {recipient.email}: {e}")
+    # ایمیل فقط در صف خروجی ثبت می‌شود و دستور send_outbox آن را ارسال می‌کند
+    enqueue_email(recipient.email, subject, message)
+
+# حداکثر تعداد اعلان‌های برگشتی در هر پاسخ
+NOTIFICATION_FEED_LIMIT = 20
+
+def _notification_payload(notification):
+    return {'id': notification.id, 'message': notification.message, 'url': reverse('mark_notification_as_read', args=[notification.id])}
 
 def notify_user(request, recipient, request_obj, action_user, action_type_display, comments):
-    """یک اعلان درون‌برنامه‌ای ایجاد کرده و ایمیل اطلاع‌رسانی را ارسال می‌کند."""
+    """
+    یک اعلان درون‌برنامه‌ای ایجاد کرده و ایمیل اطلاع‌رسانی را در صف خروجی قرار می‌دهد.
+    داخل تراکنش تغییر گردش کار فراخوانی شود تا اعلان و ایمیل همراه با آن ثبت یا برگردانده شوند.
+    """
     if not recipient:
         return
     message = f"وظیفه جدید: درخواست #{request_obj.id} توسط {action_user.get_full_name()} برای شما ارسال شد."
-    Notification.objects.create(user=recipient, request=request_obj, message=message)
-    send_notification_email(request, recipient, request_obj, action_user, action_type_display, comments)
+    with transaction.atomic():
+        notification = Notification.objects.create(user=recipient, request=request_obj, message=message)
+        adjust_counters(recipient.id, unread_notifications=1, last_notification_id=notification.id)
+        send_notification_email(request, recipient, request_obj, action_user, action_type_display, comments)
+    payload = _notification_payload(notification)
+    transaction.on_commit(lambda: notification_broker.publish(recipient.id, payload))
 
 
 
@@ -68,18 +129,27 @@ def logout_view(request):
     logout(request)
     return redirect('login')
 
-@login_required
-def dashboard_view(request):
-    user = request.user
-    active_processes = Process.objects.filter(is_active=True)
+# پارامترهای جستجوی هر جدول داشبورد؛ با هر کدام از آن‌ها آمار کارت از کوئری فیلترشده شمرده می‌شود
+RECEIVED_FILTER_PARAMS = ('search_received_id', 'search_received_deadline')
+SENT_FILTER_PARAMS = ('search_sent_id', 'search_sent_process', 'search_sent_status')
 
-    received_requests_query = Request.objects.filter(current_assignee=user, status='IN_PROGRESS').select_related('process', 'initiator_user', 'current_step').order_by('-created_at')
-    sent_requests_query = Request.objects.filter(initiator_user=user).select_related('process', 'current_assignee', 'current_step').order_by('-created_at')
+def _dashboard_querysets(request):
+    """کوئری‌های کارتابل ورودی و درخواست‌های ارسالی را با اعمال فیلترهای جستجو می‌سازد."""
+    user = request.user
+    received_requests_query = Request.objects.filter(current_assignee=user, status='IN_PROGRESS').select_related('process', 'initiator_user', 'current_step').with_deadline_status()
+    sent_requests_query = Request.objects.filter(initiator_user=user).select_related('process', 'current_assignee', 'current_step')
 
     search_received_id = request.GET.get('search_received_id')
     if search_received_id and search_received_id.isdigit():
         received_requests_query = received_requests_query.filter(id=int(search_received_id))
 
+    # ===== فیلتر وضعیت سررسید (محاسبه‌شده در دیتابیس) =====
+    search_received_deadline = request.GET.get('search_received_deadline')
+    if search_received_deadline == 'overdue':
+        received_requests_query = received_requests_query.overdue()
+    elif search_received_deadline == 'urgent':
+        received_requests_query = received_requests_query.urgent()
+
     search_sent_id = request.GET.get('search_sent_id')
     search_sent_process = request.GET.get('search_sent_process')
     search_sent_status = request.GET.get('search_sent_status')
@@ -90,33 +160,317 @@ def dashboard_view(request):
         sent_requests_query = sent_requests_query.filter(process_id=int(search_sent_process))
     if search_sent_status:
         sent_requests_query = sent_requests_query.filter(status=search_sent_status)
-    
+
+    return received_requests_query, sent_requests_query
+
+def _received_ordering(request):
+    """ترتیب کارتابل ورودی: پیش‌فرض جدیدترین‌ها، یا نزدیک‌ترین سررسید."""
+    if request.GET.get('sort_received') == 'due_date':
+        return ('due_date', 'id')
+    return ('-created_at', '-id')
+
+def _dashboard_counts(request, received_requests_query, sent_requests_query):
+    """
+    آمار کارت‌های داشبورد بدون فیلتر از شمارنده‌های تجمیعی کاربر (یک جستجوی کلید اصلی) خوانده می‌شود؛
+    وقتی جستجویی روی جدولی فعال است، آمار همان جدول از کوئری فیلترشده شمرده می‌شود تا با فهرست بخواند.
+    """
+    received_filtered = any(request.GET.get(name) for name in RECEIVED_FILTER_PARAMS)
+    sent_filtered = any(request.GET.get(name) for name in SENT_FILTER_PARAMS)
+    counters = get_counters(request.user) if not (received_filtered and sent_filtered) else None
+    return {
+        'received_count': received_requests_query.count() if received_filtered else counters.open_tasks,
+        'in_progress_sent_count': (
+            sent_requests_query.filter(status='IN_PROGRESS').count() if sent_filtered else counters.open_requests
+        ),
+    }
+
+def _next_page_url(request, table, next_cursor):
+    if not next_cursor:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = next_cursor
+    return f"{reverse('dashboard_requests_page', args=[table])}?{params.urlencode()}"
+
+@login_required
+def dashboard_view(request):
+    active_processes = Process.objects.filter(is_active=True)
+
+    received_requests_query, sent_requests_query = _dashboard_querysets(request)
+    received_requests, received_next_cursor = keyset_page(received_requests_query, ordering=_received_ordering(request))
+    sent_requests, sent_next_cursor = keyset_page(sent_requests_query)
+
     context = {
         'active_processes': active_processes,
-        'received_requests': received_requests_query,
-        'sent_requests': sent_requests_query,
-        'received_count': received_requests_query.count(),
-        'in_progress_sent_count': sent_requests_query.filter(status='IN_PROGRESS').count(),
+        'received_requests': received_requests,
+        'sent_requests': sent_requests,
+        'received_next_url': _next_page_url(request, 'received', received_next_cursor),
+        'sent_next_url': _next_page_url(request, 'sent', sent_next_cursor),
         'search_values': request.GET
     }
+    context.update(_dashboard_counts(request, received_requests_query, sent_requests_query))
     return render(request, 'dashboard.html', context)
 
+@login_required
+def dashboard_requests_page(request, table):
+    """صفحه بعدی جداول داشبورد برای اسکرول بی‌پایان (ردیف‌های HTML + آدرس صفحه بعد)."""
+    received_requests_query, sent_requests_query = _dashboard_querysets(request)
+    if table == 'received':
+        queryset, template_name = received_requests_query, 'partials/received_request_rows.html'
+        ordering = _received_ordering(request)
+    elif table == 'sent':
+        queryset, template_name = sent_requests_query, 'partials/sent_request_rows.html'
+        ordering = ('-created_at', '-id')
+    else:
+        return JsonResponse({'error': 'جدول نامعتبر است.'}, status=404)
+
+    rows, next_cursor = keyset_page(queryset, request.GET.get('cursor'), ordering=ordering)
+    return JsonResponse({
+        'html': render_to_string(template_name, {'requests': rows}, request=request),
+        'next_url': _next_page_url(request, table, next_cursor),
+    })
+
+# ===== اقدام گروهی روی کارتابل ورودی =====
+BULK_ACTION_LIMIT = 500
+BULK_ACTION_TYPES = {'approve': 'APPROVED', 'reject': 'REJECTED', 'return': 'RETURNED'}
+
+def _bulk_transition(req, action, definition, now):
+    """
+    وضعیت جدید یک درخواست را برای اقدام گروهی محاسبه و روی نمونه اعمال می‌کند (بدون ذخیره).
+    خروجی: مسئول جدید (یا None برای درخواست‌های بسته‌شده)؛ در صورت عدم امکان، ValueError.
+    """
+    if action == 'approve':
+        next_step = definition.next_step(req.current_step_id)
+        if next_step:
+            next_assignee = definition.default_assignee(next_step) or req.initiator_user.manager
+            if not next_assignee:
+                raise ValueError("مدیر مستقیم برای ثبت‌کننده تعریف نشده است")
+            new_step, new_assignee = next_step, next_assignee
+        else:
+            req.status = 'APPROVED'
+            new_step, new_assignee = None, None
+    elif action == 'reject':
+        req.status = 'REJECTED'
+        new_step, new_assignee = None, None
+    else:
+        # بازگشت گروهی فقط به ثبت‌کننده (مرحله اول) ممکن است
+        new_step, new_assignee = definition.first_step, req.initiator_user
+
+    req.current_step_id = new_step.id if new_step else None
+    req.current_assignee = new_assignee
+    req.due_date = compute_due_date(new_step, now)
+    req.updated_at = now
+    req.version += 1
+    return new_assignee
+
+def _notify_bulk(request, recipient, requests, action_user):
+    """یک اعلان و یک ایمیل برای همه درخواست‌هایی که در یک اقدام گروهی به این کاربر رسیده‌اند."""
+    if len(requests) == 1:
+        message = f"وظیفه جدید: درخواست #{requests[0].id} توسط {action_user.get_full_name()} برای شما ارسال شد."
+    else:
+        message = f"وظیفه جدید: {len(requests)} درخواست توسط {action_user.get_full_name()} برای شما ارسال شد."
+    notification = Notification(user=recipient, request=requests[0], message=message)
+    email = None
+    if recipient.email:
+        lines = "\n".join(
+            f"- درخواست #{req.id}: {request.build_absolute_uri(reverse('request_detail', args=[req.id]))}"
+            for req in requests
+        )
+        email = OutgoingEmail(
+            to_email=recipient.email,
+            subject=f"وظیفه جدید در سیستم اتوماسیون: {len(requests)} درخواست",
+            body=f"""
+کاربر گرامی {recipient.get_full_name() or recipient.username}،
+
+درخواست‌های زیر در کارتابل شما قرار گرفت:
+
+{lines}
+""",
+        )
+    return notification, email
+
+@login_required
+@require_POST
+def bulk_request_action(request):
+    """
+    یک تصمیم (تایید، رد یا بازگشت به ثبت‌کننده) را در یک تراکنش روی چند درخواست کارتابل اعمال می‌کند:
+    تاریخچه و اعلان‌ها با bulk_create، درخواست‌ها با یک bulk_update و اعلان هر گیرنده به صورت تجمیعی.
+    """
+    action = request.POST.get('action')
+    comments = request.POST.get('comments', '').strip()
+    request_ids = [int(value) for value in request.POST.getlist('request_ids') if value.isdigit()][:BULK_ACTION_LIMIT]
+
+    if action not in BULK_ACTION_TYPES:
+        messages.error(request, "اقدام انتخاب‌شده نامعتبر است.")
+        return redirect('dashboard')
+    if not request_ids:
+        messages.warning(request, "هیچ درخواستی انتخاب نشده است.")
+        return redirect('dashboard')
+    if action == 'return' and not comments:
+        messages.error(request, "برای بازگرداندن درخواست، نوشتن توضیحات اجباری است.")
+        return redirect('dashboard')
+
+    now = timezone.now()
+    processed, skipped = [], []
+    notifications_sent = []
+    with transaction.atomic():
+        requests = list(
+            Request.objects.select_for_update(of=('self',))
+            .filter(id__in=request_ids, current_assignee=request.user, status='IN_PROGRESS')
+            .select_related('initiator_user__manager')
+            .order_by('id')
+        )
+        history = []
+        deadline_changes = []
+        by_recipient = {}
+        for req in requests:
+            definition = get_process_definition(req.process_id)
+            previous_step_id = req.current_step_id
+            try:
+                new_assignee = _bulk_transition(req, action, definition, now)
+            except ValueError as e:
+                skipped.append(f"#{req.id} ({e})")
+                continue
+            processed.append(req)
+            history.append(RequestHistory(
+                request=req, step_id=previous_step_id, to_step_id=req.current_step_id, action_user=request.user,
+                action_type=BULK_ACTION_TYPES[action], comments=comments, timestamp=now,
+            ))
+            deadline_changes.append(DeadlineChange(request_id=req.id, due_date=req.due_date))
+            if new_assignee:
+                by_recipient.setdefault(new_assignee.id, (new_assignee, []))[1].append(req)
+
+        if processed:
+            RequestHistory.objects.bulk_create(history)
+            Request.objects.bulk_update(processed, ['status', 'current_step', 'current_assignee', 'due_date', 'updated_at', 'version'])
+            DeadlineChange.objects.bulk_create(deadline_changes)
+
+            # شمارنده‌ها: همه موارد از کارتابل کاربر فعلی خارج و به کارتابل گیرندگان جدید وارد می‌شوند
+            adjust_counters(request.user.id, open_tasks=-len(processed))
+            notifications, emails = [], []
+            for recipient, recipient_requests in by_recipient.values():
+                adjust_counters(recipient.id, open_tasks=len(recipient_requests))
+                notification, email = _notify_bulk(request, recipient, recipient_requests, request.user)
+                notifications.append(notification)
+                if email:
+                    emails.append(email)
+            notifications = Notification.objects.bulk_create(notifications)
+            OutgoingEmail.objects.bulk_create(emails)
+            for notification in notifications:
+                adjust_counters(notification.user_id, unread_notifications=1, last_notification_id=notification.id)
+                notifications_sent.append((notification.user_id, _notification_payload(notification)))
+
+            # درخواست‌های بسته‌شده از «در حال پیگیری» ثبت‌کنندگانشان کم می‌شوند
+            closed_by_initiator = Counter(req.initiator_user_id for req in processed if req.status != 'IN_PROGRESS')
+            for initiator_id, closed in closed_by_initiator.items():
+                adjust_counters(initiator_id, open_requests=-closed)
+
+        transaction.on_commit(lambda: [notification_broker.publish(user_id, payload) for user_id, payload in notifications_sent])
+
+    if processed:
+        messages.success(request, f"اقدام روی {len(processed)} درخواست با موفقیت انجام شد.")
+    if skipped:
+        messages.error(request, "این درخواست‌ها انجام نشد: " + "، ".join(skipped))
+    ignored = len(request_ids) - len(processed) - len(skipped)
+    if ignored:
+        messages.warning(request, f"{ignored} درخواست دیگر در کارتابل شما نبود و نادیده گرفته شد.")
+    return redirect('dashboard')
+
+# ===== داشبورد آمار SLA مدیران (فقط از جداول تجمیعی خوانده می‌شود) =====
+ANALYTICS_RANGES = (7, 30, 90)
+
+@login_required
+def analytics_view(request):
+    user = request.user
+    subordinate_ids = list(user.subordinates.values_list('id', flat=True))
+    if not (user.is_staff or subordinate_ids):
+        messages.error(request, "این صفحه فقط برای مدیران در دسترس است.")
+        return redirect('dashboard')
+
+    days = request.GET.get('days', '')
+    days = int(days) if days.isdigit() and int(days) in ANALYTICS_RANGES else 30
+    start, end = default_report_range(days)
+    # مدیران غیر ادمین فقط آمار خود و زیرمجموعه‌های مستقیمشان را می‌بینند
+    user_ids = None if user.is_staff else subordinate_ids + [user.id]
+    context = {
+        'steps': step_report(start, end),
+        'users': user_report(start, end, user_ids),
+        'days': days,
+        'ranges': ANALYTICS_RANGES,
+        'start': start,
+        'end': end,
+    }
+    return render(request, 'analytics.html', context)
+
+@login_required
+def export_requests_view(request):
+    """
+    خروجی جریانی (CSV یا JSONL) درخواست‌ها به همراه تاریخچه برای حسابرسی؛ فقط برای ادمین‌ها.
+    زیر WSGI و ASGI هر دو، حافظه مستقل از اندازه خروجی است.
+    پارامترها: format, process, status, start, end (تاریخ به صورت YYYY-MM-DD).
+    """
+    if not request.user.is_staff:
+        return HttpResponse(status=403)
+
+    params = request.GET
+    export_format = params.get('format', 'csv')
+    status = params.get('status') or None
+    process = params.get('process', '')
+    try:
+        start = date.fromisoformat(params['start']) if params.get('start') else None
+        end = date.fromisoformat(params['end']) if params.get('end') else None
+    except ValueError:
+        return HttpResponse("تاریخ نامعتبر است (قالب YYYY-MM-DD).", status=400)
+    if export_format not in EXPORT_FORMATS or (process and not process.isdigit()) \
+            or (status and status not in dict(Request.STATUS_CHOICES)):
+        return HttpResponse("پارامترهای خروجی نامعتبر است.", status=400)
+
+    queryset = export_queryset(process_id=int(process) if process else None, status=status, start=start, end=end)
+    content_type = 'text/csv; charset=utf-8' if export_format == 'csv' else 'application/x-ndjson; charset=utf-8'
+    # زیر ASGI بدنه باید async باشد تا جریانی (و نه یک‌جا در حافظه) ارسال شود
+    stream = astream_export if isinstance(request, ASGIRequest) else stream_export
+    response = StreamingHttpResponse(stream(queryset, export_format), content_type=content_type)
+    filename = f"requests-{timezone.localdate():%Y%m%d}.{export_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    # جلوگیری از بافر شدن کل پاسخ در پراکسی معکوس
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def metrics_view(request):
+    """
+    متریک‌های همه پروسه‌ها در قالب متنی Prometheus.
+    دسترسی: توکن METRICS_TOKEN (در هدر Authorization) یا ورود ادمین؛ آدرس‌های METRICS_ALLOWED_IPS
+    فقط در صورت تنظیم صریح و بدون توکن پذیرفته می‌شوند.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    allowed = bool(token) and request.headers.get('Authorization', '') == f"Bearer {token}"
+    if not allowed:
+        allowed = request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', [])
+    if not (allowed or request.user.is_staff):
+        return HttpResponse(status=403)
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @login_required
 def create_request_view(request, process_id):
     process = Process.objects.get(id=process_id)
-    first_step = process.steps.order_by('step_order').first()
+    definition = get_process_definition(process.id)
+    first_step = definition.first_step
 
     if first_step:
-        assignee = first_step.default_responsible_user or request.user.manager
+        assignee = definition.default_assignee(first_step) or request.user.manager
         if assignee:
-            new_request = Request.objects.create(
-                process=process,
-                initiator_user=request.user,
-                current_step=first_step,
-                current_assignee=assignee
-            )
-            update_request_due_date(new_request)
-            notify_user(request, assignee, new_request, request.user, "ایجاد درخواست", "فرایند جدیدی برای شما ارسال شده است.")
+            now = timezone.now()
+            with transaction.atomic():
+                new_request = Request.objects.create(
+                    process=process,
+                    initiator_user=request.user,
+                    current_step_id=first_step.id,
+                    current_assignee=assignee,
+                    created_at=now,
+                    due_date=compute_due_date(first_step, now),
+                )
+                adjust_counters(assignee.id, open_tasks=1)
+                adjust_counters(request.user.id, open_requests=1)
+                notify_user(request, assignee, new_request, request.user, "ایجاد درخواست", "فرایند جدیدی برای شما ارسال شده است.")
             messages.success(request, f"فرایند '{process.name}' با موفقیت شروع شد.")
         else:
             messages.error(request, "ثبت درخواست ممکن نیست! مدیر مستقیم برای حساب کاربری شما تعریف نشده است. لطفاً با ادمین سیستم تماس بگیرید.")
@@ -126,7 +480,7 @@ def create_request_view(request, process_id):
 def request_detail_view(request, request_id):
     try:
         req = Request.objects.select_related(
-            'process', 'initiator_user', 'current_step', 'current_assignee'
+            'process', 'initiator_user__manager', 'current_step', 'current_assignee'
         ).get(id=request_id)
         
         if not (request.user == req.initiator_user or request.user == req.current_assignee):
@@ -136,157 +490,298 @@ def request_detail_view(request, request_id):
         messages.error(request, "درخواستی با این شناسه یافت نشد.")
         return redirect('dashboard')
 
-    returnable_steps = []
-    if req.status == 'IN_PROGRESS' and req.current_step:
-        returnable_steps = ProcessStep.objects.filter(
-            process=req.process,
-            step_order__lt=req.current_step.step_order
-        ).order_by('step_order')
-
-    process_graph_svg = generate_process_graph(req.process, req.current_step.id if req.current_step else None)
+    # مسیریابی (مرحله اول/بعدی/قبلی و مسئول پیش‌فرض) از تعریف کامپایل‌شده فرایند و بدون کوئری انجام می‌شود
+    definition = get_process_definition(req.process_id)
+    returnable_steps = ()
+    if req.status == 'IN_PROGRESS' and req.current_step_id:
+        returnable_steps = definition.previous_steps(req.current_step_id)
 
     if request.method == 'POST':
         comments = request.POST.get('comments', '').strip()
         action = request.POST.get('action')
         attachment_file = request.FILES.get('attachment')
-
-        if action == 'return':
-            if not comments:
-                messages.error(request, "برای بازگرداندن درخواست، نوشتن توضیحات اجباری است.")
-                return redirect('request_detail', request_id=req.id)
-            
-            return_target = request.POST.get('return_step_id')
-            if not return_target:
-                messages.error(request, "مقصد بازگشت انتخاب نشده است.")
+        # پیوست بزرگ از قبل با بارگذاری تکه‌ای (upload_start/upload_chunk) روی دیسک آماده شده است
+        assembled_upload = None
+        attachment_token = request.POST.get('attachment_token', '').strip()
+        if attachment_file is None and attachment_token:
+            assembled_upload = uploads.get_completed_upload(request.user, attachment_token)
+            if assembled_upload is None:
+                messages.error(request, "فایل پیوست یافت نشد یا بارگذاری آن کامل نشده است. لطفاً فایل را دوباره انتخاب کنید.")
                 return redirect('request_detail', request_id=req.id)
+            attachment_file = assembled_upload
+        # نسخه‌ای از درخواست که فرم بر اساس آن نمایش داده شده بود
+        posted_version = request.POST.get('version', '')
+        expected_version = int(posted_version) if posted_version.isdigit() else req.version
 
-            # ===== منطق جدید برای مدیریت هر دو نوع بازگشت =====
-            notification_message = ""
-            success_message = ""
-            
-            if return_target == 'initiator':
-                return_step = req.process.steps.order_by('step_order').first()
-                return_assignee = req.initiator_user
-                notification_message = "بازگردانده شد به ثبت کننده"
-                success_message = "درخواست با موفقیت به ثبت‌کننده بازگردانده شد."
-            
-            elif return_target.isdigit():
-                try:
-                    return_step = returnable_steps.get(id=int(return_target))
-                    return_assignee = return_step.default_responsible_user or req.initiator_user.manager
+        try:
+            if action in ('return', 'resubmit', 'approve', 'reject') and expected_version != req.version:
+                raise TransitionConflict
+
+            if action == 'return':
+                if not (request.user == req.current_assignee and req.status == 'IN_PROGRESS'):
+                    messages.error(request, "فقط مسئول فعلی درخواست می‌تواند آن را بازگرداند.")
+                    return redirect('request_detail', request_id=req.id)
+                if not comments:
+                    messages.error(request, "برای بازگرداندن درخواست، نوشتن توضیحات اجباری است.")
+                    return redirect('request_detail', request_id=req.id)
+                
+                return_target = request.POST.get('return_step_id')
+                if not return_target:
+                    messages.error(request, "مقصد بازگشت انتخاب نشده است.")
+                    return redirect('request_detail', request_id=req.id)
 
+                # ===== منطق جدید برای مدیریت هر دو نوع بازگشت =====
+                notification_message = ""
+                success_message = ""
+                
+                if return_target == 'initiator':
+                    return_step = definition.first_step
+                    return_assignee = req.initiator_user
+                    notification_message = "بازگردانده شد به ثبت کننده"
+                    success_message = "درخواست با موفقیت به ثبت‌کننده بازگردانده شد."
+                
+                elif return_target.isdigit():
+                    return_step = next((step for step in returnable_steps if step.id == int(return_target)), None)
+                    if return_step is None:
+                        messages.error(request, "مرحله انتخاب شده برای بازگشت معتبر نیست.")
+                        return redirect('request_detail', request_id=req.id)
+
+                    return_assignee = definition.default_assignee(return_step) or req.initiator_user.manager
                     if not return_assignee:
                         messages.error(request, f"کاربر مسئولی برای مرحله '{return_step.name}' یافت نشد.")
                         return redirect('request_detail', request_id=req.id)
                     
                     notification_message = f"بازگردانده شد به مرحله '{return_step.name}'"
                     success_message = f"درخواست با موفقیت به مرحله '{return_step.name}' بازگردانده شد."
-
-                except ProcessStep.DoesNotExist:
-                    messages.error(request, "مرحله انتخاب شده برای بازگشت معتبر نیست.")
+                else:
+                    messages.error(request, "مقصد بازگشت نامعتبر است.")
                     return redirect('request_detail', request_id=req.id)
-            else:
-                messages.error(request, "مقصد بازگشت نامعتبر است.")
-                return redirect('request_detail', request_id=req.id)
-
-            # بخش مشترک برای هر دو نوع بازگشت
-            RequestHistory.objects.create(request=req, step=req.current_step, action_user=request.user, action_type='RETURNED', comments=comments, attachment=attachment_file)
-            req.current_step = return_step
-            req.current_assignee = return_assignee
-            req.save()
-            
-            update_request_due_date(req)
-            notify_user(request, return_assignee, req, request.user, notification_message, comments)
-            messages.info(request, success_message)
-            return redirect('dashboard')
 
-        elif action == 'resubmit':
-            forward_assignee = req.current_step.default_responsible_user or req.initiator_user.manager
-            if forward_assignee:
-                RequestHistory.objects.create(request=req, step=req.current_step, action_user=request.user, action_type='RESUBMITTED', comments=comments, attachment=attachment_file)
-                req.current_assignee = forward_assignee
-                req.save()
-                
-                update_request_due_date(req)
-                notify_user(request, forward_assignee, req, request.user, "ارسال مجدد", comments)
-                messages.success(request, "درخواست شما مجدداً برای بررسی ارسال شد.")
-                return redirect('dashboard')
-            else:
-                messages.error(request, "ارسال مجدد ممکن نیست! مدیر مستقیم برای حساب کاربری شما تعریف نشده است.")
-        
-        elif action == 'comment':
-            if comments or attachment_file:
-                RequestHistory.objects.create(request=req, step=req.current_step, action_user=request.user, action_type='COMMENTED', comments=comments, attachment=attachment_file)
-                messages.success(request, "نظر/فایل شما با موفقیت ثبت شد.")
-            else:
-                messages.warning(request, "لطفاً متن نظر خود را وارد کنید یا فایلی را پیوست نمایید.")
-        
-        elif request.user == req.current_assignee:
-            if action == 'approve':
-                next_step = ProcessStep.objects.filter(process=req.process, step_order__gt=req.current_step.step_order).order_by('step_order').first()
-                RequestHistory.objects.create(request=req, step=req.current_step, action_user=request.user, action_type='APPROVED', comments=comments, attachment=attachment_file)
-                if next_step:
-                    next_assignee = next_step.default_responsible_user or req.initiator_user.manager
-                    if next_assignee:
-                        req.current_step = next_step
-                        req.current_assignee = next_assignee
-                        req.save()
-                        update_request_due_date(req)
-                        notify_user(request, next_assignee, req, request.user, "تایید و ارسال به مرحله بعد", comments)
-                        messages.success(request, f"درخواست #{req.id} با موفقیت به مرحله بعد ارسال شد.")
-                    else:
-                        messages.error(request, "ارسال ممکن نیست! مدیر مستقیم برای ثبت‌کننده تعریف نشده است.")
-                        return redirect('request_detail', request_id=req.id)
-                else: 
-                    req.status = 'APPROVED'
-                    req.current_assignee = None
-                    req.current_step = None
-                    req.due_date = None
-                    req.save()
-                    messages.success(request, f"فرایند برای درخواست #{req.id} با موفقیت تایید نهایی شد.")
+                # بخش مشترک برای هر دو نوع بازگشت
+                with transaction.atomic():
+                    current_step = req.current_step
+                    _transition_request(req, expected_version, return_step, return_assignee)
+                    RequestHistory.objects.create(request=req, step=current_step, action_user=request.user, action_type='RETURNED', to_step_id=req.current_step_id, comments=comments, attachment=attachment_file, timestamp=req.updated_at)
+                    notify_user(request, return_assignee, req, request.user, notification_message, comments)
+                messages.info(request, success_message)
                 return redirect('dashboard')
 
-            elif action == 'reject':
-                RequestHistory.objects.create(request=req, step=req.current_step, action_user=request.user, action_type='REJECTED', comments=comments, attachment=attachment_file)
-                req.status = 'REJECTED'
-                req.current_assignee = None
-                req.current_step = None
-                req.due_date = None
-                req.save()
-                messages.warning(request, f"درخواست #{req.id} توسط شما رد شد.")
-                return redirect('dashboard')
-        
+            elif action == 'resubmit':
+                # فقط درخواستی که به ثبت‌کننده بازگردانده شده و در کارتابل خود اوست دوباره ارسال می‌شود
+                if not (request.user == req.current_assignee == req.initiator_user and req.status == 'IN_PROGRESS'):
+                    messages.error(request, "ارسال مجدد فقط برای درخواستی که به شما بازگردانده شده ممکن است.")
+                    return redirect('request_detail', request_id=req.id)
+                current_step = definition.get_step(req.current_step_id)
+                forward_assignee = definition.default_assignee(current_step) or req.initiator_user.manager
+                if forward_assignee:
+                    with transaction.atomic():
+                        _transition_request(req, expected_version, current_step, forward_assignee)
+                        RequestHistory.objects.create(request=req, step_id=req.current_step_id, action_user=request.user, action_type='RESUBMITTED', to_step_id=req.current_step_id, comments=comments, attachment=attachment_file, timestamp=req.updated_at)
+                        notify_user(request, forward_assignee, req, request.user, "ارسال مجدد", comments)
+                    messages.success(request, "درخواست شما مجدداً برای بررسی ارسال شد.")
+                    return redirect('dashboard')
+                else:
+                    messages.error(request, "ارسال مجدد ممکن نیست! مدیر مستقیم برای حساب کاربری شما تعریف نشده است.")
+            
+            elif action == 'comment':
+                if comments or attachment_file:
+                    RequestHistory.objects.create(request=req, step=req.current_step, action_user=request.user, action_type='COMMENTED', comments=comments, attachment=attachment_file)
+                    messages.success(request, "نظر/فایل شما با موفقیت ثبت شد.")
+                else:
+                    messages.warning(request, "لطفاً متن نظر خود را وارد کنید یا فایلی را پیوست نمایید.")
+            
+            elif request.user == req.current_assignee:
+                if action == 'approve':
+                    next_step = definition.next_step(req.current_step_id)
+                    if next_step:
+                        next_assignee = definition.default_assignee(next_step) or req.initiator_user.manager
+                        if next_assignee:
+                            with transaction.atomic():
+                                current_step = req.current_step
+                                _transition_request(req, expected_version, next_step, next_assignee)
+                                RequestHistory.objects.create(request=req, step=current_step, action_user=request.user, action_type='APPROVED', to_step_id=req.current_step_id, comments=comments, attachment=attachment_file, timestamp=req.updated_at)
+                                notify_user(request, next_assignee, req, request.user, "تایید و ارسال به مرحله بعد", comments)
+                            messages.success(request, f"درخواست #{req.id} با موفقیت به مرحله بعد ارسال شد.")
+                        else:
+                            messages.error(request, "ارسال ممکن نیست! مدیر مستقیم برای ثبت‌کننده تعریف نشده است.")
+                            return redirect('request_detail', request_id=req.id)
+                    else: 
+                        with transaction.atomic():
+                            current_step = req.current_step
+                            _transition_request(req, expected_version, None, None, status='APPROVED')
+                            RequestHistory.objects.create(request=req, step=current_step, action_user=request.user, action_type='APPROVED', to_step_id=req.current_step_id, comments=comments, attachment=attachment_file, timestamp=req.updated_at)
+                        messages.success(request, f"فرایند برای درخواست #{req.id} با موفقیت تایید نهایی شد.")
+                    return redirect('dashboard')
+
+                elif action == 'reject':
+                    with transaction.atomic():
+                        current_step = req.current_step
+                        _transition_request(req, expected_version, None, None, status='REJECTED')
+                        RequestHistory.objects.create(request=req, step=current_step, action_user=request.user, action_type='REJECTED', to_step_id=req.current_step_id, comments=comments, attachment=attachment_file, timestamp=req.updated_at)
+                    messages.warning(request, f"درخواست #{req.id} توسط شما رد شد.")
+                    return redirect('dashboard')
+        except TransitionConflict:
+            messages.error(request, "این درخواست پس از باز کردن صفحه توسط کاربر دیگری تغییر کرده است. وضعیت جدید را بررسی و دوباره اقدام کنید.")
+        finally:
+            if assembled_upload is not None:
+                uploads.release_upload(assembled_upload)
         return redirect('request_detail', request_id=req.id)
 
-    history = req.history.all().order_by('timestamp')
+    # گراف فقط در صورت آماده بودن در کش درج می‌شود؛ در غیر این صورت رندر آن در صف
+    # قرار گرفته و صفحه آن را بعداً از request_graph_view دریافت می‌کند
+    try:
+        process_graph_svg = get_process_graph_svg(req.process, req.current_step_id, wait=False)
+    except Exception:
+        process_graph_svg = None
+
+    history = req.history.select_related('action_user').order_by('timestamp')
     context = {
         'req': req,
         'history': history,
         'process_graph_svg': process_graph_svg,
+        'process_graph_pending': process_graph_svg is None,
         'returnable_steps': returnable_steps,
     }
     return render(request, 'request_detail.html', context)
 
+@login_required
+def request_graph_view(request, request_id):
+    """SVG گراف فرایند را جدا از صفحه جزئیات برمی‌گرداند تا بارگذاری صفحه منتظر Graphviz نماند."""
+    try:
+        req = Request.objects.select_related('process').get(id=request_id)
+    except Request.DoesNotExist:
+        return HttpResponse(status=404)
+    if not (request.user.id == req.initiator_user_id or request.user.id == req.current_assignee_id):
+        return HttpResponse(status=403)
+
+    try:
+        svg_code = get_process_graph_svg(req.process, req.current_step_id)
+    except GraphRenderPending:
+        return HttpResponse(status=202, headers={'Retry-After': '2'})
+    except GraphRenderBusy:
+        return HttpResponse(status=503, headers={'Retry-After': '5'})
+    except Exception as e:
+        svg_code = process_graph_error(e)
+    return HttpResponse(svg_code, content_type='text/html; charset=utf-8')
+
+
+# ===== بارگذاری تکه‌ای پیوست‌ها =====
+# فایل در تکه‌های ATTACHMENT_CHUNK_SIZE با درخواست‌های کوتاه جدا ارسال می‌شود؛ هر تکه مستقیماً از
+# بدنه درخواست روی دیسک نوشته می‌شود و فرم اقدام فقط توکن بارگذاری کامل‌شده را می‌فرستد.
+@login_required
+@require_POST
+def upload_start(request):
+    size = request.POST.get('size', '')
+    try:
+        session = uploads.start_upload(request.user, request.POST.get('file_name'), int(size) if size.isdigit() else 0)
+    except uploads.UploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(uploads.session_state(session), status=201)
+
+@login_required
+def upload_chunk(request, token):
+    """GET وضعیت و offset فعلی؛ POST یک تکه با بدنه application/octet-stream و هدر Upload-Offset."""
+    try:
+        session = UploadSession.objects.get(id=token, user=request.user)
+    except UploadSession.DoesNotExist:
+        return JsonResponse({'error': "بارگذاری یافت نشد یا منقضی شده است."}, status=404)
+    if request.method == 'GET':
+        return JsonResponse(uploads.session_state(session))
+    if request.method != 'POST':
+        return HttpResponse(status=405)
+
+    offset = request.headers.get('Upload-Offset', '')
+    length = request.headers.get('Content-Length', '')
+    if not offset.isdigit() or not length.isdigit():
+        return JsonResponse({'error': "هدرهای Upload-Offset و Content-Length الزامی است."}, status=400)
+    try:
+        uploads.append_chunk(session, int(offset), request, int(length))
+    except uploads.UploadOffsetMismatch as e:
+        return JsonResponse({**uploads.session_state(session), 'offset': e.received, 'error': "offset نامعتبر است."}, status=409)
+    except uploads.UploadError as e:
+        return JsonResponse({**uploads.session_state(session), 'error': str(e)}, status=400)
+    return JsonResponse(uploads.session_state(session))
 
 @login_required
 def get_notifications(request):
-    notifications = Notification.objects.filter(user=request.user, is_read=False)
+    """
+    فید افزایشی اعلان‌ها: فقط اعلان‌های خوانده‌نشده با شناسه بزرگ‌تر از since برگردانده می‌شوند.
+    اگر وضعیت اعلان‌های خوانده‌نشده تغییری نکرده باشد، پاسخ 304 بدون بدنه داده می‌شود.
+    """
+    # وضعیت اعلان‌ها از شمارنده تجمیعی کاربر (یک جستجوی کلید اصلی) خوانده می‌شود
+    counters = get_counters(request.user)
+    etag = f'"{counters.last_notification_id}-{counters.unread_notifications}"'
+    # هدر به برچسب‌های جدا تجزیه و مقایسه دقیق (ضعیف، بدون W/) انجام می‌شود؛ نه جستجوی زیررشته
+    client_etags = [tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))]
+    if etag in client_etags:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    since = request.GET.get('since', '')
+    since = int(since) if since.isdigit() else 0
+    notifications = Notification.objects.filter(user=request.user, is_read=False, id__gt=since).order_by('-id')[:NOTIFICATION_FEED_LIMIT]
     data = {
-        'count': notifications.count(),
-        'notifications': [
-            {'id': n.id, 'message': n.message, 'url': reverse('mark_notification_as_read', args=[n.id])}
-            for n in notifications
-        ]
+        'count': counters.unread_notifications,
+        'last_id': counters.last_notification_id,
+        'notifications': [_notification_payload(n) for n in notifications]
     }
-    return JsonResponse(data)
+    response = JsonResponse(data)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
 
 @login_required
-def mark_notification_as_read(request, notification_id):
+@require_POST
+def mark_notifications_as_read(request):
+    """علامت‌گذاری گروهی اعلان‌ها (همه یا شناسه‌های مشخص) به عنوان خوانده‌شده با یک UPDATE."""
+    notifications = Notification.objects.filter(user=request.user, is_read=False)
+    if request.POST.get('all') != '1':
+        ids = [int(i) for i in request.POST.getlist('ids') if i.isdigit()]
+        notifications = notifications.filter(id__in=ids)
+    with transaction.atomic():
+        updated = notifications.update(is_read=True)
+        adjust_counters(request.user.id, unread_notifications=-updated)
+    return JsonResponse({'updated': updated})
+
+async def _notification_events(user_id):
+    subscription = notification_broker.subscribe(user_id)
+    heartbeat = getattr(settings, 'NOTIFICATION_STREAM_HEARTBEAT', 20)
     try:
-        notification = Notification.objects.get(id=notification_id, user=request.user)
-        notification.is_read = True
-        notification.save()
-        return redirect('request_detail', request_id=notification.request.id)
-    except Notification.DoesNotExist:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                payload = await asyncio.wait_for(subscription[1].get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                # پیام خالی برای زنده نگه داشتن اتصال از پشت پراکسی‌ها
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: notification\ndata: {json.dumps(payload)}\n\n"
+    finally:
+        notification_broker.unsubscribe(user_id, subscription)
+
+@login_required
+async def notification_stream(request):
+    """
+    جریان Server-Sent Events اعلان‌ها؛ فقط زیر ASGI (config/asgi.py) فعال است.
+    زیر WSGI پاسخ 204 داده می‌شود تا مرورگر دوباره وصل نشود و polling ادامه یابد.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    user = await request.auser()
+    response = StreamingHttpResponse(_notification_events(user.id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+def mark_notification_as_read(request, notification_id):
+    notifications = Notification.objects.filter(id=notification_id, user=request.user)
+    request_id = notifications.values_list('request_id', flat=True).first()
+    if request_id is None:
         messages.error(request, "اعلان مورد نظر یافت نشد.")
-        return redirect('dashboard')
\ No newline at end of file
+        return redirect('dashboard')
+    with transaction.atomic():
+        updated = notifications.filter(is_read=False).update(is_read=True)
+        adjust_counters(request.user.id, unread_notifications=-updated)
+    return redirect('request_detail', request_id=request_id)
\ No newline at end of file
@@ -0,0 +1,142 @@
+# core/workload.py
+
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+from .counters import rebuild_counters
+from .models import User, Process, ProcessStep, Request, RequestHistory, Notification
+
+@contextmanager
+def preserve_auto_timestamps(*fields):
+    """
+    auto_now_add را موقتاً غیرفعال می‌کند تا bulk_create زمان‌های داده‌شده را بازنویسی نکند.
+    فقط در دستورات مدیریتی (پروسه جدا) استفاده شود، نه در ویوها.
+    """
+    originals = [(field, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in originals:
+            field.auto_now_add = value
+
+def generate_workload(requests=10000, users=200, processes=5, steps_per_process=4, history_per_request=3,
+                      manager_fanout=4, batch_size=5000, seed=0, log=None):
+    """
+    یک مجموعه داده مصنوعی (کاربران با سلسله‌مراتب، فرایندها، درخواست‌ها، تاریخچه و اعلان‌ها)
+    با bulk_create می‌سازد و شمارش ردیف‌های ساخته‌شده را برمی‌گرداند.
+    سلسله‌مراتب درختی است که هر مدیر حداکثر manager_fanout زیرمجموعه مستقیم دارد (عمق log n)؛
+    مسئول هر درخواست مثل ویوها مسئول پیش‌فرض مرحله یا مدیر ثبت‌کننده است.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    log = log or (lambda message: None)
+    prefix = f"wl{seed}_{int(now.timestamp())}"
+
+    with transaction.atomic():
+        created_users = User.objects.bulk_create(
+            [
+                User(username=f"{prefix}_u{i}", first_name=f"کاربر {i}", email=f"{prefix}_u{i}@example.com", password='!')
+                for i in range(users)
+            ],
+            batch_size=batch_size,
+        )
+        # هر کاربر (به جز ریشه) مدیری از سطح بالاتر درخت دارد
+        for index, user in enumerate(created_users[1:], start=1):
+            user.manager_id = created_users[(index - 1) // manager_fanout].id
+        User.objects.bulk_update(created_users, ['manager'], batch_size=batch_size)
+
+        created_processes = Process.objects.bulk_create(
+            [Process(name=f"{prefix} فرایند {i}") for i in range(processes)]
+        )
+        created_steps = ProcessStep.objects.bulk_create([
+            ProcessStep(
+                process=process, name=f"مرحله {order}", step_order=order, responsible_unit='واحد',
+                default_responsible_user=rng.choice(created_users) if rng.random() < 0.5 else None,
+                deadline_days=rng.randint(1, 7),
+            )
+            for process in created_processes for order in range(1, steps_per_process + 1)
+        ])
+    log(f"{len(created_users)} کاربر، {len(created_processes)} فرایند و {len(created_steps)} مرحله ساخته شد.")
+
+    users_by_id = {user.id: user for user in created_users}
+    steps_by_process = {}
+    for step in created_steps:
+        steps_by_process.setdefault(step.process_id, []).append(step)
+
+    counts = {'users': len(created_users), 'processes': len(created_processes), 'requests': 0, 'history': 0, 'notifications': 0}
+    notification_created_field = Notification._meta.get_field('created_at')
+
+    for start in range(0, requests, batch_size):
+        size = min(batch_size, requests - start)
+        batch = []
+        for _ in range(size):
+            process = rng.choice(created_processes)
+            steps = steps_by_process[process.id]
+            status = rng.choices(['IN_PROGRESS', 'APPROVED', 'REJECTED'], weights=[6, 3, 1])[0]
+            created_at = now - timedelta(minutes=rng.randrange(60 * 24 * 730))
+            step = rng.choice(steps) if status == 'IN_PROGRESS' else None
+            initiator = rng.choice(created_users)
+            assignee = None
+            if step:
+                assignee_id = step.default_responsible_user_id or initiator.manager_id
+                assignee = users_by_id[assignee_id] if assignee_id else rng.choice(created_users)
+            batch.append(Request(
+                process=process,
+                initiator_user=initiator,
+                current_step=step,
+                current_assignee=assignee,
+                status=status,
+                created_at=created_at,
+                due_date=created_at + timedelta(days=step.deadline_days) if step else None,
+            ))
+
+        with transaction.atomic(), preserve_auto_timestamps(notification_created_field):
+            batch = Request.objects.bulk_create(batch)
+            history = []
+            notifications = []
+            for req in batch:
+                steps = steps_by_process[req.process_id]
+                for offset in range(history_per_request):
+                    # تاریخچه مسیر مراحل را به ترتیب طی می‌کند؛ نظرها درخواست را جابه‌جا نمی‌کنند
+                    step = steps[min(offset, len(steps) - 1)]
+                    action_type = rng.choices(['APPROVED', 'COMMENTED', 'RETURNED', 'RESUBMITTED'], weights=[5, 3, 1, 1])[0]
+                    if action_type == 'COMMENTED':
+                        to_step = None
+                    elif action_type == 'RETURNED':
+                        to_step = steps[0]
+                    elif action_type == 'RESUBMITTED':
+                        to_step = step
+                    else:
+                        to_step = steps[offset + 1] if offset + 1 < len(steps) else None
+                    history.append(RequestHistory(
+                        request=req,
+                        step=step,
+                        to_step=to_step,
+                        action_user=rng.choice(created_users),
+                        action_type=action_type,
+                        timestamp=req.created_at + timedelta(hours=offset + 1),
+                        comments='توضیحات آزمایشی',
+                    ))
+                if req.current_assignee_id:
+                    notifications.append(Notification(
+                        user_id=req.current_assignee_id,
+                        request=req,
+                        message=f"وظیفه جدید: درخواست #{req.id}",
+                        is_read=rng.random() < 0.8,
+                        created_at=req.created_at,
+                    ))
+            RequestHistory.objects.bulk_create(history, batch_size=batch_size)
+            Notification.objects.bulk_create(notifications, batch_size=batch_size)
+
+        counts['requests'] += len(batch)
+        counts['history'] += len(history)
+        counts['notifications'] += len(notifications)
+        log(f"{counts['requests']} از {requests} درخواست ساخته شد.")
+
+    # bulk_create از مسیر ویوها عبور نمی‌کند؛ شمارنده‌های کاربران ساخته‌شده از روی داده محاسبه می‌شوند
+    rebuild_counters([user.id for user in created_users], batch_size=batch_size)
+    return counts